@@ -0,0 +1,606 @@
+"""Бенчмарки методов усреднения pixelate.py.
+
+Каждый метод - отдельный бенчмарк на синтетическом изображении:
+    python benchmark.py --size 1920x1080 --block 5 aocs-hsv gray-lab-l
+    python benchmark.py --compare       # сравнить с поблочным движком
+    python benchmark.py --startup       # время запуска и ленивые импорты
+    python benchmark.py --bright 30     # цена --bright: прежний HSV-путь и таблица
+    python benchmark.py --resize-check  # --resample fast против LANCZOS + пикселизации
+    python benchmark.py --median-check  # медиана по гистограмме против np.median
+    python benchmark.py --out-check     # холст в out= (pixelate_async, --workers) против обычного
+    python benchmark.py --server-check  # статусы HTTP-сервера на корректные и враждебные запросы
+    python benchmark.py --video 60 --size 1920x1080   # кадры в секунду: покадрово и с переиспользованием блоков
+    python benchmark.py --async 16 --workers 2         # задержка цикла событий: блокирующий вызов и pixelate_async
+    python benchmark.py --suite --save-baseline base.json   # полный набор, сохранить базу
+    python benchmark.py --suite --baseline base.json        # сравнить с базой
+
+--suite прогоняет process_image целиком (декодирование PNG, пикселизация,
+запись) на синтетических изображениях нескольких размеров: каждый метод с
+каждым размером блока, а также каждый формат --matrix-json и --matrix-txt.
+Для каждого случая записываются лучшее время, время этапов (pixelate_profile),
+пропускная способность и пик памяти. С --baseline случаи сравниваются с
+сохранённой базой, и скрипт завершается с кодом 1, если время или пик
+памяти выросли больше чем на --threshold процентов.
+
+--startup запускает свежие интерпретаторы: `import pixelate` и
+`pixelate.py --help` должны уложиться в --startup-budget, а OpenCV и
+scikit-learn не должны загружаться, пока не выбран метод, которому они
+нужны. При нарушении бюджета скрипт завершается с кодом 1.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from functools import partial
+
+import numpy as np
+from PIL import Image
+
+import pixelate
+import pixelate_engine
+import pixelate_profile
+from pixelate_json import MATRIX_TYPES
+
+METHODS = pixelate.COLOR_METHODS + pixelate.GRAYSCALE_METHODS + pixelate.BLACK_WHITE_METHODS
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pixelate.py')
+
+# Тяжёлые зависимости, которые грузятся только по требованию
+HEAVY_MODULES = ('cv2', 'sklearn', 'scipy')
+
+# Код для свежего интерпретатора и тяжёлые модули, которые ему разрешено загрузить
+STARTUP_CHECKS = [
+    ('import pixelate', 'import pixelate', ()),
+    ('pixelate.py --help', f"import runpy, sys; sys.argv = [{SCRIPT!r}, '--help']; "
+                           f"runpy.run_path({SCRIPT!r}, run_name='__main__')", ()),
+    ('meav run', 'from PIL import Image; import pixelate; '
+                 'pixelate.pixelate_image(Image.new("RGB", (64, 64)), 8, 8)', ()),
+    ('aocs-hsv run', 'from PIL import Image; import pixelate; '
+                     'pixelate.pixelate_image(Image.new("RGB", (64, 64)), 8, 8, "aocs-hsv")', ('cv2',)),
+]
+
+
+def method_mode(method):
+    """Режим, в котором метод применяется из командной строки"""
+    if method in pixelate.GRAYSCALE_METHODS:
+        return 'grayscale'
+    if method in pixelate.BLACK_WHITE_METHODS:
+        return 'black-white'
+    return 'color'
+
+
+def synthetic_image(width, height, seed=0):
+    """Градиент с шумом: детерминированный и не слишком однородный"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // max(width - 1, 1),
+                     y * 255 // max(height - 1, 1),
+                     (x + y) * 255 // max(width + height - 2, 1)], axis=-1)
+    noise = rng.integers(-40, 41, size=base.shape)
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8), 'RGB')
+
+
+def time_call(func, repeat):
+    """Лучшее время из repeat запусков"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_method(image, method, block, repeat, compare):
+    mode = method_mode(method)
+    result = {'method': method,
+              'vector': time_call(lambda: pixelate.pixelate_image(image, block, block, method, mode), repeat)}
+    if compare:
+        result['block'] = time_call(
+            lambda: pixelate.pixelate_image(image, block, block, method, mode, 'block'), 1)
+    return result
+
+
+def hsv_brightness(image, brightness):
+    """Прежняя реализация --bright через HSV, для сравнения"""
+    h, s, v = image.convert('HSV').split()
+    v = v.point(lambda x: min(255, max(0, x + brightness)))
+    return Image.merge('HSV', (h, s, v)).convert('RGB')
+
+
+def bench_brightness(image, brightness, block, repeat):
+    """Время пикселизации без яркости, с прежней HSV-яркостью и с табличной"""
+    def run(adjust):
+        return lambda: pixelate.pixelate_grid(adjust(image), block, block)
+    return {'pixelate': time_call(run(lambda im: im), repeat),
+            'hsv': time_call(run(lambda im: hsv_brightness(im, brightness)), repeat),
+            'lut': time_call(run(lambda im: pixelate.apply_brightness(im, brightness)), repeat)}
+
+
+# Методы и уменьшения (zoom) для --resize-check
+RESIZE_METHODS = ('amac', 'meav', 'gray-wav', 'bin-tc', 'aocs-hsv')
+RESIZE_ZOOMS = (-1, -3, -7)
+
+
+def jpeg_copy(image, quality=90):
+    """То же изображение, открытое из JPEG: для проверки draft"""
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    buffer.seek(0)
+    return Image.open(buffer)
+
+
+def resize_pair(image, source_format, zoom, method, block):
+    """Сетки двухэтапного пути (LANCZOS, затем блоки) и --resample fast с их временем"""
+    mode = method_mode(method)
+    results = {}
+    for resample in pixelate.RESAMPLE_MODES:
+        source = jpeg_copy(image) if source_format == 'jpeg' else image.copy()
+        start = time.perf_counter()
+        size = pixelate.resized_size(source.size, zoom=zoom)
+        if resample == 'fast' and pixelate.area_supported(source, size, method):
+            grid = pixelate.area_grid(source, size, block, block, method)
+        else:
+            resized = pixelate.resize_image(source, zoom=zoom, resample=resample)
+            grid = pixelate.pixelate_grid(resized, block, block, method, mode)
+        results[resample] = (grid.colors, time.perf_counter() - start)
+    return results
+
+
+def check_resize(image, block, tolerance):
+    """Расхождение --resample fast с LANCZOS в % шкалы; False, если больше tolerance"""
+    ok = True
+    for source_format in ('raw', 'jpeg'):
+        for zoom in RESIZE_ZOOMS:
+            for method in RESIZE_METHODS:
+                results = resize_pair(image, source_format, zoom, method, block)
+                (exact, exact_time), (fast, fast_time) = results['lanczos'], results['fast']
+                error = np.abs(exact.astype(int) - fast).mean() / 255 * 100
+                line = (f"{source_format:<5} zoom {zoom:>3} {method:<9} error {error:6.3f}%   "
+                        f"lanczos {exact_time:7.3f}s   fast {fast_time:7.3f}s   x{exact_time / fast_time:.1f}")
+                if error > tolerance:
+                    line += f"   over tolerance {tolerance}%"
+                    ok = False
+                print(line)
+    return ok
+
+
+# Размеры блоков для --median-check: чётное и нечётное число значений,
+# неполные блоки по краям
+MEDIAN_BLOCKS = (3, 4, 5, 8, 15, 16, 32, 33, 64)
+
+
+def numpy_median_reducers():
+    """Прежние пакетные meav и gray-mb через np.median, для сравнения"""
+    def meav(blocks):
+        rows, cols = blocks.shape[:2]
+        return np.median(blocks.reshape(rows, cols, -1, blocks.shape[4]), axis=2).astype(int)
+
+    def gray_mb(blocks):
+        rows, cols = blocks.shape[:2]
+        return np.median(blocks.reshape(rows, cols, -1), axis=2)
+    return {'meav': meav, 'gray-mb': gray_mb}
+
+
+def check_median(image, repeat):
+    """Сравнивает медиану pixelate_median с np.median: результат и время; False при расхождении"""
+    arr = pixelate_engine.image_to_array(image)
+    ok = True
+    for method, reference in numpy_median_reducers().items():
+        for block in MEDIAN_BLOCKS:
+            expected = pixelate_engine.block_grid(arr, block, block, method, reducer=reference)
+            actual = pixelate_engine.block_grid(arr, block, block, method)
+            same = np.array_equal(expected, actual)
+            ok &= same
+            old = time_call(lambda: pixelate_engine.block_grid(arr, block, block, method, reducer=reference), repeat)
+            new = time_call(lambda: pixelate_engine.block_grid(arr, block, block, method), repeat)
+            print(f"{method:<8} block {block:>3}   np.median {old:7.3f}s   histogram {new:7.3f}s   "
+                  f"x{old / new:4.1f}   {'same' if same else 'DIFFERENT'}")
+    return ok
+
+
+def moving_frames(image, count):
+    """Кадры: неподвижный фон и движущийся квадрат в четверть высоты"""
+    background = np.asarray(image)
+    height, width = background.shape[:2]
+    side = height // 4
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        x = i * (width - side) // max(1, count - 1)
+        frame[height // 3:height // 3 + side, x:x + side] = (220, 40, 40)
+        frames.append(frame)
+    return frames
+
+
+def bench_video(image, count, block):
+    """Кадры в секунду: пикселизация каждого кадра целиком и TemporalPixelator с порогом 0"""
+    from pixelate_video import TemporalPixelator
+    frames = moving_frames(image, count)
+    grid_function = partial(pixelate.compute_grid, method='meav')
+    start = time.perf_counter()
+    for frame in frames:
+        pixelate_engine.upsample_grid(grid_function(frame, block, block), block, block, *image.size)
+    full = time.perf_counter() - start
+    pixelator = TemporalPixelator(block, block, grid_function, threshold=0)
+    start = time.perf_counter()
+    for frame in frames:
+        pixelator.process(frame)
+    temporal = time.perf_counter() - start
+    return {'full': count / full, 'temporal': count / temporal, 'recomputed': pixelator.recomputed / pixelator.blocks}
+
+
+# Запросы для --server-check: (описание, строка запроса, Content-Length или
+# None - длина тела, ожидаемый статус). {escape} - путь вне временного
+# каталога сервера, который не должен появиться
+SERVER_CHECKS = [
+    ('plain upload', 'point-w=8', None, 200),
+    ('registered out-type', 'point-w=8&out-type=jpg', None, 200),
+    ('unknown out-type', 'out-type=xyz', None, 400),
+    ('out-type path traversal', 'out-type=png/../../../{escape}', None, 400),
+    ('forbidden option', 'out-name=x', None, 400),
+    ('non-numeric Content-Length', '', 'abc', 400),
+    ('negative Content-Length', '', '-5', 400),
+    ('zero Content-Length', '', '0', 411),
+    ('oversized Content-Length', '', str(1 << 40), 413),
+]
+
+
+def check_server(image):
+    """Прогоняет SERVER_CHECKS через PixelateServer; False при неожиданном статусе или файле вне сервера"""
+    import http.client
+    import threading
+    from urllib.parse import quote
+    from pixelate_server import PixelateServer
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    body = buffer.getvalue()
+    server = PixelateServer(('127.0.0.1', 0), workers=1, backend='thread')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ok = True
+    try:
+        with tempfile.TemporaryDirectory(prefix='pixelate-check-') as directory:
+            escape = os.path.join(directory, 'escaped', 'escaped.png').lstrip(os.sep)
+            for name, query, length, expected in SERVER_CHECKS:
+                headers = {'Content-Length': length} if length is not None else {}
+                connection = http.client.HTTPConnection(*server.server_address, timeout=60)
+                connection.request('POST', '/pixelate?' + query.format(escape=quote(escape)),
+                                   body if length is None else b'', headers)
+                status = connection.getresponse().status
+                connection.close()
+                escaped = os.path.exists(os.path.join(directory, 'escaped'))
+                passed = status == expected and not escaped
+                ok &= passed
+                print(f"{name:<28} {status} (expected {expected}){'   WROTE OUTSIDE' if escaped else ''}"
+                      f"   {'ok' if passed else 'FAILED'}")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return ok
+
+
+# Шаг таймера, по опозданию которого меряется задержка цикла событий
+LOOP_TICK = 0.005
+
+
+def bench_async(image, requests, workers, block):
+    """Время requests запросов (JPEG в памяти) и наибольшая задержка цикла событий, с.
+
+    'blocking' - render_buffers прямо в корутине, как без асинхронного API;
+    'async' - те же запросы через AsyncPixelator.
+    """
+    import asyncio
+    from pixelate_async import AsyncPixelator, parse_options, render_buffers
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    data = buffer.getvalue()
+    options = {'point-w': block, 'point-h': block}
+
+    async def measure(call):
+        lag, done = 0.0, asyncio.Event()
+
+        async def ticker():
+            nonlocal lag
+            while not done.is_set():
+                start = time.perf_counter()
+                await asyncio.sleep(LOOP_TICK)
+                lag = max(lag, time.perf_counter() - start - LOOP_TICK)
+
+        task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        await asyncio.gather(*(call() for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await task
+        return {'time': elapsed, 'lag': lag}
+
+    async def blocking():
+        return render_buffers(data, parse_options(options))
+
+    async def run():
+        async with AsyncPixelator(workers) as pixelator:
+            await pixelator.pixelate(data, options)  # прогрев потоков и ленивых импортов
+            return {'blocking': await measure(blocking),
+                    'async': await measure(lambda: pixelator.pixelate(data, options))}
+
+    return asyncio.run(run())
+
+
+def check_out(image, block):
+    """to_array(out) и AsyncPixelator с out= против обычного холста; False при расхождении"""
+    import asyncio
+    from pixelate_async import AsyncPixelator, parse_options
+    ok = True
+    for workers in (1, 2):
+        grid = pixelate.pixelate_grid(image, block, block, workers=workers)
+        out = np.zeros((image.height, image.width, 3), dtype=np.uint8)
+        same = grid.to_array(out) is out and np.array_equal(out, grid.to_array())
+        ok &= same
+        print(f"to_array(out) workers {workers}   {'same' if same else 'DIFFERENT'}")
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+
+    async def run():
+        async with AsyncPixelator(1) as pixelator:
+            options = {'point-w': block, 'point-h': block}
+            encoded = await pixelator.pixelate(buffer.getvalue(), options)
+            out = np.zeros((encoded.height, encoded.width, 3), dtype=np.uint8)
+            await pixelator.pixelate(buffer.getvalue(), options, out=out)
+            return np.array_equal(out, np.asarray(Image.open(io.BytesIO(encoded.data)).convert('RGB')))
+
+    same = asyncio.run(run())
+    ok &= same
+    print(f"AsyncPixelator out=      {'same' if same else 'DIFFERENT'}")
+    try:
+        parse_options({'workers': 2})
+        rejected = False
+    except ValueError:
+        rejected = True
+    ok &= rejected
+    print(f"async workers option     {'rejected' if rejected else 'ACCEPTED'}")
+    return ok
+
+
+def startup_run(code):
+    """Время выполнения кода в свежем интерпретаторе и загруженные им тяжёлые модули"""
+    report = ("import atexit, sys; atexit.register(lambda: print('HEAVY', "
+              f"*[m for m in {HEAVY_MODULES!r} if m in sys.modules], file=sys.stderr))")
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-W', 'ignore', '-c', f"{report}\n{code}"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                            cwd=os.path.dirname(SCRIPT))
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{code} failed:\n{result.stderr}")
+    return elapsed, set(result.stderr.rsplit('HEAVY', 1)[-1].split())
+
+
+def check_startup(budget, repeat):
+    """Печатает время запуска; False, если бюджет превышен или загружено лишнее"""
+    ok = True
+    for name, code, allowed in STARTUP_CHECKS:
+        runs = [startup_run(code) for _ in range(repeat)]
+        best = min(elapsed for elapsed, _ in runs)
+        extra = sorted(runs[0][1] - set(allowed))
+        line = f"{name:<20} {best * 1000:8.1f} ms"
+        if not allowed and best > budget / 1000:
+            line += f"   over budget {budget:.0f} ms"
+            ok = False
+        if extra:
+            line += f"   loaded {', '.join(extra)}"
+            ok = False
+        print(line)
+    return ok
+
+
+# Размеры изображений и блоков --suite по умолчанию
+SUITE_SIZES = ((320, 240), (1280, 720))
+SUITE_BLOCKS = (5, 10, 20)
+# Метод и блок для случаев с форматами матриц
+FORMAT_METHOD = 'meav'
+FORMAT_BLOCK = 10
+
+
+def suite_cases(methods, sizes, blocks):
+    """[(имя случая, размер, аргументы командной строки)] набора --suite"""
+    cases = []
+    for width, height in sizes:
+        size = f"{width}x{height}"
+        for method in methods:
+            for block in blocks:
+                cases.append((f"method/{method}/{size}/b{block}", (width, height),
+                              ['--averating', method, f"--mode-{method_mode(method)}",
+                               '--point-w', str(block), '--point-h', str(block)]))
+        block_args = ['--averating', FORMAT_METHOD, '--point-w', str(FORMAT_BLOCK), '--point-h', str(FORMAT_BLOCK)]
+        for matrix_type in MATRIX_TYPES:
+            cases.append((f"json/{matrix_type}/{size}", (width, height), block_args + ['--matrix-json', matrix_type]))
+        for matrix_type in pixelate.TXT_TYPES:
+            cases.append((f"txt/{matrix_type}/{size}", (width, height), block_args + ['--matrix-txt', matrix_type]))
+    return cases
+
+
+def run_case(source, argv, directory, repeat):
+    """Лучший из repeat прогонов process_image и отдельный прогон с замером памяти"""
+    args = pixelate.build_parser().parse_args([source, '--out-name', os.path.join(directory, 'out')] + argv)
+
+    def profiled(memory):
+        with pixelate_profile.Profiler(source, memory=memory) as profiler:
+            with pixelate_profile.stage('total'):
+                pixelate.process_image(source, args, log=lambda message: None)
+        return {record['stage']: record for record in profiler.records}
+
+    best = min((profiled(False) for _ in range(repeat)), key=lambda stages: stages['total']['wall_s'])
+    peak = profiled(True)['total']['peak_bytes']
+    return {'wall_s': best['total']['wall_s'],
+            'stages': {name: record['wall_s'] for name, record in best.items() if name != 'total'},
+            'peak_bytes': peak}
+
+
+def environment():
+    """Окружение запуска: сравнение с базой другой машины малоосмысленно"""
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pillow': Image.__version__,
+            'machine': platform.machine(), 'system': platform.system(), 'cpus': os.cpu_count()}
+
+
+def run_suite(methods, sizes, blocks, repeat):
+    """Результаты --suite: {'environment': ..., 'cases': {имя: результат}}"""
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='pixelate-bench-') as directory:
+        sources = {}
+        for size in sizes:
+            sources[size] = os.path.join(directory, f"source-{size[0]}x{size[1]}.png")
+            synthetic_image(*size).save(sources[size])
+        for name, size, argv in suite_cases(methods, sizes, blocks):
+            result = run_case(sources[size], argv, directory, repeat)
+            result['mb_s'] = size[0] * size[1] * 3 / 1e6 / result['wall_s']
+            results[name] = result
+            stages = '  '.join(f"{stage} {seconds * 1000:.1f}" for stage, seconds in result['stages'].items())
+            print(f"{name:<32} {result['wall_s'] * 1000:9.1f} ms {result['mb_s']:8.1f} MB/s "
+                  f"{result['peak_bytes'] / 1e6:8.1f} MB   {stages}", flush=True)
+    return {'environment': environment(), 'cases': results}
+
+
+def compare_baseline(results, baseline, threshold, min_delta):
+    """Регрессии относительно базы: время и пик памяти выросли больше чем на threshold %.
+
+    Изменения меньше min_delta секунд по времени не считаются - это шум.
+    """
+    if baseline.get('environment') != results['environment']:
+        print(f"Warning: baseline environment differs: {baseline.get('environment')}")
+    regressions = []
+    for name, result in results['cases'].items():
+        old = baseline['cases'].get(name)
+        if old is None:
+            continue
+        limit = 1 + threshold / 100
+        if result['wall_s'] > old['wall_s'] * limit and result['wall_s'] - old['wall_s'] > min_delta:
+            regressions.append(f"{name}: time {old['wall_s'] * 1000:.1f} -> {result['wall_s'] * 1000:.1f} ms")
+        if result['peak_bytes'] > old['peak_bytes'] * limit and result['peak_bytes'] - old['peak_bytes'] > 1 << 20:
+            regressions.append(f"{name}: peak memory {old['peak_bytes'] / 1e6:.1f} -> "
+                               f"{result['peak_bytes'] / 1e6:.1f} MB")
+    missing = sorted(set(baseline['cases']) - set(results['cases']))
+    if missing:
+        print(f"Not run (in baseline): {len(missing)} cases")
+    return regressions
+
+
+def parse_list(parse):
+    return lambda value: [parse(item) for item in value.split(',') if item]
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pixelate.py averaging methods.')
+    parser.add_argument('methods', nargs='*', help='Methods to benchmark (default: all)')
+    parser.add_argument('--size', type=parse_size, default=(1024, 768), help='Image size WxH (default: 1024x768)')
+    parser.add_argument('--block', type=int, default=5, help='Block size in pixels (default: 5)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark, best is reported')
+    parser.add_argument('--compare', action='store_true', help='Also time the legacy per-block engine')
+    # Режимы вместо замера методов - не больше одного за запуск
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument('--startup', action='store_true',
+                       help='Check startup time and lazy imports instead; exit 1 on a regression')
+    parser.add_argument('--startup-budget', type=float, default=500,
+                        help='Startup budget in ms for runs without heavy backends (default: 500)')
+    modes.add_argument('--bright', type=int,
+                       help='Instead of methods, time pixelation with this --bright via HSV and via the LUT')
+    modes.add_argument('--resize-check', action='store_true',
+                       help='Compare --resample fast with LANCZOS + pixelation; exit 1 above --resize-tolerance')
+    parser.add_argument('--resize-tolerance', type=float, default=1.5,
+                        help='Allowed mean block difference in %% of full scale (default: 1.5)')
+    modes.add_argument('--median-check', action='store_true',
+                       help='Compare the meav/gray-mb median engine with np.median; exit 1 on a mismatch')
+    modes.add_argument('--video', type=int, metavar='FRAMES',
+                       help='Time meav over this many moving-square frames, per frame and with block reuse')
+    modes.add_argument('--async', dest='async_requests', type=int, metavar='REQUESTS',
+                       help='Time this many in-memory requests with a blocking call and with pixelate_async')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Thread count for --async (default: number of CPUs)')
+    modes.add_argument('--out-check', action='store_true',
+                       help='Compare canvases written into out= arrays with regular ones; exit 1 on a mismatch')
+    modes.add_argument('--server-check', action='store_true',
+                       help='Send valid and hostile requests to a local HTTP server; exit 1 on a wrong status')
+    modes.add_argument('--suite', action='store_true',
+                       help='Run the end-to-end suite: every method and block size, every matrix format')
+    parser.add_argument('--suite-sizes', type=parse_list(parse_size), default=list(SUITE_SIZES),
+                        help='Comma-separated image sizes for --suite (default: 320x240,1280x720)')
+    parser.add_argument('--suite-blocks', type=parse_list(int), default=list(SUITE_BLOCKS),
+                        help='Comma-separated block sizes for --suite (default: 5,10,20)')
+    parser.add_argument('--save-baseline', help='Write --suite results to this JSON file')
+    parser.add_argument('--baseline', help='Compare --suite results with this JSON file; exit 1 on a regression')
+    parser.add_argument('--threshold', type=float, default=25,
+                        help='Allowed slowdown or peak memory growth in %% (default: 25)')
+    parser.add_argument('--min-delta-ms', type=float, default=5,
+                        help='Ignore time changes smaller than this, in ms (default: 5)')
+    args = parser.parse_args()
+    if args.startup:
+        sys.exit(0 if check_startup(args.startup_budget, args.repeat) else 1)
+    unknown = [m for m in args.methods if m not in METHODS]
+    if unknown:
+        parser.error(f"unknown methods: {', '.join(unknown)}")
+
+    warnings.filterwarnings('ignore')
+    if args.suite:
+        results = run_suite(args.methods or METHODS, args.suite_sizes, args.suite_blocks, args.repeat)
+        if args.save_baseline:
+            with open(args.save_baseline, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        if args.baseline:
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = compare_baseline(results, baseline, args.threshold, args.min_delta_ms / 1000)
+            for line in regressions:
+                print(f"REGRESSION {line}")
+            print(f"{len(regressions)} regressions over {args.threshold}% against {args.baseline}")
+            sys.exit(1 if regressions else 0)
+        return
+
+    image = synthetic_image(*args.size)
+    print(f"Image {args.size[0]}x{args.size[1]}, block {args.block}x{args.block}")
+    if args.resize_check:
+        sys.exit(0 if check_resize(image, args.block, args.resize_tolerance) else 1)
+    if args.video:
+        result = bench_video(image, args.video, args.block)
+        print(f"per frame        {result['full']:8.1f} fps")
+        print(f"block reuse      {result['temporal']:8.1f} fps   {result['recomputed']:.0%} blocks recomputed")
+        return
+    if args.async_requests:
+        result = bench_async(image, args.async_requests, args.workers, args.block)
+        for name in ('blocking', 'async'):
+            print(f"{name:<16} {result[name]['time']:8.3f}s   event loop lag up to {result[name]['lag'] * 1000:.1f} ms")
+        return
+    if args.out_check:
+        sys.exit(0 if check_out(image, args.block) else 1)
+    if args.server_check:
+        sys.exit(0 if check_server(image) else 1)
+    if args.median_check:
+        sys.exit(0 if check_median(image, args.repeat) else 1)
+    if args.bright is not None:
+        result = bench_brightness(image, args.bright, args.block, args.repeat)
+        base = result['pixelate']
+        print(f"pixelate only    {base:8.3f}s")
+        for name in ('hsv', 'lut'):
+            print(f"{name} + pixelate   {result[name]:8.3f}s   brightness +{result[name] - base:.3f}s")
+        return
+    for method in args.methods or METHODS:
+        result = bench_method(image, method, args.block, args.repeat, args.compare)
+        line = f"{method:<12} vector {result['vector']:8.3f}s"
+        if 'block' in result:
+            line += f"   block {result['block']:8.3f}s   x{result['block'] / result['vector']:.1f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
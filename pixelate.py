@@ -6,17 +6,42 @@ import base64
 import numpy as np
 from PIL import Image, ImageOps, ImageDraw
 from datetime import datetime
-from sklearn.cluster import KMeans
-import cv2
-from collections import defaultdict
+# OpenCV (HSV/LAB) и scikit-learn (abdc) импортируются в функциях, которым они
+# нужны: их загрузка дольше всего остального запуска
+from collections import defaultdict, namedtuple
+from functools import partial
+
+from pixelate_engine import SPACE_REDUCERS, BlockGrid, block_grid, convert_color_space, image_to_array, to_colors
+from pixelate_dominant import STRATEGIES as ABDC_STRATEGIES, dominant_reducer
+from pixelate_parallel import BACKENDS as WORKER_BACKENDS, pixelate_tiled
+from pixelate_batch import collect_inputs, run_batch
+from pixelate_stream import open_reader, stream_pixelate
+from pixelate_json import MATRIX_SCOPES, MATRIX_TYPES, pixel_strings, write_json_matrix
+from pixelate_integral import INTEGRAL_METHODS, IntegralImage, block_edges, region_values
+from pixelate_palette import LUT_MODES, PaletteMatcher, load_palette
+from pixelate_cache import ResultCache, file_digest, format_stats
+from pixelate_matrix import MATRIX_BIN_FORMATS, MATRIX_BIN_SUFFIXES, load_matrix, matrix_compressor, write_matrix
+from pixelate_tone import adjust_array, is_identity
+from pixelate_console import CONSOLE_COLORS, truecolor_text
+from pixelate_profile import PROFILE_FORMATS, Profiler, stage
+from pixelate_roi import mask_blocks, parse_rect, pixelate_blocks, rect_blocks
+from pixelate_quadtree import (MAX_LEVELS as MAX_QUAD_LEVELS, BlockMoments, QuadTree, leaf_colors, quadtree_json,
+                               quadtree_text, split_leaves)
 
 # Настройка кодировки вывода для разных версий Python
 if sys.version_info[0] >= 3:
     sys.stdout.reconfigure(encoding='utf-8') if hasattr(sys.stdout, 'reconfigure') else None
 os.environ["PYTHONIOENCODING"] = "utf-8"
 
-def resize_image(image, width=None, height=None, zoom=None):
-    original_width, original_height = image.size
+TXT_TYPES = ('rgb', 'hex', 'ansi', 'sdd', 'sac')
+RESAMPLE_MODES = ('lanczos', 'fast')
+# --resample fast: Image.reduce уменьшает в целое число раз, пока размер не меньше
+# FAST_REDUCING_GAP x итогового, остаток делает LANCZOS
+FAST_REDUCING_GAP = 3.0
+
+def resized_size(size, width=None, height=None, zoom=None):
+    """Размер после resize_image или None, если размер не меняется"""
+    original_width, original_height = size
 
     if zoom is not None:
         if zoom > 0:
@@ -38,19 +63,69 @@ def resize_image(image, width=None, height=None, zoom=None):
         new_height = height
         new_width = int(original_width * ratio)
     else:
+        return None
+
+    return new_width, new_height
+
+
+def resize_image(image, width=None, height=None, zoom=None, resample='lanczos'):
+    new_size = resized_size(image.size, width, height, zoom)
+    if new_size is None:
         return image
+    if resample == 'fast':
+        return fast_resize(image, new_size)
+    return image.resize(new_size, Image.LANCZOS)
+
+
+def draft_for(image, size):
+    """JPEG при уменьшении декодируется сразу в 1/2, 1/4 или 1/8 (масштабирование DCT), не меньше size.
+
+    Действует только до загрузки пикселей; для прочих форматов ничего не делает.
+    """
+    if size[0] < image.width and size[1] < image.height:
+        image.draft(image.mode, size)
+    return image
+
+
+def fast_resize(image, size):
+    """Приближённый LANCZOS: draft для JPEG, Image.reduce до FAST_REDUCING_GAP x size, затем LANCZOS"""
+    draft_for(image, size)
+    return image.resize(size, Image.LANCZOS, reducing_gap=FAST_REDUCING_GAP)
 
-    return image.resize((new_width, new_height), Image.LANCZOS)
 
+def area_supported(image, size, method):
+    """Можно ли посчитать сетку размера size прямо из исходника (area_grid)"""
+    return (size is not None and method in INTEGRAL_METHODS and image.mode in ('RGB', 'L')
+            and size[0] <= image.width and size[1] <= image.height)
 
-def apply_brightness(image, brightness):
-    if brightness == 0:
+
+def area_grid(image, size, block_width, block_height, method, tone=(0, 1.0, 1.0)):
+    """BlockGrid изображения размера size прямо из исходника, без промежуточного изображения.
+
+    Блоку итоговой сетки соответствует прямоугольник исходника с теми же
+    относительными границами; значение блока - среднее по этому
+    прямоугольнику (area averaging), суммы считаются одним проходом по
+    исходнику (region_values) вместо фильтра LANCZOS и второго прохода.
+    Только для уменьшения и методов INTEGRAL_METHODS (см. area_supported).
+    tone - (яркость, контраст, гамма), применяются к исходнику.
+    """
+    draft_for(image, size)
+    arr = image_to_array(image)
+    if not is_identity(*tone):
+        arr = adjust_array(np.require(arr, requirements=['C', 'W']), *tone)
+    height, width = arr.shape[:2]
+    y_edges = np.rint(block_edges(size[1], block_height) * (height / size[1])).astype(np.intp)
+    x_edges = np.rint(block_edges(size[0], block_width) * (width / size[0])).astype(np.intp)
+    colors = to_colors(region_values(arr, method, y_edges, x_edges))
+    return BlockGrid(colors, block_width, block_height, *size)
+
+
+def apply_brightness(image, brightness, contrast=1.0, gamma=1.0):
+    """Яркость, контраст и гамма по V (как сдвиг V в HSV) одной табличной операцией"""
+    if is_identity(brightness, contrast, gamma):
         return image
-    hsv = image.convert('HSV')
-    h, s, v = hsv.split()
-    v = v.point(lambda x: min(255, max(0, x + brightness)))
-    hsv = Image.merge('HSV', (h, s, v))
-    return hsv.convert('RGB')
+    arr = np.array(image if image.mode == 'RGB' else image.convert('RGB'))
+    return Image.fromarray(adjust_array(arr, brightness, contrast, gamma))
 
 
 def average_block_amac(block):
@@ -63,6 +138,7 @@ def average_block_meav(block):
 
 def average_block_aocs_hsv(block):
     """Averaging in HSV color space"""
+    import cv2
     hsv_block = cv2.cvtColor(block, cv2.COLOR_RGB2HSV)
     h, s, v = cv2.split(hsv_block)
     avg_h = np.mean(h)
@@ -74,6 +150,7 @@ def average_block_aocs_hsv(block):
 
 
 def average_block_aocs_lab(block):
+    import cv2
     lab_block = cv2.cvtColor(block, cv2.COLOR_RGB2LAB)
     l, a, b = cv2.split(lab_block)
     avg_l = np.mean(l)
@@ -92,6 +169,7 @@ def average_block_abdc(block):
         return (0, 0, 0)
 
     # Применяем k-means для 1 кластера (доминирующий цвет)
+    from sklearn.cluster import KMeans
     kmeans = KMeans(n_clusters=1, random_state=0, n_init=10).fit(pixels)
     dominant_color = kmeans.cluster_centers_[0].round().astype(int).tolist()
     return tuple(dominant_color)
@@ -109,6 +187,7 @@ def average_block_gray_wav(block):
 
 
 def average_block_gray_hsv_v(block):
+    import cv2
     hsv_block = cv2.cvtColor(block, cv2.COLOR_RGB2HSV)
     v = hsv_block[:, :, 2]
     gray_value = np.mean(v)
@@ -116,6 +195,7 @@ def average_block_gray_hsv_v(block):
 
 
 def average_block_gray_hsv_s(block):
+    import cv2
     hsv_block = cv2.cvtColor(block, cv2.COLOR_RGB2HSV)
     s = hsv_block[:, :, 1]
     gray_value = np.mean(s)
@@ -123,6 +203,7 @@ def average_block_gray_hsv_s(block):
 
 
 def average_block_gray_hsv_h(block):
+    import cv2
     hsv_block = cv2.cvtColor(block, cv2.COLOR_RGB2HSV)
     h = hsv_block[:, :, 0]
     gray_value = np.mean(h)
@@ -130,6 +211,7 @@ def average_block_gray_hsv_h(block):
 
 
 def average_block_gray_lab_l(block):
+    import cv2
     lab_block = cv2.cvtColor(block, cv2.COLOR_RGB2LAB)
     l = lab_block[:, :, 0]
     gray_value = np.mean(l)
@@ -174,7 +256,271 @@ def average_block_blwt_tc(block, threshold=128):
     return (bw_value, bw_value, bw_value)
 
 
-def pixelate_image(image, block_width=10, block_height=10, averaging_method='meav', mode='color'):
+COLOR_METHODS = ('amac', 'meav', 'aocs-hsv', 'aocs-lab', 'abdc')
+GRAYSCALE_METHODS = ('gray-rgb', 'gray-wav', 'gray-hsv-v', 'gray-hsv-s', 'gray-hsv-h', 'gray-lab-l',
+                     'gray-tc', 'gray-mb')
+BLACK_WHITE_METHODS = ('bin-tc', 'bin-mb', 'blwt', 'blwt-tc')
+
+
+def resolve_method(averaging_method, mode):
+    """Возвращает метод, который реально будет применён в данном режиме"""
+    if mode == 'grayscale':
+        if averaging_method == 'abdc':
+            return 'gray-abdc'
+        return averaging_method if averaging_method in GRAYSCALE_METHODS else 'gray-wav'
+    if mode == 'black-white':
+        return averaging_method if averaging_method in BLACK_WHITE_METHODS else 'blwt-tc'
+    return averaging_method if averaging_method in COLOR_METHODS else 'meav'
+
+
+def average_block_gray_abdc(block):
+    """Доминирующий цвет, приведённый к оттенку серого"""
+    color = average_block_abdc(block)
+    gray = int(0.299 * color[0] + 0.587 * color[1] + 0.114 * color[2])
+    return (gray, gray, gray)
+
+
+BLOCK_FUNCTIONS = {
+    'amac': average_block_amac,
+    'meav': average_block_meav,
+    'aocs-hsv': average_block_aocs_hsv,
+    'aocs-lab': average_block_aocs_lab,
+    'abdc': average_block_abdc,
+    'gray-abdc': average_block_gray_abdc,
+    'gray-rgb': average_block_gray_rgb,
+    'gray-wav': average_block_gray_wav,
+    'gray-hsv-v': average_block_gray_hsv_v,
+    'gray-hsv-s': average_block_gray_hsv_s,
+    'gray-hsv-h': average_block_gray_hsv_h,
+    'gray-lab-l': average_block_gray_lab_l,
+    'gray-tc': average_block_gray_tc,
+    'gray-mb': average_block_gray_mb,
+    'bin-tc': average_block_bin_tc,
+    'bin-mb': average_block_bin_mb,
+    'blwt': average_block_blwt,
+    'blwt-tc': average_block_blwt_tc,
+}
+
+ENGINES = ('vector', 'block')
+
+
+def compute_grid(arr, block_width, block_height, method, abdc_strategy='mean', abdc_clusters=3, source=None):
+    """Цвета блоков (rows, cols, 3) для массива (H, W, 3) и уже выбранного метода.
+
+    source - SourceArrays с общими для нескольких сеток HSV/LAB-массивами
+    и интегральными изображениями.
+    """
+    if source is not None and method in INTEGRAL_METHODS:
+        return source.integral().grid(method, block_width, block_height)
+    reducer = None
+    converted = None
+    if method in ('abdc', 'gray-abdc'):
+        params = {'k': abdc_clusters} if abdc_strategy == 'kmeans' else {}
+        reducer = dominant_reducer(abdc_strategy, method == 'gray-abdc', **params)
+    elif source is not None and method in SPACE_REDUCERS:
+        converted = source.converted(SPACE_REDUCERS[method][0])
+    return block_grid(arr, block_width, block_height, method, BLOCK_FUNCTIONS[method], reducer, converted)
+
+
+class SourceArrays:
+    """Подготовленный массив изображения и производные от него, общие для многих сеток.
+
+    HSV/LAB-представления и интегральное изображение строятся по первому
+    требованию и дальше переиспользуются.
+    """
+
+    def __init__(self, arr):
+        self.arr = arr
+        self._converted = {}
+        self._integral = None
+
+    def converted(self, space):
+        if space not in self._converted:
+            self._converted[space] = convert_color_space(self.arr, space)
+        return self._converted[space]
+
+    def integral(self):
+        if self._integral is None:
+            self._integral = IntegralImage(self.arr)
+        return self._integral
+
+
+def pixelate_grid(image, block_width=10, block_height=10, averaging_method='meav', mode='color',
+                  engine='vector', abdc_strategy='mean', abdc_clusters=3, workers=1,
+                  worker_backend='thread'):
+    """Пикселизирует изображение и возвращает BlockGrid - по одному цвету на блок.
+
+    engine='vector' (по умолчанию) считает все блоки пакетно в pixelate_engine,
+    engine='block' - исходный поблочный проход, оставлен для сверки.
+    abdc_strategy выбирает способ поиска доминирующего цвета (см. pixelate_dominant),
+    abdc_clusters - число кластеров для стратегии 'kmeans'.
+    workers > 1 делит изображение на полосы и считает их пулом потоков
+    или процессов (worker_backend), см. pixelate_parallel.
+    """
+    if engine == 'block':
+        pixelated = _pixelate_image_blockwise(image, block_width, block_height, averaging_method, mode)
+        return BlockGrid.from_canvas(np.asarray(pixelated), block_width, block_height)
+
+    arr = image_to_array(image)
+    if arr.ndim != 3 or arr.shape[-1] != 3:
+        # Нестандартное число каналов (например, LA) - только поблочно
+        pixelated = _pixelate_image_blockwise(image, block_width, block_height, averaging_method, mode)
+        return BlockGrid.from_canvas(np.asarray(pixelated), block_width, block_height)
+
+    method = resolve_method(averaging_method, mode)
+    grid_function = partial(compute_grid, method=method, abdc_strategy=abdc_strategy,
+                            abdc_clusters=abdc_clusters)
+    width, height = image.size
+    if workers > 1:
+        grid, canvas = pixelate_tiled(arr, block_width, block_height, grid_function, workers, worker_backend)
+        return BlockGrid(grid, block_width, block_height, width, height, canvas)
+    grid = grid_function(arr, block_width, block_height)
+    return BlockGrid(grid, block_width, block_height, width, height)
+
+
+def pixelate_sizes(image, sizes, averaging_method='meav', mode='color', abdc_strategy='mean',
+                   abdc_clusters=3):
+    """Пикселизация с несколькими размерами блока: {(block_width, block_height): BlockGrid}.
+
+    Изображение переводится в массив один раз; для методов на средних
+    (INTEGRAL_METHODS) один раз строится интегральное изображение, и каждый
+    следующий размер стоит O(1) на блок, см. SourceArrays.
+    """
+    arr = image_to_array(image)
+    if arr.ndim != 3 or arr.shape[-1] != 3:
+        return {(bw, bh): pixelate_grid(image, bw, bh, averaging_method, mode, 'vector', abdc_strategy,
+                                        abdc_clusters) for bw, bh in sizes}
+
+    method = resolve_method(averaging_method, mode)
+    source = SourceArrays(arr)
+    width, height = image.size
+    return {(bw, bh): BlockGrid(compute_grid(arr, bw, bh, method, abdc_strategy, abdc_clusters, source),
+                                bw, bh, width, height)
+            for bw, bh in sizes}
+
+
+def pixelate_roi(image, rects=(), mask=None, block_width=10, block_height=10, averaging_method='meav',
+                 mode='color', abdc_strategy='mean', abdc_clusters=3):
+    """Пикселизирует только блоки, пересекающие области интереса (см. pixelate_roi.py).
+
+    rects - прямоугольники Rect/(x, y, width, height), mask - изображение или
+    массив (H, W) того же размера, ненулевые пиксели - область; можно вместе.
+    image - PIL.Image или массив (H, W, 3) uint8: массив меняется на месте
+    и возвращается, для Image возвращается новое изображение.
+    """
+    in_place = isinstance(image, np.ndarray)
+    arr = image if in_place else np.array(image_to_array(image))
+    if arr.ndim != 3 or arr.shape[-1] != 3 or arr.dtype != np.uint8:
+        raise ValueError("pixelate_roi needs an (H, W, 3) uint8 image")
+    if not arr.flags.writeable:
+        raise ValueError("pixelate_roi needs a writable array")
+    height, width = arr.shape[:2]
+    selected = rect_blocks(rects, width, height, block_width, block_height)
+    if mask is not None:
+        mask = np.asarray(mask.convert('L') if isinstance(mask, Image.Image) else mask)
+        if mask.shape != (height, width):
+            raise ValueError(f"Mask size {mask.shape[1]}x{mask.shape[0]} differs from image size {width}x{height}")
+        selected |= mask_blocks(mask, block_width, block_height)
+
+    grid_function = partial(compute_grid, method=resolve_method(averaging_method, mode),
+                            abdc_strategy=abdc_strategy, abdc_clusters=abdc_clusters)
+    pixelate_blocks(arr, selected, block_width, block_height, grid_function)
+    return arr if in_place else Image.fromarray(arr)
+
+
+def pixelate_quadtree(image, block_width=10, block_height=10, averaging_method='meav', mode='color', levels=5,
+                      threshold=12.0, abdc_strategy='mean', abdc_clusters=3):
+    """Адаптивная пикселизация квадродеревом (см. pixelate_quadtree.py): QuadTree.
+
+    Блоки от (block_width, block_height) * 2^levels делятся на четыре, пока
+    разброс цвета (корень средней дисперсии каналов) больше threshold, но не
+    мельче block_width x block_height.
+    """
+    arr = image_to_array(image)
+    if arr.ndim != 3 or arr.shape[-1] != 3:
+        arr = image_to_array(image.convert('RGB'))
+    moments = BlockMoments(arr, block_width, block_height)
+    rects = split_leaves(moments, levels, threshold)
+    method = resolve_method(averaging_method, mode)
+    if method in INTEGRAL_METHODS:
+        x0, y0 = rects[:, 0], rects[:, 1]
+        values = moments.values(method, y0, y0 + rects[:, 3], x0, x0 + rects[:, 2])
+        colors = to_colors(values[None])[0]
+    else:
+        colors = leaf_colors(arr, rects, partial(compute_grid, method=method, abdc_strategy=abdc_strategy,
+                                                 abdc_clusters=abdc_clusters))
+    height, width = arr.shape[:2]
+    return QuadTree(rects, colors, width, height, block_width, block_height, levels)
+
+
+def generate_quadtree_json(tree, matrix_type='rgb'):
+    """JSON-матрица листьев QuadTree словарём (см. pixelate_quadtree.quadtree_json)"""
+    strings = None
+    if matrix_type not in ('aoa', 'sla', 'slo', 'b64'):
+        strings = pixel_strings(tree.colors[None], matrix_type if matrix_type in ('hex', 'cmyk') else 'rgb')[0]
+    return quadtree_json(tree, matrix_type, strings)
+
+
+MODES = ('color', 'grayscale', 'black-white')
+
+# Один вариант вывода: режим, метод усреднения, размер блока и имя файла
+# (как --out-name; None - общее имя с суффиксом варианта)
+Variant = namedtuple('Variant', ['mode', 'method', 'block_width', 'block_height', 'out_name'],
+                     defaults=('meav', 10, 10, None))
+
+
+def parse_variant(text):
+    """Variant из строки MODE[:METHOD[:WxH[:OUT_NAME]]], например grayscale:gray-wav:5x5"""
+    parts = text.split(':', 3) + [''] * 3
+    mode, method, size, out_name = parts[:4]
+    if mode not in MODES:
+        raise argparse.ArgumentTypeError(f"unknown mode '{mode}' in variant '{text}'")
+    method = method or 'meav'
+    if method not in COLOR_METHODS + GRAYSCALE_METHODS + BLACK_WHITE_METHODS:
+        raise argparse.ArgumentTypeError(f"unknown averaging method '{method}' in variant '{text}'")
+    width, _, height = (size or '10').lower().partition('x')
+    try:
+        block_width, block_height = int(width), int(height or width)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"bad block size '{size}' in variant '{text}'") from None
+    return Variant(mode, method, block_width, block_height, out_name or None)
+
+
+def render_variants(image, variants, width=None, height=None, zoom=None, bright=0, engine='vector',
+                    abdc_strategy='mean', abdc_clusters=3, contrast=1.0, gamma=1.0, resample='lanczos'):
+    """Несколько вариантов пикселизации одного изображения: BlockGrid в порядке variants.
+
+    Изменение размера и кривая тона (яркость, контраст, гамма) выполняются один раз; массив изображения,
+    его HSV/LAB-представления и интегральное изображение общие для всех
+    вариантов (SourceArrays).
+    """
+    image = resize_image(image, width, height, zoom, resample)
+    image = apply_brightness(image, bright, contrast, gamma)
+
+    arr = image_to_array(image)
+    if engine == 'block' or arr.ndim != 3 or arr.shape[-1] != 3:
+        return [pixelate_grid(image, v.block_width, v.block_height, v.method, v.mode, engine,
+                              abdc_strategy, abdc_clusters) for v in variants]
+
+    source = SourceArrays(arr)
+    grids = []
+    for v in variants:
+        colors = compute_grid(arr, v.block_width, v.block_height, resolve_method(v.method, v.mode),
+                              abdc_strategy, abdc_clusters, source)
+        grids.append(BlockGrid(colors, v.block_width, v.block_height, *image.size))
+    return grids
+
+
+def pixelate_image(image, block_width=10, block_height=10, averaging_method='meav', mode='color',
+                   engine='vector', abdc_strategy='mean', abdc_clusters=3, workers=1,
+                   worker_backend='thread'):
+    """Пикселизирует изображение: полноразмерный результат, см. pixelate_grid"""
+    return pixelate_grid(image, block_width, block_height, averaging_method, mode, engine,
+                         abdc_strategy, abdc_clusters, workers, worker_backend).to_image()
+
+
+def _pixelate_image_blockwise(image, block_width=10, block_height=10, averaging_method='meav', mode='color'):
+    """Исходная поблочная реализация: crop + average_block_* + ImageDraw"""
     width, height = image.size
     pixelated = Image.new('RGB', (width, height))
     draw = ImageDraw.Draw(pixelated)
@@ -252,47 +598,43 @@ def pixelate_image(image, block_width=10, block_height=10, averaging_method='mea
     return pixelated
 
 
-def generate_json_matrix(image, matrix_type='rgb'):
+def generate_json_matrix(image, matrix_type='rgb', scope='pixels'):
+    """JSON-матрица изображения или BlockGrid словарём.
+
+    scope='blocks' для BlockGrid - один элемент на блок; к данным
+    добавляется геометрия сетки. scope='pixels' - полноразмерный холст.
+    Для записи в файл см. save_json_matrix - она не строит словарь.
+    """
+    if isinstance(image, BlockGrid):
+        if scope == 'blocks':
+            json_data = generate_json_matrix(Image.fromarray(image.colors, 'RGB'), matrix_type)
+            json_data.update(block_grid_geometry(image))
+            return json_data
+        image = image.to_image()
+
     width, height = image.size
-    pixels = list(image.getdata())
+    pixels = np.asarray(image).reshape(height, width, -1)
 
     if matrix_type == 'aoa':
-        pixel_matrix = []
-        for y in range(height):
-            row = []
-            for x in range(width):
-                pixel = pixels[y * width + x]
-                row.append(list(pixel))
-            pixel_matrix.append(row)
         json_data = {
             "width": width,
             "height": height,
-            "pixels": pixel_matrix
+            "pixels": pixels.tolist()
         }
     elif matrix_type == 'sla':
-        flat_pixels = []
-        for pixel in pixels:
-            flat_pixels.extend(pixel)
         json_data = {
             "width": width,
             "height": height,
-            "channels": len(pixels[0]),
-            "pixels": flat_pixels
+            "channels": pixels.shape[2],
+            "pixels": pixels.ravel().tolist()
         }
     elif matrix_type == 'slo':
+        names = 'rgba'[:min(pixels.shape[2], 4)]
         pixel_list = []
-        for y in range(height):
-            for x in range(width):
-                pixel = pixels[y * width + x]
-                pixel_dict = {
-                    "x": x,
-                    "y": y,
-                    "r": pixel[0],
-                    "g": pixel[1],
-                    "b": pixel[2]
-                }
-                if len(pixel) > 3:
-                    pixel_dict["a"] = pixel[3]
+        for y, row in enumerate(pixels.tolist()):
+            for x, pixel in enumerate(row):
+                pixel_dict = {"x": x, "y": y}
+                pixel_dict.update(zip(names, pixel))
                 pixel_list.append(pixel_dict)
         json_data = {
             "width": width,
@@ -308,73 +650,59 @@ def generate_json_matrix(image, matrix_type='rgb'):
             "format": "RGB",
             "data": base64_data
         }
-    elif matrix_type == 'hex':
-        pixel_matrix = []
-        for y in range(height):
-            row = []
-            for x in range(width):
-                pixel = pixels[y * width + x]
-                hex_color = "#{:02x}{:02x}{:02x}".format(*pixel[:3])
-                row.append(hex_color)
-            pixel_matrix.append(row)
-        json_data = {
-            "width": width,
-            "height": height,
-            "pixels": pixel_matrix
-        }
-    elif matrix_type == 'rgb':
-        pixel_matrix = []
-        for y in range(height):
-            row = []
-            for x in range(width):
-                pixel = pixels[y * width + x]
-                rgb_str = " ".join(map(str, pixel[:3]))
-                row.append(rgb_str)
-            pixel_matrix.append(row)
-        json_data = {
-            "width": width,
-            "height": height,
-            "pixels": pixel_matrix
-        }
-    elif matrix_type == 'cmyk':
-        pixel_matrix = []
-        for y in range(height):
-            row = []
-            for x in range(width):
-                pixel = pixels[y * width + x]
-                r, g, b = pixel[:3]
-                k = 1 - max(r / 255, g / 255, b / 255)
-                if k == 1:
-                    c = m = y = 0
-                else:
-                    c = (1 - r / 255 - k) / (1 - k)
-                    m = (1 - g / 255 - k) / (1 - k)
-                    y = (1 - b / 255 - k) / (1 - k)
-                cmyk_str = " ".join(map(str, [int(c * 100), int(m * 100), int(y * 100), int(k * 100)]))
-                row.append(cmyk_str)
-            pixel_matrix.append(row)
-        json_data = {
-            "width": width,
-            "height": height,
-            "pixels": pixel_matrix
-        }
     else:
-        pixel_matrix = []
-        for y in range(height):
-            row = []
-            for x in range(width):
-                pixel = pixels[y * width + x]
-                rgb_str = " ".join(map(str, pixel[:3]))
-                row.append(rgb_str)
-            pixel_matrix.append(row)
+        # hex, rgb, cmyk; неизвестный тип - как rgb
         json_data = {
             "width": width,
             "height": height,
-            "pixels": pixel_matrix
+            "pixels": pixel_strings(pixels, matrix_type if matrix_type in ('hex', 'cmyk') else 'rgb')
         }
 
     return json_data
 
+
+def block_grid_geometry(grid):
+    """Геометрия сетки для JSON-матрицы с scope='blocks'"""
+    return {"block_width": grid.block_width, "block_height": grid.block_height,
+            "image_width": grid.width, "image_height": grid.height}
+
+
+def matrix_source(image, scope='pixels'):
+    """Источник строк матрицы: (rows, width, height, channels, geometry).
+
+    rows(start, stop) возвращает строки массивом uint8; geometry - геометрия
+    сетки для scope='blocks' или None.
+    """
+    geometry = None
+    if isinstance(image, BlockGrid) and scope == 'blocks':
+        geometry = block_grid_geometry(image)
+        image = image.colors
+    if isinstance(image, BlockGrid):
+        # Строки холста растягиваются из сетки по мере записи
+        width, height = image.size
+        return image.rows, width, height, 3, geometry
+    pixels = image if isinstance(image, np.ndarray) else np.asarray(image).reshape(image.height, image.width, -1)
+    height, width, channels = pixels.shape
+    return (lambda start, stop: pixels[start:stop]), width, height, channels, geometry
+
+
+def save_json_matrix(image, path, matrix_type='rgb', scope='pixels', compact=False):
+    """Потоково пишет JSON-матрицу изображения или BlockGrid в файл.
+
+    Без compact результат побайтно совпадает с
+    json.dump(generate_json_matrix(image, matrix_type, scope), f, indent=2).
+    """
+    rows, width, height, channels, geometry = matrix_source(image, scope)
+    with open(path, 'w') as f:
+        write_json_matrix(f, rows, width, height, channels, matrix_type, geometry, compact)
+
+
+def save_matrix_bin(image, path, fmt='npy', scope='pixels'):
+    """Пишет матрицу изображения или BlockGrid в двоичном формате (см. pixelate_matrix)"""
+    rows, width, height, channels, geometry = matrix_source(image, scope)
+    write_matrix(path, rows, width, height, channels, fmt, geometry)
+
+
 def get_palette(palette_type='ansi'):
     """Возвращает словарь с палитрой символов для заданного типа"""
     palettes = {
@@ -424,41 +752,38 @@ def get_closest_color(palette, pixel):
     return min(palette.keys(), key=lambda c: sum((a - b) ** 2 for a, b in zip(c, pixel)))
 
 
-def generate_txt_matrix(image, matrix_type='ansi', block_width=10, block_height=10):
-    """Генерирует текстовую матрицу с одним символом на блок"""
-    width, height = image.size
-    pixels = list(image.getdata())
-    palette = get_palette(matrix_type)
+def block_averages(image, block_width=10, block_height=10):
+    """Средние цвета блоков (сумма // число пикселей) массивом (rows, cols, 3).
 
-    lines = []
-    for y in range(0, height, block_height):
-        line = []
-        for x in range(0, width, block_width):
-            # Усредняем цвет блока
-            r, g, b, count = 0, 0, 0, 0
-            for dy in range(block_height):
-                for dx in range(block_width):
-                    if y + dy < height and x + dx < width:
-                        pixel = pixels[(y + dy) * width + (x + dx)]
-                        r += pixel[0]
-                        g += pixel[1]
-                        b += pixel[2] if len(pixel) > 2 else 0
-                        count += 1
-
-            if count > 0:
-                avg_color = (r // count, g // count, b // count)
-                closest = get_closest_color(palette, avg_color)
-                line.append(palette[closest])
-        lines.append(' '.join(line))
-
-    return '\n'.join(lines)
-
-
-def print_console_preview(image, block_width=10, block_height=10):
-    """Выводит в консоль превью с одним символом на блок"""
+    Для BlockGrid считается по цветам сетки без построения холста.
+    """
+    if not isinstance(image, BlockGrid):
+        pixels = np.asarray(image if image.mode in ('RGB', 'RGBA') else image.convert('RGB'))
+        image = BlockGrid(pixels[..., :3], 1, 1, image.width, image.height)
+    return image.block_means(block_width, block_height)
+
+
+def generate_txt_matrix(image, matrix_type='ansi', block_width=10, block_height=10, palette_lut='none',
+                        palette=None):
+    """Генерирует текстовую матрицу с одним символом на блок (изображение или BlockGrid).
+
+    palette - своя палитра {(r, g, b): символ} вместо get_palette(matrix_type);
+    palette_lut - таблица поиска цвета палитры, см. pixelate_palette.
+    """
+    matcher = PaletteMatcher(palette or get_palette(matrix_type), palette_lut)
+    symbols = matcher.match(block_averages(image, block_width, block_height))
+    return '\n'.join(' '.join(row) for row in symbols.tolist())
+
+
+def print_console_preview(image, block_width=10, block_height=10, palette_lut='none', color='palette', file=None):
+    """Выводит в консоль превью с одним символом на блок (изображение или BlockGrid).
+
+    color='palette' - символы ANSI-палитры; 'truecolor' - 24-битный цвет и
+    полублоки, по две строки блоков на строку консоли. Текст собирается в
+    один буфер и выводится одной записью в file (по умолчанию sys.stdout).
+    """
     width, height = image.size
-    pixels = list(image.getdata())
-    palette = get_palette('ansi')  # Для консоли всегда используем ANSI палитру
+    file = file or sys.stdout
 
     # Автоматическая подстройка под размер терминала
     try:
@@ -472,40 +797,54 @@ def print_console_preview(image, block_width=10, block_height=10):
     # Формируем заголовок
     header = f" Preview {width // block_width}x{height // block_height} "
     border = '=' * len(header)
-    print(f"\n{border}\n{header}\n{border}")
+    averages = block_averages(image, block_width, block_height)
+    if color == 'truecolor':
+        lines = truecolor_text(averages).splitlines()
+    else:
+        matcher = PaletteMatcher(get_palette('ansi'), palette_lut)  # Для консоли всегда используем ANSI палитру
+        lines = [''.join(line) for line in matcher.match(averages).tolist()]
 
-    # Генерируем и выводим превью
-    for y in range(0, height, block_height):
-        line = []
-        for x in range(0, width, block_width):
-            # Усредняем цвет блока
-            r, g, b, count = 0, 0, 0, 0
-            for dy in range(block_height):
-                for dx in range(block_width):
-                    if y + dy < height and x + dx < width:
-                        pixel = pixels[(y + dy) * width + (x + dx)]
-                        r += pixel[0]
-                        g += pixel[1]
-                        b += pixel[2] if len(pixel) > 2 else 0
-                        count += 1
-
-            if count > 0:
-                avg_color = (r // count, g // count, b // count)
-                closest = get_closest_color(palette, avg_color)
-                line.append(palette[closest])
-
-        # Вывод строки с обработкой ошибок кодировки
+    # Выводим превью одной записью
+    encoding = getattr(file, 'encoding', None) or 'utf-8'
+
+    def printable(line):
         try:
-            print(''.join(line))
-        except UnicodeEncodeError:
-            print('*' * len(line))  # Фолбэк для терминалов без Unicode
+            line.encode(encoding)
+            return line
+        except (UnicodeEncodeError, LookupError):
+            return '*' * averages.shape[1]  # Фолбэк для терминалов без Unicode
 
-    print(border + "\n")
+    body = '\n'.join(map(printable, lines))
+    file.write(f"\n{border}\n{header}\n{border}\n{body}\n{border}\n\n")
+    file.flush()
 
 
-def main():
-    parser = argparse.ArgumentParser(description='Pixelate an image with various options.')
-    parser.add_argument('image_path', help='Path to the image file to process')
+def positive_float(text):
+    value = float(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"must be positive: {text}")
+    return value
+
+
+def positive_int(text):
+    value = int(text)
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"must be positive: {text}")
+    return value
+
+
+def quad_levels(text):
+    value = int(text)
+    if not 0 <= value <= MAX_QUAD_LEVELS:
+        raise argparse.ArgumentTypeError(f"must be between 0 and {MAX_QUAD_LEVELS}: {text}")
+    return value
+
+
+def build_parser(parser_class=argparse.ArgumentParser):
+    parser = parser_class(description='Pixelate an image with various options.')
+    parser.add_argument('image_path', nargs='+',
+                        help='Image file(s) to process; directories, glob patterns and @manifest files '
+                             'switch to batch mode')
     parser.add_argument('--averating', choices=['amac', 'meav', 'aocs-hsv', 'aocs-lab', 'abdc',
                                                 'gray-rgb', 'gray-wav', 'gray-hsv-v', 'gray-hsv-s', 'gray-hsv-h',
                                                 'gray-lab-l',
@@ -516,23 +855,87 @@ def main():
     parser.add_argument('--zoom', type=float, help='Zoom factor (positive to enlarge, negative to shrink)')
     parser.add_argument('--point-w', type=int, default=10, help='Block width in pixels (default: 10)')
     parser.add_argument('--point-h', type=int, default=10, help='Block height in pixels (default: 10)')
+    parser.add_argument('--resample', choices=RESAMPLE_MODES, default='lanczos',
+                        help='Resize quality: lanczos (default) or fast - JPEG draft decoding, Image.reduce '
+                             'and, for mean-based methods, block colors averaged straight from the source')
     parser.add_argument('--mode-color', action='store_true', help='Output in color mode')
     parser.add_argument('--mode-black-white', action='store_true', help='Output in black and white mode')
     parser.add_argument('--mode-grayscale', action='store_true', help='Output in grayscale mode')
     parser.add_argument('--bright', type=int, default=0, help='Brightness adjustment (-255 to 255)')
+    parser.add_argument('--contrast', type=float, default=1.0,
+                        help='Contrast factor around mid-gray (default: 1.0, no change)')
+    parser.add_argument('--gamma', type=positive_float, default=1.0,
+                        help='Gamma correction, values above 1 brighten midtones (default: 1.0, no change)')
     parser.add_argument('--out-prefix', help='Prefix for output filename')
     parser.add_argument('--out-name', help='Output filename')
     parser.add_argument('--out-type', help='Output file extension')
     parser.add_argument('--matrix-json', nargs='?', const='rgb',
-                        choices=['aoa', 'sla', 'slo', 'b64', 'hex', 'rgb', 'cmyk'],
+                        choices=MATRIX_TYPES,
                         help='Generate JSON matrix file with specified format')
-    parser.add_argument('--matrix-txt', choices=['rgb', 'hex', 'ansi', 'sdd', 'sac'],
+    parser.add_argument('--matrix-txt', choices=TXT_TYPES,
                         help='Generate TXT matrix file with specified format')
     parser.add_argument('--console', action='store_true', help='Print ANSI-color preview to console')
-
-    args = parser.parse_args()
-
-    # Determine output mode
+    parser.add_argument('--console-color', choices=CONSOLE_COLORS, default='palette',
+                        help='Console preview colors: palette symbols (default) or 24-bit truecolor half-blocks')
+    parser.add_argument('--palette-file',
+                        help='JSON palette {"#rrggbb": "symbol"} for --matrix-txt instead of the built-in one')
+    parser.add_argument('--palette-lut', choices=LUT_MODES, default='none',
+                        help='Palette lookup table: none (exact search), 32 (32x32x32, approximate) '
+                             'or full (24-bit, exact, cached on disk)')
+    parser.add_argument('--matrix-bin', choices=MATRIX_BIN_FORMATS,
+                        help='Write a binary matrix: .npy, memory-mappable raw (.pxm) or compressed chunks (.pxz)')
+    parser.add_argument('--matrix-scope', choices=MATRIX_SCOPES, default='pixels',
+                        help='JSON/binary matrix granularity: every pixel (default) or one entry per block')
+    parser.add_argument('--matrix-compact', action='store_true',
+                        help='Write the JSON matrix without indentation')
+    parser.add_argument('--engine', choices=ENGINES, default='vector',
+                        help='Pixelation engine: vectorized (default) or legacy per-block')
+    parser.add_argument('--abdc-strategy', choices=ABDC_STRATEGIES, default='mean',
+                        help='Dominant color strategy for abdc (default: mean)')
+    parser.add_argument('--abdc-clusters', type=int, default=3,
+                        help='Number of clusters for --abdc-strategy kmeans (default: 3)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Process the image in bands using N parallel workers (default: 1)')
+    parser.add_argument('--workers-backend', choices=WORKER_BACKENDS, default='thread',
+                        help='Worker pool type for --workers (default: thread)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Process the image in horizontal strips with bounded memory')
+    parser.add_argument('--strip-mb', type=float, default=64,
+                        help='Memory budget per strip for --stream, in MB (default: 64)')
+    parser.add_argument('--profile', nargs='?', const='text', choices=PROFILE_FORMATS,
+                        help='Report wall/CPU time, peak memory and bytes per stage: text table (default) '
+                             'or JSON lines')
+    parser.add_argument('--profile-out', help='Append the --profile report to this file instead of printing it')
+    parser.add_argument('--roi', action='append', type=parse_rect, metavar='X,Y,W,H',
+                        help='Pixelate only blocks touching this rectangle (output pixels); may be repeated')
+    parser.add_argument('--roi-mask',
+                        help='Pixelate only blocks touching nonzero pixels of this mask image '
+                             '(resized to the output size if needed)')
+    parser.add_argument('--quadtree', action='store_true',
+                        help='Adaptive blocks: split by color variance down to --point-w x --point-h')
+    parser.add_argument('--quad-levels', type=quad_levels, default=5,
+                        help='Largest --quadtree block is the minimum block times 2^levels (default: 5)')
+    parser.add_argument('--quad-threshold', type=float, default=12.0,
+                        help='Split a --quadtree block while its color standard deviation exceeds this (default: 12)')
+    parser.add_argument('--variant', action='append', type=parse_variant,
+                        metavar='MODE[:METHOD[:WxH[:OUT_NAME]]]',
+                        help='Render several variants from one decode, e.g. --variant color:meav:10 '
+                             '--variant grayscale:gray-wav:5x5 (repeatable)')
+    parser.add_argument('--cache', nargs='?', const='',
+                        help='Reuse results of identical runs from a content-addressed cache '
+                             '(default directory: ~/.cache/pixelate/results)')
+    parser.add_argument('--cache-mb', type=float, default=1024,
+                        help='Cache size limit in MB; least recently used entries are evicted (default: 1024)')
+    parser.add_argument('--manifest', help='Batch mode: text file with one image path per line')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Batch mode: number of images processed in parallel (default: CPU count)')
+    parser.add_argument('--force', action='store_true',
+                        help='Batch mode: reprocess images whose outputs are already up to date')
+    return parser
+
+
+def resolve_mode(args):
+    """Определяет режим вывода и метод усреднения по умолчанию для него"""
     if args.mode_black_white:
         mode = 'black-white'
         if args.averating == 'meav':
@@ -543,90 +946,484 @@ def main():
             args.averating = 'gray-wav'
     else:
         mode = 'color'
+    return mode
+
+
+def output_conflict(args):
+    """Сообщение о несовместимых с --roi/--roi-mask или --quadtree опциях, или None.
+
+    Результат ROI - изображение, а не сетка блоков: матрицам и превью
+    не из чего строиться. Квадродерево пишет свои JSON/TXT-матрицы
+    (списком листьев), но не двоичные матрицы и не превью.
+    """
+    roi = args.roi or args.roi_mask
+    if not (roi or args.quadtree):
+        return None
+    if roi and args.quadtree:
+        return "--quadtree is not supported with --roi/--roi-mask"
+    options = [('--variant', args.variant), ('--stream', args.stream), ('--matrix-bin', args.matrix_bin),
+               ('--console', args.console), ('--engine block', args.engine == 'block')]
+    if roi:
+        options += [('--matrix-json', args.matrix_json), ('--matrix-txt', args.matrix_txt)]
+    name = next((name for name, value in options if value), None)
+    if name is None:
+        return None
+    return f"{name} is not supported with {'--roi/--roi-mask' if roi else '--quadtree'}"
+
+
+def load_roi_mask(path, size):
+    """Маска --roi-mask размера size: при другом размере масштабируется без сглаживания"""
+    mask = Image.open(path).convert('L')
+    if mask.size != size:
+        mask = mask.resize(size, Image.NEAREST)
+    return mask
+
+
+def output_path(image_path, args, timestamp=None):
+    """Путь сохраняемого изображения по --out-name/--out-prefix/--out-type.
+
+    В пакетном режиме {name} в --out-name заменяется именем исходного файла.
+    """
+    if args.out_type:
+        output_ext = args.out_type
+    else:
+        output_ext = os.path.splitext(image_path)[1][1:] or 'png'
+
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    if args.out_name:
+        return f"{args.out_name.replace('{name}', base_name)}.{output_ext}"
+    if timestamp is None:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    prefix = args.out_prefix if args.out_prefix else 'pic_'
+    return f"{prefix}{base_name}_{timestamp}.{output_ext}"
+
+
+def variant_output_path(image_path, args, variant, timestamp=None):
+    """Путь изображения варианта: его собственное имя или общее имя с суффиксом варианта"""
+    if variant.out_name:
+        return output_path(image_path, argparse.Namespace(**dict(vars(args), out_name=variant.out_name)),
+                           timestamp)
+    root, ext = os.path.splitext(output_path(image_path, args, timestamp))
+    method = resolve_method(variant.method, variant.mode)
+    return f"{root}_{variant.mode}-{method}-{variant.block_width}x{variant.block_height}{ext}"
+
+
+def process_variants(image_path, args, log=print, grids=None):
+    """Все варианты --variant за одно декодирование и одну предобработку"""
+    try:
+        with stage('decode') as record:
+            image = Image.open(image_path)
+            record['bytes'] = os.path.getsize(image_path)
+            if args.resample != 'fast':
+                image.load()
+    except Exception as e:
+        log(f"Error opening image: {e}")
+        return []
+
+    with stage('variants', image_bytes(image)):
+        rendered = render_variants(image, args.variant, args.width, args.height, args.zoom, args.bright,
+                                   args.engine, args.abdc_strategy, args.abdc_clusters, args.contrast,
+                                   args.gamma, args.resample)
+    if grids is not None:
+        grids.extend(rendered)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    written = []
+    for variant, grid in zip(args.variant, rendered):
+        output_filename = variant_output_path(image_path, args, variant, timestamp)
+        output_dir = os.path.dirname(output_filename)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        save_grid(grid, output_filename)
+        log(f"Pixelated image saved to {output_filename}")
+        written += [output_filename] + write_matrices(grid, output_filename, args, log)
+    return written
+
+
+def process_image(image_path, args, log=print):
+    """Полный цикл для одного файла: открытие, обработка и запись всех выходов.
+
+    Возвращает список записанных файлов (пустой при ошибке открытия).
+    С --cache результат берётся из кэша или сохраняется в него.
+    """
+    if args.profile:
+        return profile_image(image_path, args, log)
+    mode = resolve_mode(args)
+    if args.cache is not None:
+        return process_cached(image_path, args, mode, log)
+    return render_outputs(image_path, args, mode, log)
+
+
+def profile_image(image_path, args, log=print):
+    """process_image с замерами этапов (--profile).
+
+    Отчёт (таблица или JSON-строки) уходит в log или дописывается в файл
+    --profile-out; в пакетном режиме - по отчёту на изображение.
+    """
+    with Profiler(image_path) as profiler:
+        with stage('total'):
+            written = process_image(image_path, argparse.Namespace(**dict(vars(args), profile=None)), log)
+    report = profiler.text() if args.profile == 'text' else profiler.json_lines().rstrip('\n')
+    if args.profile_out:
+        with open(args.profile_out, 'a', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        log(report)
+    return written
+
+
+def render_outputs(image_path, args, mode, log=print, grids=None):
+    """Обработка без кэша; grids, если передан, пополняется полученными BlockGrid"""
+    conflict = output_conflict(args)
+    if conflict:
+        log(f"Error: {conflict}")
+        return []
+    if args.variant:
+        return process_variants(image_path, args, log, grids)
+    if args.stream:
+        return stream_image(image_path, args, mode, log, grids)
 
     # Open image
     try:
-        image = Image.open(args.image_path)
+        with stage('decode') as record:
+            image = Image.open(image_path)
+            record['bytes'] = os.path.getsize(image_path)
+            if args.resample != 'fast':  # Для fast JPEG декодируется уже уменьшенным (draft)
+                image.load()
     except Exception as e:
-        print(f"Error opening image: {e}")
-        return
+        log(f"Error opening image: {e}")
+        return []
+
+    mask = None
+    if args.roi_mask:
+        try:
+            size = resized_size(image.size, args.width, args.height, args.zoom) or image.size
+            mask = load_roi_mask(args.roi_mask, size)
+        except Exception as e:
+            log(f"Error opening ROI mask: {e}")
+            return []
+
+    result = pixelate_source(image, args, mode, mask)
+
+    output_filename = output_path(image_path, args)
+    output_dir = os.path.dirname(output_filename)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    if isinstance(result, BlockGrid):
+        save_grid(result, output_filename)
+        log(f"Pixelated image saved to {output_filename}")
+        if grids is not None:
+            grids.append(result)
+        return [output_filename] + write_matrices(result, output_filename, args, log)
+
+    with stage('save') as record:
+        result.save(output_filename)
+        record['bytes'] = os.path.getsize(output_filename)
+    if isinstance(result, QuadTree):
+        log(f"Pixelated image saved to {output_filename} ({len(result)} blocks)")
+        return [output_filename] + write_quadtree_matrices(result, output_filename, args, log)
+    log(f"Pixelated image saved to {output_filename}")
+    return [output_filename]
+
+
+def pixelate_source(image, args, mode, mask=None):
+    """Обработка открытого изображения по опциям командной строки, без записи файлов.
+
+    Возвращает BlockGrid, QuadTree (--quadtree) или Image (--roi/--roi-mask;
+    mask - уже загруженная маска размера результата).
+    """
+    size = resized_size(image.size, args.width, args.height, args.zoom)
+    method = resolve_method(args.averating, mode)
+    roi = args.roi or mask is not None
+    if not (roi or args.quadtree) and args.resample == 'fast' and args.engine == 'vector' \
+            and area_supported(image, size, method):
+        # Сетка блоков прямо из исходника, без промежуточного изображения
+        with stage('pixelate', image_bytes(image)):
+            return area_grid(image, size, args.point_w, args.point_h, method,
+                             (args.bright, args.contrast, args.gamma))
 
     # Resize image
-    image = resize_image(image, args.width, args.height, args.zoom)
+    if size is not None:
+        with stage('resize', image_bytes(image)):
+            image = resize_image(image, args.width, args.height, args.zoom, args.resample)
 
-    # Apply brightness
-    if args.bright != 0:
-        image = apply_brightness(image, args.bright)
+    # Apply brightness, contrast and gamma
+    if not is_identity(args.bright, args.contrast, args.gamma):
+        with stage('tone', image_bytes(image)):
+            image = apply_brightness(image, args.bright, args.contrast, args.gamma)
 
     # Pixelate image
-    pixelated = pixelate_image(image, args.point_w, args.point_h, args.averating, mode)
+    with stage('pixelate', image_bytes(image)):
+        if roi:
+            return pixelate_roi(image, args.roi or (), mask, args.point_w, args.point_h, args.averating, mode,
+                                args.abdc_strategy, args.abdc_clusters)
+        if args.quadtree:
+            return pixelate_quadtree(image, args.point_w, args.point_h, args.averating, mode, args.quad_levels,
+                                     args.quad_threshold, args.abdc_strategy, args.abdc_clusters)
+        return pixelate_grid(image, args.point_w, args.point_h, args.averating, mode, args.engine,
+                             args.abdc_strategy, args.abdc_clusters, args.workers, args.workers_backend)
 
-    # Determine output filename
-    if args.out_name:
-        output_filename = args.out_name
-    else:
-        base_name = os.path.splitext(os.path.basename(args.image_path))[0]
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        prefix = args.out_prefix if args.out_prefix else 'pic_'
-        output_filename = f"{prefix}{base_name}_{timestamp}"
 
-    # Determine output extension
-    if args.out_type:
-        output_ext = args.out_type
-    else:
-        output_ext = os.path.splitext(args.image_path)[1][1:] or 'png'
+def quadtree_matrix_json(tree, args):
+    """Текст JSON-матрицы листьев --matrix-json"""
+    return json.dumps(generate_quadtree_json(tree, args.matrix_json),
+                      **({'separators': (',', ':')} if args.matrix_compact else {'indent': 2}))
 
-    # Save pixelated image
-    if args.out_type:
-        output_ext = args.out_type
-    else:
-        output_ext = os.path.splitext(args.image_path)[1][1:] or 'png'
 
-    if args.out_name:
-        output_filename = f"{args.out_name}.{output_ext}"
+def quadtree_matrix_txt(tree, args):
+    """Текст TXT-матрицы листьев --matrix-txt"""
+    palette = load_palette(args.palette_file) if args.palette_file else None
+    matcher = PaletteMatcher(palette or get_palette(args.matrix_txt), args.palette_lut)
+    return quadtree_text(tree, matcher.match(tree.colors).tolist())
+
+
+def write_quadtree_matrices(tree, output_filename, args, log=print):
+    """JSON/TXT матрицы листьев QuadTree; возвращает записанные файлы"""
+    written = []
+    if args.matrix_json:
+        json_path = f"{output_filename}.json"
+        with stage('matrix-json') as record:
+            with open(json_path, 'w') as f:
+                f.write(quadtree_matrix_json(tree, args))
+            record['bytes'] = os.path.getsize(json_path)
+        log(f"JSON matrix saved to {json_path}")
+        written.append(json_path)
+
+    if args.matrix_txt:
+        txt_path = f"{output_filename}.txt"
+        with stage('matrix-txt') as record:
+            with open(txt_path, 'w', encoding='utf-8') as f:
+                f.write(quadtree_matrix_txt(tree, args))
+            record['bytes'] = os.path.getsize(txt_path)
+        log(f"TXT matrix saved to {txt_path}")
+        written.append(txt_path)
+    return written
+
+
+def image_bytes(image):
+    """Объём пикселей изображения в байтах (для замеров --profile)"""
+    return image.width * image.height * len(image.getbands())
+
+
+def save_grid(grid, path):
+    """Сохраняет изображение сетки; этап 'save' для --profile"""
+    with stage('save') as record:
+        grid.save(path)
+        record['bytes'] = os.path.getsize(path)
+
+
+def cache_options(image_path, args, mode):
+    """Нормализованные параметры, от которых зависят выходные файлы (ключ --cache)"""
+    method = resolve_method(args.averating, mode)
+    options = {
+        'size': [args.width, args.height, args.zoom],
+        'bright': args.bright,
+        'tone': [args.contrast, args.gamma],
+        'resample': args.resample if not args.stream else 'lanczos',
+        'format': os.path.splitext(output_path(image_path, args, timestamp=''))[1],
+        'stream': args.stream,
+        'matrix_json': args.matrix_json,
+        'matrix_txt': args.matrix_txt,
+        'matrix_bin': args.matrix_bin,
+    }
+    if args.variant:
+        options['variants'] = [[v.mode, resolve_method(v.method, v.mode), v.block_width, v.block_height]
+                               for v in args.variant]
+        methods = [method for _, method, _, _ in options['variants']]
     else:
-        base_name = os.path.splitext(os.path.basename(args.image_path))[0]
+        options.update(mode=mode, method=method, block=[args.point_w, args.point_h])
+        methods = [method]
+    if args.quadtree:
+        options['quadtree'] = [args.quad_levels, args.quad_threshold]
+    if args.roi or args.roi_mask:
+        options['roi'] = [list(rect) for rect in args.roi or []]
+        options['roi_mask'] = file_digest(args.roi_mask) if args.roi_mask else None
+    if 'abdc' in methods or 'gray-abdc' in methods:
+        # Поблочный движок всегда считает abdc через sklearn; остальные методы от движка не зависят
+        options['abdc'] = 'sklearn' if args.engine == 'block' else [args.abdc_strategy, args.abdc_clusters]
+    if args.matrix_json or args.matrix_bin:
+        options['matrix_scope'] = args.matrix_scope
+    if args.matrix_json:
+        options['matrix_compact'] = args.matrix_compact
+    if args.matrix_txt:
+        # Точный поиск и полная таблица дают одно и то же
+        options['palette_lut'] = '32' if args.palette_lut == '32' else 'exact'
+        options['palette'] = file_digest(args.palette_file) if args.palette_file else None
+    return options
+
+
+def output_targets(image_path, args, timestamp=None):
+    """Имена изображений всех выходов запуска (по одному на вариант)"""
+    if timestamp is None:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        prefix = args.out_prefix if args.out_prefix else 'pic_'
-        output_filename = f"{prefix}{base_name}_{timestamp}.{output_ext}"
+    if args.variant:
+        return [variant_output_path(image_path, args, variant, timestamp) for variant in args.variant]
+    return [output_path(image_path, args, timestamp)]
 
-    output_path = output_filename  # Убираем автоматическое добавление .png
-    output_dir = os.path.dirname(output_path)
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    pixelated.save(output_path)
-    print(f"Pixelated image saved to {output_path}")
+
+def process_cached(image_path, args, mode, log=print):
+    """process_image через кэш результатов: при попадании файлы копируются из кэша"""
+    cache = ResultCache(args.cache, int(args.cache_mb * 1024 * 1024))
+    try:
+        with stage('cache-lookup', os.path.getsize(image_path)):
+            key = cache.key(image_path, cache_options(image_path, args, mode))
+            result = cache.get(key)
+    except OSError as e:
+        log(f"Error opening image: {e}")
+        return []
+
+    if result is not None:
+        with stage('cache-restore'):
+            written = cache.restore(result, output_targets(image_path, args))
+        for path in written:
+            log(f"Restored from cache: {path}")
+        if args.console:
+            for grid in result.grids:
+                show_console_preview(grid, args)
+        return written
+
+    grids = []
+    written = render_outputs(image_path, args, mode, log, grids)
+    if written:
+        with stage('cache-store'):
+            cache.put(key, grids, written)
+    return written
+
+
+def write_matrices(grid, output_filename, args, log=print):
+    """JSON/TXT матрицы и превью в консоли из BlockGrid; возвращает записанные файлы"""
+    written = []
 
     # Generate JSON matrix if requested
     if args.matrix_json:
-        json_data = generate_json_matrix(pixelated, args.matrix_json)
         json_path = f"{output_filename}.json"
-        with open(json_path, 'w') as f:
-            json.dump(json_data, f, indent=2)
-        print(f"JSON matrix saved to {json_path}")
+        with stage('matrix-json') as record:
+            save_json_matrix(grid, json_path, args.matrix_json, args.matrix_scope, args.matrix_compact)
+            record['bytes'] = os.path.getsize(json_path)
+        log(f"JSON matrix saved to {json_path}")
+        written.append(json_path)
+
+    # Generate binary matrix if requested
+    if args.matrix_bin:
+        bin_path = output_filename + MATRIX_BIN_SUFFIXES[args.matrix_bin]
+        try:
+            with stage('matrix-bin') as record:
+                save_matrix_bin(grid, bin_path, args.matrix_bin, args.matrix_scope)
+                record['bytes'] = os.path.getsize(bin_path)
+            log(f"Binary matrix saved to {bin_path}")
+            written.append(bin_path)
+        except Exception as e:
+            log(f"Error saving binary matrix: {e}")
 
     # Generate TXT matrix if requested
     if args.matrix_txt:
-        txt_data = generate_txt_matrix(pixelated, args.matrix_txt)
+        palette = load_palette(args.palette_file) if args.palette_file else None
         txt_path = f"{output_filename}.txt"
         try:
-            with open(txt_path, 'w', encoding='utf-8') as f:  # Явно указываем UTF-8
-                f.write(txt_data)
-            print(f"TXT matrix saved to {txt_path}")
+            with stage('matrix-txt') as record:
+                txt_data = generate_txt_matrix(grid, args.matrix_txt, palette_lut=args.palette_lut, palette=palette)
+                with open(txt_path, 'w', encoding='utf-8') as f:  # Явно указываем UTF-8
+                    f.write(txt_data)
+                record['bytes'] = os.path.getsize(txt_path)
+            log(f"TXT matrix saved to {txt_path}")
+            written.append(txt_path)
         except Exception as e:
-            print(f"Error saving TXT matrix: {e}")
+            log(f"Error saving TXT matrix: {e}")
 
     # Print console preview if requested
     if args.console:
+        with stage('console'):
+            show_console_preview(grid, args)
+
+    return written
+
+
+def show_console_preview(grid, args):
+    """Превью в консоли с рамкой и запасным выводом"""
+    try:
+        print('\n' + '=' * 50 + '\nConsole Preview:\n' + '=' * 50)
+        print_console_preview(grid, palette_lut=args.palette_lut, color=args.console_color)
+        print('=' * 50 + '\n')
+    except Exception as e:
+        print(f"\nError in console preview: {str(e)}")
+        print("Trying simplified output...")
+        # Фолбэк на ASCII-арт
+        grid.to_image().resize((50, 30)).convert('L').show()
+
+
+def stream_image(image_path, args, mode, log=print, grids=None):
+    """Потоковый вариант process_image: память ограничена бюджетом полосы"""
+    try:
+        reader = open_reader(image_path)
+    except Exception as e:
+        log(f"Error opening image: {e}")
+        return []
+
+    output_filename = output_path(image_path, args)
+    output_dir = os.path.dirname(output_filename)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    method = resolve_method(args.averating, mode)
+    grid_function = partial(compute_grid, method=method, abdc_strategy=args.abdc_strategy,
+                            abdc_clusters=args.abdc_clusters)
+    brightness = None
+    if not is_identity(args.bright, args.contrast, args.gamma):
+        brightness = partial(apply_brightness, brightness=args.bright, contrast=args.contrast, gamma=args.gamma)
+    size = resized_size(reader.size, args.width, args.height, args.zoom) or reader.size
+    with stage('stream', os.path.getsize(image_path)):
+        colors = stream_pixelate(reader, output_filename, size, args.point_w, args.point_h, grid_function,
+                                 brightness, int(args.strip_mb * 1024 * 1024))
+    log(f"Pixelated image saved to {output_filename}")
+    # Матрицы строятся по сетке: полноразмерный холст в память не попадает
+    grid = BlockGrid(colors, args.point_w, args.point_h, *size)
+    if grids is not None:
+        grids.append(grid)
+    return [output_filename] + write_matrices(grid, output_filename, args, log)
+
+
+def main():
+    if sys.argv[1:2] == ['serve']:
+        from pixelate_server import serve_main
+        serve_main(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ['video']:
+        from pixelate_video import video_main
+        video_main(sys.argv[2:])
+        return
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.stream and args.variant:
+        parser.error('--stream does not support --variant')
+    conflict = output_conflict(args)
+    if conflict:
+        parser.error(conflict)
+    if args.matrix_bin:
         try:
-            print('\n' + '=' * 50 + '\nConsole Preview:\n' + '=' * 50)
-            print_console_preview(pixelated)
-            print('=' * 50 + '\n')
-        except Exception as e:
-            print(f"\nError in console preview: {str(e)}")
-            print("Trying simplified output...")
-            # Фолбэк на ASCII-арт
-            pixelated.resize((50, 30)).convert('L').show()
+            matrix_compressor(args.matrix_bin)
+        except RuntimeError as e:
+            parser.error(str(e))
+    if args.manifest:
+        args.image_path.append('@' + args.manifest)
+
+    cache = ResultCache(args.cache or None) if args.cache is not None else None
+    before = cache.stats() if cache else None
+    inputs, batch = collect_inputs(args.image_path)
+    if not batch:
+        process_image(inputs[0], args)
+    else:
+        if args.out_name and '{name}' not in args.out_name and len(inputs) > 1:
+            parser.error('--out-name must contain {name} when processing several images')
+        if args.variant:
+            # Актуальность проверяется по первому варианту
+            outputs = partial(variant_output_path, variant=args.variant[0])
+        else:
+            outputs = output_path
+        try:
+            run_batch(inputs, process_image, args, outputs, args.jobs, args.force)
+        except ValueError as e:
+            parser.error(str(e))
+    if cache:
+        print(format_stats(cache.stats(), before))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,346 @@
+"""Асинхронный API пикселизации для сервисов на asyncio.
+
+    async with AsyncPixelator(workers=4, max_queue=16) as pixelator:
+        result = await pixelator.pixelate(data, {'point-w': 8, 'mode-grayscale': True, 'matrix-json': 'hex'})
+        result.data              # байты изображения (формат исходника или out-type)
+        result.matrices['json']  # матрицы --matrix-json/--matrix-txt/--matrix-bin байтами
+
+    result = await pixelate_async(data, options)  # общий пул по умолчанию
+
+Декодирование, обработка и кодирование идут в ограниченном пуле потоков,
+цикл событий не блокируется: NumPy, Pillow и OpenCV отпускают GIL на
+тяжёлых операциях. Вход - байты, путь, файловый объект, PIL.Image или
+массив; выход - байты в памяти, временных файлов нет. Опции - словарь с
+именами опций командной строки (без ведущих --) или argparse.Namespace.
+
+Обратное давление: на цикл событий принимается не больше workers +
+max_queue задач, следующие ждут места (или сразу получают PixelatorBusy
+при wait=False). Отмена задачи, ждущей потока, снимает её; идущая
+обработка прерывается на ближайшей границе этапов. Место освобождается,
+только когда поток действительно закончил, поэтому отменённые задачи не
+переполняют пул.
+
+Холст результата растягивается в массив, который поток исполнителя
+держит между вызовами, или в массив out вызывающего - тогда результат
+не кодируется, а возвращается в out.
+"""
+import argparse
+import asyncio
+import io
+import os
+import threading
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+from PIL import Image
+
+import pixelate
+from pixelate_engine import BlockGrid
+from pixelate_json import write_json_matrix
+from pixelate_matrix import dump_matrix, matrix_compressor
+from pixelate_palette import load_palette
+from pixelate_profile import stage
+from pixelate_quadtree import QuadTree
+
+# Опции, которые пишут файлы или печатают в консоль, и свои пулы на запрос,
+# обходящие ограничение исполнителя
+UNSUPPORTED_OPTIONS = ('out-prefix', 'out-name', 'console', 'stream', 'variant', 'cache', 'cache-mb',
+                       'profile', 'profile-out', 'manifest', 'jobs', 'force', 'workers', 'workers-backend')
+
+# Сколько холстов разного размера поток исполнителя держит между вызовами
+CACHED_CANVASES = 4
+
+# data/content_type - закодированное изображение (None, если передан out);
+# array - out с результатом; matrices - {'json' | 'txt' | 'bin': bytes}
+PixelateResult = namedtuple('PixelateResult', ['data', 'content_type', 'array', 'width', 'height', 'matrices'])
+
+
+class PixelatorBusy(Exception):
+    """Очередь пула заполнена, а задача подана с wait=False"""
+
+
+class _Interrupted(Exception):
+    """Обработка отменённой задачи остановлена на границе этапов"""
+
+
+class _OptionsParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise ValueError(message)
+
+
+_parser = None
+_worker = threading.local()
+
+
+def options_parser():
+    global _parser
+    if _parser is None:
+        _parser = pixelate.build_parser(_OptionsParser)
+    return _parser
+
+
+def parse_options(options=None):
+    """Namespace опций командной строки из словаря {имя опции: значение}.
+
+    Имена - как в командной строке без ведущих -- (можно через _). Флаг
+    включается истинным значением, None и False опцию опускают, список
+    повторяет её; кортеж чисел (Rect) записывается как X,Y,W,H.
+    Namespace копируется как есть. Неверные опции - ValueError.
+    """
+    parser = options_parser()
+    if isinstance(options, argparse.Namespace):
+        args = argparse.Namespace(**vars(options))
+    else:
+        argv = []
+        for name, value in (options or {}).items():
+            name = name.replace('_', '-')
+            action = parser._option_string_actions.get('--' + name)
+            if action is None:
+                raise ValueError(f"unknown option '{name}'")
+            if value is None or value is False:
+                continue
+            for item in value if isinstance(value, list) else [value]:
+                if item is True:
+                    argv.append('--' + name)
+                elif isinstance(item, tuple):
+                    argv.append(f"--{name}={','.join(str(part) for part in item)}")
+                else:
+                    argv.append(f"--{name}={item}")
+        args = parser.parse_args(['buffer'] + argv)
+
+    for name in UNSUPPORTED_OPTIONS:
+        attribute = name.replace('-', '_')
+        if getattr(args, attribute, None) != parser.get_default(attribute):
+            raise ValueError(f"option '{name}' is not available in the async API")
+    conflict = pixelate.output_conflict(args)
+    if conflict:
+        raise ValueError(conflict)
+    if args.matrix_bin:
+        try:
+            matrix_compressor(args.matrix_bin)
+        except RuntimeError as e:
+            raise ValueError(str(e)) from None
+    output_format(args)
+    return args
+
+
+def output_format(args, image=None):
+    """Формат Pillow результата: по --out-type, иначе формат исходника, иначе PNG"""
+    if args.out_type:
+        fmt = Image.registered_extensions().get('.' + args.out_type.lower())
+        if fmt is None:
+            raise ValueError(f"unknown output type '{args.out_type}'")
+        return fmt
+    return (image.format if image is not None else None) or 'PNG'
+
+
+def open_image(source):
+    """PIL.Image из байтов, пути, файлового объекта, PIL.Image или массива uint8"""
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, np.ndarray):
+        return Image.fromarray(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def load_mask(mask, size):
+    """Маска ROI размера size из того же, что принимает open_image; массив - как есть"""
+    if isinstance(mask, np.ndarray):
+        return mask
+    mask = open_image(mask).convert('L')
+    if mask.size != size:
+        mask = mask.resize(size, Image.NEAREST)
+    return mask
+
+
+def worker_canvas(width, height):
+    """Холст (height, width, 3) uint8 потока исполнителя, общий для его вызовов.
+
+    Поток занят одной задачей, а изображение из холста Pillow копирует,
+    поэтому к следующему вызову холст свободен. Держится CACHED_CANVASES
+    последних размеров.
+    """
+    canvases = getattr(_worker, 'canvases', None)
+    if canvases is None:
+        canvases = _worker.canvases = {}
+    canvas = canvases.pop((width, height), None)
+    if canvas is None:
+        canvas = np.empty((height, width, 3), dtype=np.uint8)
+    canvases[(width, height)] = canvas
+    while len(canvases) > CACHED_CANVASES:
+        del canvases[next(iter(canvases))]
+    return canvas
+
+
+def matrix_buffers(result, args):
+    """Матрицы --matrix-json/--matrix-txt/--matrix-bin результата байтами"""
+    matrices = {}
+    if isinstance(result, QuadTree):
+        if args.matrix_json:
+            with stage('matrix-json'):
+                matrices['json'] = pixelate.quadtree_matrix_json(result, args).encode('utf-8')
+        if args.matrix_txt:
+            with stage('matrix-txt'):
+                matrices['txt'] = pixelate.quadtree_matrix_txt(result, args).encode('utf-8')
+        return matrices
+    if not isinstance(result, BlockGrid):
+        return matrices
+
+    if args.matrix_json:
+        with stage('matrix-json'):
+            text = io.StringIO()
+            rows, width, height, channels, geometry = pixelate.matrix_source(result, args.matrix_scope)
+            write_json_matrix(text, rows, width, height, channels, args.matrix_json, geometry, args.matrix_compact)
+            matrices['json'] = text.getvalue().encode('utf-8')
+    if args.matrix_bin:
+        with stage('matrix-bin'):
+            binary = io.BytesIO()
+            rows, width, height, channels, geometry = pixelate.matrix_source(result, args.matrix_scope)
+            dump_matrix(binary, rows, width, height, channels, args.matrix_bin, geometry)
+            matrices['bin'] = binary.getvalue()
+    if args.matrix_txt:
+        with stage('matrix-txt'):
+            palette = load_palette(args.palette_file) if args.palette_file else None
+            matrices['txt'] = pixelate.generate_txt_matrix(result, args.matrix_txt, palette_lut=args.palette_lut,
+                                                           palette=palette).encode('utf-8')
+    return matrices
+
+
+def render_buffers(source, args, mask=None, out=None, cancelled=None):
+    """Задача исполнителя: PixelateResult для source по опциям args (см. parse_options).
+
+    cancelled - threading.Event; когда он выставлен, обработка прерывается
+    на ближайшей границе этапов.
+    """
+    def checkpoint():
+        if cancelled is not None and cancelled.is_set():
+            raise _Interrupted()
+
+    mode = pixelate.resolve_mode(args)
+    with stage('decode'):
+        image = open_image(source)
+        if args.resample != 'fast':
+            image.load()
+    fmt = output_format(args, image)
+    if mask is None and args.roi_mask:
+        mask = args.roi_mask
+    if mask is not None:
+        mask = load_mask(mask, pixelate.resized_size(image.size, args.width, args.height, args.zoom) or image.size)
+    checkpoint()
+
+    result = pixelate.pixelate_source(image, args, mode, mask)
+    width, height = result.size
+    checkpoint()
+    matrices = matrix_buffers(result, args)
+
+    if out is not None:
+        if out.shape != (height, width, 3) or out.dtype != np.uint8:
+            raise ValueError(f"out must be a ({height}, {width}, 3) uint8 array")
+        if isinstance(result, Image.Image):
+            np.copyto(out, np.asarray(result.convert('RGB')))
+        else:
+            result.to_array(out)
+        return PixelateResult(None, None, out, width, height, matrices)
+
+    if not isinstance(result, Image.Image):
+        result = result.to_image(worker_canvas(width, height))
+    checkpoint()
+    with stage('save') as record:
+        buffer = io.BytesIO()
+        result.save(buffer, fmt)
+        record['bytes'] = buffer.tell()
+    return PixelateResult(buffer.getvalue(), Image.MIME.get(fmt, 'application/octet-stream'), None, width, height,
+                          matrices)
+
+
+def _release(loop, slots, future):
+    try:
+        loop.call_soon_threadsafe(slots.release)
+    except RuntimeError:
+        pass  # цикл событий уже закрыт
+
+
+class AsyncPixelator:
+    """Пул потоков пикселизации для asyncio с ограниченной очередью.
+
+    workers - число потоков (по умолчанию число процессоров), max_queue -
+    сколько задач сверх workers может ждать потока. Ограничение действует
+    отдельно для каждого цикла событий.
+    """
+
+    def __init__(self, workers=None, max_queue=16):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = self.workers + max_queue
+        self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix='pixelate')
+        self._slots = weakref.WeakKeyDictionary()
+
+    def _loop_slots(self):
+        loop = asyncio.get_running_loop()
+        slots = self._slots.get(loop)
+        if slots is None:
+            slots = self._slots[loop] = asyncio.Semaphore(self.max_pending)
+        return loop, slots
+
+    async def pixelate(self, source, options=None, *, mask=None, out=None, wait=True):
+        """PixelateResult для source с опциями options (см. parse_options).
+
+        mask - маска ROI (байты, путь, изображение или массив) вместо
+        --roi-mask. out - массив (H, W, 3) uint8 размера результата: холст
+        пишется в него и не кодируется; при отмене вызов возвращается после
+        остановки потока, чтобы out снова принадлежал вызывающему.
+        wait=False - PixelatorBusy вместо ожидания места в очереди.
+        """
+        args = parse_options(options)
+        loop, slots = self._loop_slots()
+        if not wait and slots.locked():
+            raise PixelatorBusy(f"{self.max_pending} tasks already pending")
+        await slots.acquire()
+        cancelled = threading.Event()
+        try:
+            future = self.executor.submit(render_buffers, source, args, mask, out, cancelled)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(partial(_release, loop, slots))
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            cancelled.set()
+            if out is not None and not future.done():
+                await asyncio.gather(asyncio.wrap_future(future), return_exceptions=True)
+            raise
+
+    def close(self):
+        """Снимает ждущие задачи, не дожидаясь идущих"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def aclose(self):
+        """Снимает ждущие задачи и дожидается идущих, не блокируя цикл событий"""
+        await asyncio.to_thread(self.executor.shutdown, True, cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+_default = None
+
+
+def default_pixelator():
+    """Общий AsyncPixelator с настройками по умолчанию (создаётся при первом вызове)"""
+    global _default
+    if _default is None:
+        _default = AsyncPixelator()
+    return _default
+
+
+async def pixelate_async(source, options=None, *, mask=None, out=None, wait=True, pixelator=None):
+    """await pixelate_async(data, {'point-w': 8}) - AsyncPixelator.pixelate общего или своего пула"""
+    return await (pixelator or default_pixelator()).pixelate(source, options, mask=mask, out=out, wait=wait)
@@ -0,0 +1,170 @@
+"""Пакетный режим: много изображений за один запуск интерпретатора.
+
+Входы - файлы, каталоги, glob-шаблоны и файлы-манифесты (@list.txt, по
+одному пути в строке). Изображения раздаются постоянному пулу процессов,
+результаты выводятся по мере готовности, уже актуальные выходы
+пропускаются, в конце печатается сводка о производительности.
+"""
+import glob
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pixelate_matrix import MATRIX_BIN_SUFFIXES
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff', '.webp')
+
+
+def read_manifest(path):
+    """Пути из манифеста; пустые строки и # комментарии пропускаются.
+
+    Относительные пути считаются от каталога манифеста.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                entries.append(line if os.path.isabs(line) else os.path.join(base_dir, line))
+    return entries
+
+
+def _list_directory(path):
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(path, name)))
+
+
+def collect_inputs(paths):
+    """Разворачивает аргументы в список файлов.
+
+    Возвращает (files, batch): batch=False только для единственного
+    явно указанного файла - тогда поведение как у обычного запуска.
+    """
+    files = []
+    batch = len(paths) > 1
+    for path in paths:
+        if path.startswith('@'):
+            batch = True
+            manifest_files, _ = collect_inputs(read_manifest(path[1:]))
+            files.extend(manifest_files)
+        elif os.path.isdir(path):
+            batch = True
+            files.extend(_list_directory(path))
+        elif glob.has_magic(path):
+            batch = True
+            files.extend(sorted(p for p in glob.glob(path, recursive=True) if os.path.isfile(p)))
+        else:
+            files.append(path)
+
+    # Один и тот же файл может попасть из нескольких источников
+    seen = set()
+    unique = []
+    for path in files:
+        key = os.path.abspath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique, batch
+
+
+def _existing_outputs(image_path, args, output_path):
+    """Кандидаты на уже записанный результат для image_path"""
+    if args.out_name:
+        return [output_path(image_path, args)]
+    # Имя с отметкой времени: подходит любой прошлый запуск с тем же префиксом
+    pattern = output_path(image_path, args, timestamp='[0-9]' * 8 + '_' + '[0-9]' * 6)
+    head, tail = os.path.split(pattern)
+    return glob.glob(os.path.join(glob.escape(head), tail))
+
+
+def is_up_to_date(image_path, args, output_path):
+    """True, если все запрошенные выходы есть и не старше исходного файла"""
+    source_mtime = os.path.getmtime(image_path)
+    for image_output in _existing_outputs(image_path, args, output_path):
+        required = [image_output]
+        if args.matrix_json:
+            required.append(f"{image_output}.json")
+        if args.matrix_bin:
+            required.append(image_output + MATRIX_BIN_SUFFIXES[args.matrix_bin])
+        if args.matrix_txt:
+            required.append(f"{image_output}.txt")
+        if all(os.path.exists(p) and os.path.getmtime(p) >= source_mtime for p in required):
+            return True
+    return False
+
+
+def output_collisions(inputs, args, output_path):
+    """Входы, которые пишут в один и тот же выход: {выход: [пути]}.
+
+    {name} в --out-name и имя с отметкой времени берут только имя файла
+    без каталога, поэтому a/img.png и b/img.png попадают в один выход.
+    """
+    targets = {}
+    for image_path in inputs:
+        target = os.path.abspath(output_path(image_path, args, timestamp=''))
+        targets.setdefault(target, []).append(image_path)
+    return {target: paths for target, paths in targets.items() if len(paths) > 1}
+
+
+def _process_logged(process, image_path, args):
+    """Задача пула: сообщения копятся и печатаются родителем целиком"""
+    log = io.StringIO()
+    try:
+        written = process(image_path, args, log=lambda message: print(message, file=log))
+    except Exception as e:
+        print(f"Error processing {image_path}: {e}", file=log)
+        written = []
+    return written, log.getvalue()
+
+
+def run_batch(inputs, process, args, output_path, jobs=1, force=False):
+    """Обрабатывает inputs функцией process(image_path, args, log) в пуле из jobs процессов.
+
+    output_path(image_path, args, timestamp=None) - схема имён выходов,
+    по ней проверяется актуальность. Возвращает (processed, skipped, failed).
+    ValueError - несколько входов пишут в один выход (см. output_collisions).
+    """
+    collisions = output_collisions(inputs, args, output_path)
+    if collisions:
+        paths = next(iter(collisions.values()))
+        more = f" (and {len(collisions) - 1} more)" if len(collisions) > 1 else ''
+        raise ValueError(f"{', '.join(paths)} would write the same output file{more}; "
+                         f"rename the inputs or process their directories separately")
+    start = time.perf_counter()
+    pending = []
+    skipped = 0
+    for image_path in inputs:
+        if not force and os.path.isfile(image_path) and is_up_to_date(image_path, args, output_path):
+            skipped += 1
+        else:
+            pending.append(image_path)
+
+    processed = failed = 0
+    source_bytes = 0
+
+    def report(image_path, written, messages):
+        nonlocal processed, failed, source_bytes
+        print(messages, end='', flush=True)
+        if written:
+            processed += 1
+            source_bytes += os.path.getsize(image_path)
+        else:
+            failed += 1
+
+    if jobs > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(min(jobs, len(pending))) as pool:
+            futures = {pool.submit(_process_logged, process, path, args): path for path in pending}
+            for future in as_completed(futures):
+                report(futures[future], *future.result())
+    else:
+        for image_path in pending:
+            report(image_path, *_process_logged(process, image_path, args))
+
+    elapsed = time.perf_counter() - start
+    rate = processed / elapsed if elapsed else 0.0
+    throughput = source_bytes / elapsed / 1e6 if elapsed else 0.0
+    print(f"Batch done: {processed} processed, {skipped} up to date, {failed} failed "
+          f"in {elapsed:.2f}s ({rate:.2f} images/s, {throughput:.2f} MB/s)")
+    return processed, skipped, failed
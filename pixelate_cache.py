@@ -0,0 +1,263 @@
+"""Кэш результатов с адресацией по содержимому (--cache).
+
+Ключ - SHA-256 от байтов исходного файла и нормализованных параметров
+запуска (размер, яркость, блок, метод, режим, форматы выходов). Запись
+хранит сетки блоков (.npy) и уже закодированные выходные файлы, поэтому
+попадание в кэш обходится без декодирования и пикселизации: файлы просто
+копируются под новыми именами.
+
+Размер кэша ограничен: после каждой записи самые давно использованные
+записи удаляются, пока общий объём не станет меньше лимита (при
+попадании время использования записи обновляется). Попадания, промахи и
+вытеснения дописываются по одному байту в журнал events (дозапись в
+O_APPEND атомарна), так что статистика общая для всех процессов пула.
+Журнал длиннее EVENTS_COMPACT_BYTES сворачивается в маленький файл
+счётчиков counters.json: дозаписи идут под разделяемой блокировкой
+events.lock, свёртка и чтение статистики - под исключительной и
+разделяемой, поэтому события не теряются и не считаются дважды.
+"""
+import hashlib
+import json
+import os
+import shutil
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: только исключительная блокировка
+    fcntl = None
+    import msvcrt
+
+import numpy as np
+
+from pixelate_engine import BlockGrid
+
+# Меняется при изменении формата записи или результатов пикселизации
+CACHE_VERSION = 2
+DEFAULT_MAX_BYTES = 1 << 30
+
+_EVENTS = {'hit': b'h', 'miss': b'm', 'evict': b'e'}
+_COUNTERS = {'hits': b'h', 'misses': b'm', 'evictions': b'e'}
+# Журнал событий длиннее стольких байт сворачивается в counters.json
+EVENTS_COMPACT_BYTES = 4096
+
+# grids - сетки BlockGrid; files - [(номер выхода, суффикс, путь в кэше)]
+CachedResult = namedtuple('CachedResult', ['grids', 'files'])
+
+
+def default_cache_dir():
+    return os.path.join(os.environ.get('PIXELATE_CACHE_DIR')
+                        or os.path.join(os.path.expanduser('~'), '.cache', 'pixelate'), 'results')
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def group_outputs(written):
+    """[(номер выхода, суффикс)] для списка записанных файлов.
+
+    Каждый выход - изображение и его матрицы, чьи имена начинаются с
+    имени изображения (out.png, out.png.json, ...).
+    """
+    groups = []
+    base = None
+    index = -1
+    for path in written:
+        if base is None or not path.startswith(base):
+            base = path
+            index += 1
+        groups.append((index, path[len(base):]))
+    return groups
+
+
+class ResultCache:
+    """Дисковый LRU-кэш результатов, ограниченный max_bytes"""
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+
+    def key(self, source, options):
+        """Ключ записи: исходный файл (путь) или байты и словарь параметров"""
+        digest = file_digest(source) if isinstance(source, str) else hashlib.sha256(source).hexdigest()
+        normalized = json.dumps(dict(options, cache_version=CACHE_VERSION), sort_keys=True)
+        return hashlib.sha256(f"{digest}\n{normalized}".encode('utf-8')).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        """Блокировка журнала событий между процессами (events.lock)"""
+        fd = os.open(os.path.join(self.directory, 'events.lock'), os.O_RDWR | os.O_CREAT)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            yield
+        finally:
+            if fcntl is None:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            os.close(fd)
+
+    def _record(self, event, count=1):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with self._locked():
+                fd = os.open(os.path.join(self.directory, 'events'), os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+                try:
+                    os.write(fd, _EVENTS[event] * count)
+                    size = os.fstat(fd).st_size
+                finally:
+                    os.close(fd)
+            if size > EVENTS_COMPACT_BYTES:
+                self._compact()
+        except OSError:
+            pass
+
+    def _counters(self):
+        """Счётчики: свёрнутые в counters.json плюс ещё не свёрнутый журнал (под блокировкой)"""
+        try:
+            with open(os.path.join(self.directory, 'counters.json'), encoding='utf-8') as f:
+                counters = json.load(f)
+        except (OSError, ValueError):
+            counters = {}
+        try:
+            with open(os.path.join(self.directory, 'events'), 'rb') as f:
+                events = f.read()
+        except OSError:
+            events = b''
+        return {name: counters.get(name, 0) + events.count(code) for name, code in _COUNTERS.items()}
+
+    def _compact(self):
+        """Сворачивает журнал событий в counters.json и очищает его"""
+        with self._locked(exclusive=True):
+            path = os.path.join(self.directory, 'events')
+            if os.path.getsize(path) <= EVENTS_COMPACT_BYTES:
+                return  # Уже свёрнут другим процессом
+            counters = self._counters()
+            temporary = os.path.join(self.directory, f"counters.json.{os.getpid()}.tmp")
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump(counters, f)
+            os.replace(temporary, os.path.join(self.directory, 'counters.json'))
+            open(path, 'wb').close()
+
+    def get(self, key):
+        """CachedResult или None; учитывается в статистике как попадание или промах"""
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            grids = [BlockGrid(np.load(os.path.join(entry, f"grid-{i}.npy")), *geometry)
+                     for i, geometry in enumerate(meta['grids'])]
+            os.utime(entry)
+        except (OSError, ValueError, KeyError):
+            self._record('miss')
+            return None
+        self._record('hit')
+        files = [(index, suffix, os.path.join(entry, f"{index}{suffix}")) for index, suffix in meta['files']]
+        return CachedResult(grids, files)
+
+    def put(self, key, grids, written):
+        """Сохраняет сетки и записанные файлы (список путей в порядке записи)"""
+        entry = self._entry(key)
+        temporary = f"{entry}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(temporary, exist_ok=True)
+            files = group_outputs(written)
+            for (index, suffix), path in zip(files, written):
+                shutil.copyfile(path, os.path.join(temporary, f"{index}{suffix}"))
+            for i, grid in enumerate(grids):
+                np.save(os.path.join(temporary, f"grid-{i}.npy"), grid.colors)
+            meta = {'grids': [[g.block_width, g.block_height, g.width, g.height] for g in grids],
+                    'files': files,
+                    'bytes': sum(os.path.getsize(os.path.join(temporary, name)) for name in os.listdir(temporary))}
+            with open(os.path.join(temporary, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            if os.path.exists(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+            os.replace(temporary, entry)
+        except OSError:
+            shutil.rmtree(temporary, ignore_errors=True)
+            return
+        self.evict()
+
+    def restore(self, result, targets):
+        """Копирует файлы записи под имена targets[номер выхода]; возвращает записанные пути"""
+        written = []
+        for index, suffix, path in result.files:
+            target = targets[index] + suffix
+            target_dir = os.path.dirname(target)
+            if target_dir and not os.path.exists(target_dir):
+                os.makedirs(target_dir)
+            shutil.copyfile(path, target)
+            written.append(target)
+        return written
+
+    def entries(self):
+        """[(время использования, байт, путь)] всех записей"""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    with open(os.path.join(entry.path, 'meta.json'), encoding='utf-8') as f:
+                        size = json.load(f)['bytes']
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except (OSError, ValueError, KeyError):
+                    continue
+        return entries
+
+    def evict(self):
+        """Удаляет давно использованные записи сверх max_bytes; возвращает число удалённых"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(path))  # Пустой каталог-шард
+            except OSError:
+                pass
+            total -= size
+            evicted += 1
+        if evicted:
+            self._record('evict', evicted)
+        return evicted
+
+    def stats(self):
+        """Накопленная статистика: попадания, промахи, вытеснения, число записей и объём"""
+        counters = dict.fromkeys(_COUNTERS, 0)
+        if os.path.isdir(self.directory):
+            try:
+                with self._locked():
+                    counters = self._counters()
+            except OSError:
+                pass
+        entries = self.entries()
+        return dict(counters, entries=len(entries), bytes=sum(size for _, size, _ in entries))
+
+
+def format_stats(stats, previous=None):
+    """Строка статистики; previous - снимок до запуска, чтобы показать только его события"""
+    counts = {name: stats[name] - (previous or {}).get(name, 0) for name in ('hits', 'misses', 'evictions')}
+    lookups = counts['hits'] + counts['misses']
+    rate = counts['hits'] / lookups * 100 if lookups else 0.0
+    return (f"Cache: {counts['hits']} hits, {counts['misses']} misses ({rate:.0f}% hit rate), "
+            f"{counts['evictions']} evicted, {stats['entries']} entries, {stats['bytes'] / 1e6:.1f} MB")
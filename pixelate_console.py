@@ -0,0 +1,53 @@
+"""24-битное цветное превью в консоли (--console-color truecolor).
+
+Каждый символ - верхняя половина блока '▀': цвет текста - верхний блок,
+цвет фона - нижний, поэтому по вертикали помещается вдвое больше блоков.
+Текст собирается векторно из полей фиксированной ширины, как JSON-матрицы
+в pixelate_json: escape-последовательности всех ячеек склеиваются
+NumPy-маской в один буфер без цикла по ячейкам.
+"""
+import numpy as np
+
+from pixelate_json import _choice, _const, _decimal_table, _lookup, _render
+
+CONSOLE_COLORS = ('palette', 'truecolor')
+
+UPPER_HALF = '▀'
+RESET = '\x1b[0m'
+
+
+def _utf8_const(text):
+    encoded = np.frombuffer(text.encode('utf-8'), dtype=np.uint8)
+    return encoded[None, :], np.array([len(encoded)]), None
+
+
+def truecolor_text(colors):
+    """Текст превью для цветов блоков (rows, cols, 3): по строке на две строки блоков"""
+    colors = np.asarray(colors, dtype=np.uint8)
+    rows, cols = colors.shape[:2]
+    if rows % 2:
+        # Нечётная строка: нижняя половина последней строки - фон терминала
+        colors = np.concatenate([colors, np.zeros((1, cols, 3), dtype=np.uint8)])
+    top = colors[0::2].reshape(-1, 3)
+    bottom = colors[1::2].reshape(-1, 3)
+    count = len(top)
+    decimal = _decimal_table(256)
+
+    last_row = np.zeros(count, dtype=np.intp)
+    if rows % 2:
+        last_row[-cols:] = 1
+    line_end = np.zeros(count, dtype=np.intp)
+    line_end[cols - 1::cols] = 1
+
+    # Значение нижнего блока; в последней нечётной строке - пусто (фон по умолчанию)
+    optional = [str(v) for v in range(256)] + ['']
+
+    fields = [_const('\x1b[38;2;')]
+    for c in range(3):
+        fields += [_lookup(decimal, top[:, c]), _const(';' if c < 2 else '')]
+    fields.append(_choice([';48;2;', ';49'], last_row))
+    for c in range(3):
+        fields += [_choice(optional, np.where(last_row, 256, bottom[:, c].astype(np.intp))),
+                   _choice([';' if c < 2 else '', ''], last_row)]
+    fields += [_const('m'), _utf8_const(UPPER_HALF), _choice(['', RESET + '\n'], line_end)]
+    return _render(fields, count).decode('utf-8')
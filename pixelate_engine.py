@@ -0,0 +1,356 @@
+"""Векторизованный движок блочной пикселизации.
+
+Изображение один раз превращается в массив (H, W, 3), сетка блоков
+представляется видом (rows, cols, bh, bw, 3) без копирования, а статистика
+всех блоков считается одним пакетным вызовом NumPy. Неполные блоки по
+правому и нижнему краю обрабатываются отдельными областями той же формы.
+
+Результат побитово совпадает с поблочными функциями average_block_*
+из pixelate.py: суммы целых в float64 точны, поэтому sum / n даёт то же
+число, что и np.mean, а медиана (pixelate_median) совпадает с np.median.
+"""
+import numpy as np
+from PIL import Image
+
+from pixelate_median import block_median, block_median_all
+
+
+def image_to_array(image):
+    """Приводит изображение к массиву (H, W, 3) uint8 так же, как поблочный код"""
+    arr = np.asarray(image)
+    if arr.ndim == 2:  # Grayscale (H,W) -> (H,W,3)
+        arr = np.stack([arr] * 3, axis=-1)
+    elif arr.shape[-1] == 4:  # RGBA -> RGB
+        arr = arr[..., :3]
+    if arr.dtype != np.uint8:
+        arr = np.clip(arr, 0, 255).astype(np.uint8)
+    return arr
+
+
+def grid_shape(width, height, block_width, block_height):
+    """Размер сетки блоков (rows, cols) с учётом неполных блоков на краях"""
+    return -(-height // block_height), -(-width // block_width)
+
+
+def iter_block_regions(arr, block_width, block_height):
+    """Делит массив на области с блоками одинакового размера.
+
+    Возвращает тройки (rows, cols, blocks), где rows/cols - срезы сетки,
+    а blocks - вид формы (R, C, bh, bw, ch) на исходный массив. Областей
+    не больше четырёх: целые блоки, правый край, нижний край и угол.
+    """
+    height, width = arr.shape[:2]
+    channels = arr.shape[2:]
+    full_rows, rest_h = divmod(height, block_height)
+    full_cols, rest_w = divmod(width, block_width)
+
+    row_parts = [(0, full_rows, block_height)] if full_rows else []
+    if rest_h:
+        row_parts.append((full_rows, full_rows + 1, rest_h))
+    col_parts = [(0, full_cols, block_width)] if full_cols else []
+    if rest_w:
+        col_parts.append((full_cols, full_cols + 1, rest_w))
+
+    for r0, r1, bh in row_parts:
+        y0 = r0 * block_height
+        y1 = y0 + (r1 - r0) * bh
+        for c0, c1, bw in col_parts:
+            x0 = c0 * block_width
+            x1 = x0 + (c1 - c0) * bw
+            region = arr[y0:y1, x0:x1]
+            blocks = region.reshape((r1 - r0, bh, c1 - c0, bw) + channels).swapaxes(1, 2)
+            yield slice(r0, r1), slice(c0, c1), blocks
+
+
+def block_reduce(values, block_width, block_height, ufunc=np.add, dtype=None):
+    """Свёртка ufunc значений (H, W, ch) по блокам сетки: (rows, cols, ch).
+
+    Сначала сворачиваются строки пикселей внутри строки блоков - это
+    непрерывные строки массива, - затем столбцы уже уменьшенного массива.
+    """
+    height, width, channels = values.shape
+    flat = values.reshape(height, width * channels)
+    full = height // block_height * block_height
+    parts = []
+    if full:
+        parts.append(ufunc.reduce(flat[:full].reshape(-1, block_height, width * channels), axis=1, dtype=dtype))
+    if full < height:
+        parts.append(ufunc.reduce(flat[full:], axis=0, keepdims=True, dtype=dtype))
+    rows = np.concatenate(parts) if len(parts) > 1 else parts[0]
+    return ufunc.reduceat(rows.reshape(len(rows), width, channels), np.arange(0, width, block_width), axis=1)
+
+
+def _block_count(blocks):
+    return blocks.shape[2] * blocks.shape[3]
+
+
+def _block_mean(blocks):
+    """np.mean(block, axis=(0, 1)) для каждого блока"""
+    return blocks.sum(axis=(2, 3), dtype=np.int64) / _block_count(blocks)
+
+
+def _block_mean_all(blocks):
+    """np.mean(block) по всем каналам для каждого блока"""
+    return blocks.sum(axis=(2, 3, 4), dtype=np.int64) / (_block_count(blocks) * blocks.shape[4])
+
+
+def _block_gray_wav(blocks):
+    mean = _block_mean(blocks)
+    r, g, b = mean[..., 0], mean[..., 1], mean[..., 2]
+    return 0.299 * r + 0.587 * g + 0.114 * b
+
+
+def _block_blwt(blocks):
+    white_pixels = np.count_nonzero(blocks >= 128, axis=(2, 3, 4))
+    return 255 * (white_pixels / _block_count(blocks))
+
+
+def _threshold(values, threshold=128):
+    return np.where(values >= threshold, 255, 0)
+
+
+def reduce_amac(blocks):
+    return _block_mean(blocks).astype(int)
+
+
+def reduce_meav(blocks):
+    return block_median(blocks).astype(int)
+
+
+def reduce_gray_mb(blocks):
+    return block_median_all(blocks)
+
+
+def reduce_bin_tc(blocks):
+    return _threshold(_block_gray_wav(blocks))
+
+
+def reduce_blwt_tc(blocks):
+    return _threshold(_block_blwt(blocks))
+
+
+# Пакетные аналоги average_block_*: блоки (R, C, bh, bw, 3) -> значения
+# (R, C, 3) либо (R, C) для оттенков серого.
+BLOCK_REDUCERS = {
+    'amac': reduce_amac,
+    'meav': reduce_meav,
+    'gray-rgb': _block_mean_all,
+    'gray-wav': _block_gray_wav,
+    'gray-tc': _block_mean_all,
+    'gray-mb': reduce_gray_mb,
+    'bin-tc': reduce_bin_tc,
+    'bin-mb': reduce_bin_tc,
+    'blwt': _block_blwt,
+    'blwt-tc': reduce_blwt_tc,
+}
+
+
+# Цветовые пространства: прямое и обратное преобразование OpenCV (имена
+# констант cv2 - сам модуль загружается только для методов HSV/LAB)
+COLOR_SPACES = {
+    'hsv': ('COLOR_RGB2HSV', 'COLOR_HSV2RGB'),
+    'lab': ('COLOR_RGB2LAB', 'COLOR_LAB2RGB'),
+}
+
+
+def _cvt_color(arr, space, inverse=False):
+    import cv2
+    return cv2.cvtColor(arr, getattr(cv2, COLOR_SPACES[space][int(inverse)]))
+
+
+def convert_color_space(arr, space):
+    """Переводит всё изображение в HSV/LAB одним вызовом cvtColor.
+
+    Преобразование попиксельное, поэтому результат совпадает с переводом
+    каждого блока по отдельности.
+    """
+    return _cvt_color(np.ascontiguousarray(arr), space)
+
+
+def _space_mean(blocks):
+    return _block_mean(blocks).astype(np.uint8)
+
+
+def _channel_mean(channel):
+    def reduce(blocks):
+        return _block_mean(blocks[..., channel:channel + 1])[..., 0]
+    return reduce
+
+
+# Методы, усредняющие в другом цветовом пространстве:
+# метод -> (пространство, редьюсер по блокам, обратное преобразование сетки)
+SPACE_REDUCERS = {
+    'aocs-hsv': ('hsv', _space_mean, True),
+    'aocs-lab': ('lab', _space_mean, True),
+    'gray-hsv-h': ('hsv', _channel_mean(0), False),
+    'gray-hsv-s': ('hsv', _channel_mean(1), False),
+    'gray-hsv-v': ('hsv', _channel_mean(2), False),
+    'gray-lab-l': ('lab', _channel_mean(0), False),
+}
+
+
+def _space_grid(arr, block_width, block_height, method, converted=None):
+    """Сетка для SPACE_REDUCERS: одно преобразование туда и одно обратно"""
+    space, reducer, convert_back = SPACE_REDUCERS[method]
+    if converted is None:
+        converted = convert_color_space(arr, space)
+    rows, cols = grid_shape(arr.shape[1], arr.shape[0], block_width, block_height)
+    if convert_back:
+        averages = np.empty((rows, cols, 3), dtype=np.uint8)
+        for rs, cs, blocks in iter_block_regions(converted, block_width, block_height):
+            averages[rs, cs] = reducer(blocks)
+        # Обратно переводим столбцом (N, 1, 3): для широких строк OpenCV
+        # включает SIMD-ветку HSV2RGB, которая расходится со скалярной
+        # на 1x1, а результат должен совпадать с поблочным
+        column = averages.reshape(-1, 1, 3)
+        return _cvt_color(column, space, inverse=True).reshape(rows, cols, 3)
+    grid = np.empty((rows, cols, 3), dtype=np.uint8)
+    for rs, cs, blocks in iter_block_regions(converted, block_width, block_height):
+        grid[rs, cs] = to_colors(reducer(blocks))
+    return grid
+
+
+def to_colors(values):
+    """Приводит значения блоков к цвету так же, как int() + заливка PIL"""
+    values = np.asarray(values)
+    if values.ndim == 2:
+        values = np.repeat(values[..., None], 3, axis=-1)
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+
+def block_grid(arr, block_width, block_height, method, block_function=None, reducer=None, converted=None):
+    """Считает цвета всех блоков: массив (rows, cols, 3) uint8.
+
+    reducer подменяет пакетную реализацию метода (например, стратегию abdc).
+    Для методов без пакетной реализации используется block_function -
+    поблочная функция average_block_*, вызываемая на видах массива.
+    converted - уже переведённый в HSV/LAB массив для SPACE_REDUCERS.
+    """
+    if reducer is None and method in SPACE_REDUCERS:
+        return _space_grid(arr, block_width, block_height, method, converted)
+
+    height, width = arr.shape[:2]
+    rows, cols = grid_shape(width, height, block_width, block_height)
+    grid = np.empty((rows, cols, 3), dtype=np.uint8)
+    if reducer is None:
+        reducer = BLOCK_REDUCERS.get(method)
+
+    for rs, cs, blocks in iter_block_regions(arr, block_width, block_height):
+        if reducer is not None:
+            grid[rs, cs] = to_colors(reducer(blocks))
+            continue
+        if block_function is None:
+            raise ValueError(f"Unknown averaging method: {method}")
+        values = np.empty(blocks.shape[:2] + (3,), dtype=np.float64)
+        for i in range(blocks.shape[0]):
+            for j in range(blocks.shape[1]):
+                block = np.ascontiguousarray(blocks[i, j])
+                values[i, j] = [int(c) for c in block_function(block)]
+        grid[rs, cs] = to_colors(values)
+    return grid
+
+
+def upsample_grid(grid, block_width, block_height, width, height, out=None):
+    """Растягивает сетку цветов до полного изображения (H, W, 3).
+
+    out - готовый массив (H, W, 3) uint8, в который пишется результат.
+    """
+    canvas = np.empty((height, width, 3), dtype=np.uint8) if out is None else out
+    for rs, cs, blocks in iter_block_regions(canvas, block_width, block_height):
+        # Строка блоков растягивается по ширине один раз и копируется на все
+        # строки пикселей: запись идёт непрерывными строками, а не по 3 байта
+        rows, cols, _, bw, channels = blocks.shape
+        stretched = np.repeat(grid[rs, cs], bw, axis=1)
+        blocks.swapaxes(1, 2)[...] = stretched.reshape(rows, 1, cols, bw, channels)
+    return canvas
+
+
+def _window_sums(values, block, size, target):
+    """Суммы по окнам длины target вдоль оси 0 растянутой сетки.
+
+    values[i] занимает пиксели [i * block, (i + 1) * block) оси длины size;
+    суммы считаются по префиксным суммам, без разворачивания в пиксели.
+    """
+    count = values.shape[0]
+    shape = (-1,) + (1,) * (values.ndim - 1)
+    widths = np.minimum(block, size - np.arange(count) * block).reshape(shape)
+    prefix = np.concatenate([np.zeros_like(values[:1]), np.cumsum(values * widths, axis=0)])
+    edges = np.append(np.arange(0, size, target), size)
+    index = np.minimum(edges // block, count - 1)
+    at_edges = prefix[index] + values[index] * (edges - index * block).reshape(shape)
+    return np.diff(at_edges, axis=0)
+
+
+class BlockGrid:
+    """Результат пикселизации: один цвет на блок и геометрия сетки.
+
+    colors - массив (rows, cols, 3) uint8; полноразмерный холст строится
+    лениво, только когда он действительно нужен (запись растра).
+    canvas - уже готовый холст, если он посчитан попутно (pixelate_tiled).
+    """
+
+    def __init__(self, colors, block_width, block_height, width, height, canvas=None):
+        self.colors = colors
+        self.block_width = block_width
+        self.block_height = block_height
+        self.width = width
+        self.height = height
+        self._canvas = canvas
+
+    @classmethod
+    def from_canvas(cls, canvas, block_width, block_height):
+        """Сетка из уже закрашенного холста: берётся левый верхний пиксель блока"""
+        colors = np.ascontiguousarray(canvas[::block_height, ::block_width, :3])
+        return cls(colors, block_width, block_height, canvas.shape[1], canvas.shape[0])
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def shape(self):
+        return self.colors.shape[:2]
+
+    def to_array(self, out=None):
+        """Полноразмерный холст (H, W, 3) uint8.
+
+        out - готовый массив, в который растягивается сетка (или копируется
+        готовый холст); такой холст не запоминается, массив остаётся за вызывающим.
+        """
+        if out is not None and self._canvas is not None:
+            np.copyto(out, self._canvas)
+            return out
+        if self._canvas is not None:
+            return self._canvas
+        if out is not None:
+            return upsample_grid(self.colors, self.block_width, self.block_height, self.width, self.height, out)
+        self._canvas = upsample_grid(self.colors, self.block_width, self.block_height, self.width, self.height)
+        return self._canvas
+
+    def rows(self, start, stop):
+        """Строки холста [start, stop) без построения всего холста"""
+        if self._canvas is not None:
+            return self._canvas[start:stop]
+        band = self.colors[np.arange(start, stop) // self.block_height]
+        return np.repeat(band, self.block_width, axis=1)[:, :self.width]
+
+    def to_image(self, out=None):
+        return Image.fromarray(self.to_array(out), 'RGB')
+
+    def save(self, path, **params):
+        self.to_image().save(path, **params)
+
+    def block_sums(self, block_width, block_height):
+        """Суммы каналов холста по другой сетке блоков и число пикселей в каждом"""
+        sums = _window_sums(self.colors.astype(np.int64), self.block_height, self.height, block_height)
+        sums = _window_sums(sums.swapaxes(0, 1), self.block_width, self.width, block_width).swapaxes(0, 1)
+        heights = np.diff(np.append(np.arange(0, self.height, block_height), self.height))
+        widths = np.diff(np.append(np.arange(0, self.width, block_width), self.width))
+        return sums, heights[:, None] * widths[None, :]
+
+    def block_means(self, block_width, block_height):
+        """Целочисленные средние (сумма // число пикселей) по сетке block_width x block_height"""
+        if (block_width, block_height) == (self.block_width, self.block_height):
+            return self.colors
+        sums, counts = self.block_sums(block_width, block_height)
+        return sums // counts[..., None]
@@ -0,0 +1,216 @@
+"""Потоковая запись JSON-матриц (--matrix-json) прямо из массива пикселей.
+
+Вывод побайтно совпадает с json.dump(generate_json_matrix(...), f, indent=2),
+но словарь со списками и строками на каждый пиксель не строится: строки
+изображения обрабатываются пачками, и текст каждой пачки собирается
+векторно. Каждая запись - набор полей фиксированной максимальной ширины
+(константы и значения из таблиц десятичных/шестнадцатеричных строк),
+лишние байты отбрасываются маской, и пачка уходит в файл одним write.
+
+compact=True пишет тот же JSON без отступов и пробелов, как
+json.dump(..., separators=(',', ':')).
+"""
+import base64
+import json
+from functools import lru_cache
+
+import numpy as np
+
+MATRIX_TYPES = ('aoa', 'sla', 'slo', 'b64', 'hex', 'rgb', 'cmyk')
+MATRIX_SCOPES = ('pixels', 'blocks')
+
+# Пикселей в одной пачке: около 8 МБ текста даже для 'slo'
+CHUNK_PIXELS = 1 << 16
+
+
+def _text_table(strings):
+    """Таблица строк: (uint8 (k, w) с дополнением нулями, длины (k,))"""
+    encoded = [s.encode('ascii') for s in strings]
+    table = np.zeros((len(encoded), max(len(s) for s in encoded)), dtype=np.uint8)
+    for i, s in enumerate(encoded):
+        table[i, :len(s)] = np.frombuffer(s, dtype=np.uint8)
+    return table, np.array([len(s) for s in encoded])
+
+
+@lru_cache(maxsize=None)
+def _decimal_table(limit):
+    return _text_table(str(v) for v in range(limit))
+
+
+HEX_TABLE = _text_table(f'{v:02x}' for v in range(256))
+
+
+def _const(text):
+    table, lengths = _text_table([text])
+    return table, lengths, None
+
+
+def _choice(texts, index):
+    table, lengths = _text_table(texts)
+    return table, lengths, index
+
+
+def _lookup(table, index):
+    return table[0], table[1], index
+
+
+def _render(fields, count):
+    """Склеивает поля count записей в одну байтовую строку.
+
+    fields - список (table, lengths, index); index=None - константа.
+    """
+    pieces = []
+    masks = []
+    for table, lengths, index in fields:
+        positions = np.arange(table.shape[1])
+        if index is None:
+            pieces.append(np.broadcast_to(table[0], (count, table.shape[1])))
+            masks.append(np.broadcast_to(positions < lengths[0], (count, table.shape[1])))
+        else:
+            pieces.append(table[index])
+            masks.append(positions < lengths[index][:, None])
+    return np.concatenate(pieces, axis=1)[np.concatenate(masks, axis=1)].tobytes()
+
+
+class _Layout:
+    """Разделители json.dump: с отступом indent или компактные"""
+
+    def __init__(self, compact=False, indent=2):
+        self.indent = None if compact else indent
+        self.key_separator = ':' if compact else ': '
+
+    def newline(self, depth):
+        return '' if self.indent is None else '\n' + ' ' * (self.indent * depth)
+
+    def key(self, name, depth):
+        return self.newline(depth) + json.dumps(name) + self.key_separator
+
+
+def cmyk_values(pixels):
+    """CMYK в процентах (..., 4) с тем же округлением int(), что и исходный цикл"""
+    rgb = pixels[..., :3] / 255
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    k = 1 - np.maximum(np.maximum(r, g), b)
+    black = k == 1
+    denominator = np.where(black, 1, 1 - k)
+    channels = [np.where(black, 0, (1 - value - k) / denominator) for value in (r, g, b)]
+    return np.trunc(np.stack(channels + [k], axis=-1) * 100).astype(np.int64)
+
+
+def _pixel_fields(matrix_type, pixels, xs, ys, layout, depth):
+    """Поля записи одного пикселя списка pixels (n, C) на глубине depth"""
+    decimal = _decimal_table(256)
+    if matrix_type == 'aoa':
+        fields = [_const('[')]
+        for c in range(pixels.shape[1]):
+            fields += [_const((',' if c else '') + layout.newline(depth + 1)), _lookup(decimal, pixels[:, c])]
+        return fields + [_const(layout.newline(depth) + ']')]
+    if matrix_type == 'slo':
+        coordinates = _decimal_table(max(256, int(xs.max()) + 1, int(ys.max()) + 1))
+        fields = [_const('{' + layout.key('x', depth + 1)), _lookup(coordinates, xs),
+                  _const(',' + layout.key('y', depth + 1)), _lookup(coordinates, ys)]
+        for c, name in enumerate('rgba'[:min(pixels.shape[1], 4)]):
+            fields += [_const(',' + layout.key(name, depth + 1)), _lookup(decimal, pixels[:, c])]
+        return fields + [_const(layout.newline(depth) + '}')]
+    if matrix_type == 'hex':
+        return [_const('"#'), _lookup(HEX_TABLE, pixels[:, 0]), _lookup(HEX_TABLE, pixels[:, 1]),
+                _lookup(HEX_TABLE, pixels[:, 2]), _const('"')]
+    if matrix_type == 'cmyk':
+        values = cmyk_values(pixels)
+        channels = [values[:, c] for c in range(4)]
+    else:
+        channels = [pixels[:, c] for c in range(3)]
+    fields = [_const('"')]
+    for c, values in enumerate(channels):
+        fields += [_const(' ' if c else ''), _lookup(decimal, values)]
+    return fields + [_const('"')]
+
+
+def _pixel_chunks(rows, width, height, channels):
+    """Пачки (пиксели (n, C), xs, ys) из rows(start, stop) -> (n_rows, width, C)"""
+    rows_per_chunk = max(1, CHUNK_PIXELS // width)
+    for start in range(0, height, rows_per_chunk):
+        stop = min(start + rows_per_chunk, height)
+        block = rows(start, stop)
+        ys, xs = np.divmod(np.arange(start * width, stop * width), width)
+        yield block.reshape(-1, channels), xs, ys
+
+
+def _write_nested(f, matrix_type, rows, width, height, channels, layout):
+    """Список строк, каждая - список пикселей (aoa, hex, rgb, cmyk)"""
+    for pixels, xs, ys in _pixel_chunks(rows, width, height, channels):
+        prefix = np.where(xs == 0, np.where(ys == 0, 1, 2), 0)
+        suffix = (xs == width - 1).astype(np.intp)
+        fields = ([_choice([',', layout.newline(2) + '[', ',' + layout.newline(2) + '['], prefix),
+                   _const(layout.newline(3))]
+                  + _pixel_fields(matrix_type, pixels, xs, ys, layout, 3)
+                  + [_choice(['', layout.newline(2) + ']'], suffix)])
+        f.write(_render(fields, len(xs)).decode('ascii'))
+
+
+def _write_flat(f, matrix_type, rows, width, height, channels, layout):
+    """Плоский список значений (sla) или объектов-пикселей (slo)"""
+    first = True
+    for pixels, xs, ys in _pixel_chunks(rows, width, height, channels):
+        if matrix_type == 'sla':
+            pixels = pixels.reshape(-1, 1)
+            fields = [_lookup(_decimal_table(256), pixels[:, 0])]
+        else:
+            fields = _pixel_fields(matrix_type, pixels, xs, ys, layout, 2)
+        count = len(pixels)
+        separator = np.zeros(count, dtype=np.intp)
+        separator[0] = first
+        first = False
+        fields = [_choice([',', ''], separator), _const(layout.newline(2))] + fields
+        f.write(_render(fields, count).decode('ascii'))
+
+
+def _write_base64(f, rows, width, height, channels):
+    """Base64 по пачкам из целого числа троек байт - склейка равна кодированию целиком"""
+    rows_per_chunk = max(1, CHUNK_PIXELS // width) * 3
+    for start in range(0, height, rows_per_chunk):
+        block = np.ascontiguousarray(rows(start, min(start + rows_per_chunk, height)))
+        f.write(base64.b64encode(block.tobytes()).decode('ascii'))
+
+
+def write_json_matrix(f, rows, width, height, channels, matrix_type='rgb', extra=None, compact=False):
+    """Пишет JSON-матрицу в текстовый файл f.
+
+    rows(start, stop) возвращает строки изображения массивом
+    (stop - start, width, channels) uint8; extra - дополнительные ключи
+    верхнего уровня после пикселей (геометрия сетки блоков).
+    """
+    layout = _Layout(compact)
+    if matrix_type not in MATRIX_TYPES:
+        matrix_type = 'rgb'
+    header = {'width': width, 'height': height}
+    if matrix_type == 'sla':
+        header['channels'] = channels
+    elif matrix_type == 'b64':
+        header['format'] = 'RGB'
+
+    f.write('{' + ','.join(layout.key(name, 1) + json.dumps(value) for name, value in header.items()) + ',')
+    if matrix_type == 'b64':
+        f.write(layout.key('data', 1) + '"')
+        _write_base64(f, rows, width, height, channels)
+        f.write('"')
+    else:
+        f.write(layout.key('pixels', 1) + '[')
+        if matrix_type in ('sla', 'slo'):
+            _write_flat(f, matrix_type, rows, width, height, channels, layout)
+        else:
+            _write_nested(f, matrix_type, rows, width, height, channels, layout)
+        f.write(layout.newline(1) + ']')
+    for name, value in (extra or {}).items():
+        f.write(',' + layout.key(name, 1) + json.dumps(value))
+    f.write(layout.newline(0) + '}')
+
+
+def pixel_strings(pixels, matrix_type='rgb'):
+    """Строки 'hex'/'rgb'/'cmyk' для массива (H, W, C) списком строк изображения"""
+    height, width, channels = pixels.shape
+    flat = pixels.reshape(-1, channels)
+    fields = _pixel_fields(matrix_type, flat, None, None, _Layout(), 0) + [_const('\n')]
+    # Кавычки JSON внутри значений не встречаются
+    lines = _render(fields, len(flat)).decode('ascii').replace('"', '').split('\n')
+    return [lines[y * width:(y + 1) * width] for y in range(height)]
@@ -0,0 +1,144 @@
+"""Двоичные матрицы пикселей или блоков (--matrix-bin) вместо JSON.
+
+Форматы:
+
+- 'npy'  - стандартный .npy, читается np.load(path, mmap_mode='r');
+- 'raw'  - заголовок PXMATRIX и сырые строки uint8, выровненные на
+           DATA_ALIGN байт; load_matrix отображает их в память без копии;
+- 'zlib', 'zstd' - тот же заголовок и сжатые пачки строк: каждая пачка -
+           длина uint32 и сжатые байты. Для 'zstd' нужен модуль
+           compression.zstd (Python 3.14+) или пакет zstandard.
+
+Строки пишутся пачками из rows(start, stop), поэтому матрица пикселей
+для BlockGrid собирается без полноразмерного холста.
+"""
+import struct
+import zlib
+
+import numpy as np
+
+MATRIX_BIN_FORMATS = ('npy', 'raw', 'zlib', 'zstd')
+MATRIX_BIN_SUFFIXES = {'npy': '.npy', 'raw': '.pxm', 'zlib': '.pxz', 'zstd': '.pxz'}
+
+MAGIC = b'PXMATRIX'
+# magic, кодек, каналы, высота, ширина, блок (ширина, высота), исходник (ширина, высота),
+# строк в пачке, смещение данных
+HEADER = struct.Struct('<8sBxHIIIIIIII')
+DATA_ALIGN = 64
+CODECS = {'raw': 0, 'zlib': 1, 'zstd': 2}
+
+# Несжатых байт в одной пачке строк
+CHUNK_BYTES = 1 << 20
+
+
+def _zstd():
+    """Модуль zstd: стандартный (3.14+) или пакет zstandard"""
+    try:
+        from compression import zstd
+        return zstd.compress, zstd.decompress
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd matrices need Python 3.14+ or the 'zstandard' package") from None
+    return zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress
+
+
+def _compressor(codec):
+    if codec == 'zlib':
+        return zlib.compress, zlib.decompress
+    return _zstd()
+
+
+def matrix_compressor(fmt):
+    """Функция сжатия пачек формата fmt (None для 'npy' и 'raw').
+
+    ValueError - неизвестный формат, RuntimeError - кодек недоступен.
+    """
+    if fmt not in MATRIX_BIN_FORMATS:
+        raise ValueError(f"Unknown matrix format: {fmt}")
+    return _compressor(fmt)[0] if fmt in ('zlib', 'zstd') else None
+
+
+def _chunk_rows(width, channels):
+    return max(1, CHUNK_BYTES // (width * channels))
+
+
+def write_matrix(path, rows, width, height, channels, fmt='npy', geometry=None):
+    """Пишет матрицу (height, width, channels) uint8 из rows(start, stop) в формате fmt.
+
+    geometry - словарь block_width, block_height, image_width, image_height
+    для заголовка (в .npy не сохраняется).
+    """
+    # Кодек проверяется до открытия файла: при ошибке пустой файл не остаётся
+    compress = matrix_compressor(fmt)
+    with open(path, 'wb') as f:
+        _dump(f, rows, width, height, channels, fmt, geometry, compress)
+
+
+def dump_matrix(f, rows, width, height, channels, fmt='npy', geometry=None):
+    """write_matrix в открытый двоичный файл или буфер (io.BytesIO)"""
+    _dump(f, rows, width, height, channels, fmt, geometry, matrix_compressor(fmt))
+
+
+def _dump(f, rows, width, height, channels, fmt, geometry, compress):
+    chunk_rows = _chunk_rows(width, channels)
+    if fmt == 'npy':
+        header = {'descr': '|u1', 'fortran_order': False, 'shape': (height, width, channels)}
+        np.lib.format.write_array_header_1_0(f, header)
+    else:
+        geometry = geometry or {}
+        f.write(HEADER.pack(MAGIC, CODECS[fmt], channels, height, width,
+                            geometry.get('block_width', 1), geometry.get('block_height', 1),
+                            geometry.get('image_width', width), geometry.get('image_height', height),
+                            chunk_rows, DATA_ALIGN))
+        f.write(b'\0' * (DATA_ALIGN - HEADER.size))
+    for start in range(0, height, chunk_rows):
+        data = np.ascontiguousarray(rows(start, min(start + chunk_rows, height)), dtype=np.uint8).tobytes()
+        if compress is not None:
+            data = compress(data)
+            f.write(struct.pack('<I', len(data)))
+        f.write(data)
+
+
+def read_matrix_header(path):
+    """Заголовок файла 'raw'/'zlib'/'zstd' словарём"""
+    with open(path, 'rb') as f:
+        fields = HEADER.unpack(f.read(HEADER.size))
+    if fields[0] != MAGIC:
+        raise ValueError(f"Not a pixelate matrix file: {path}")
+    codec = {code: name for name, code in CODECS.items()}[fields[1]]
+    names = ('channels', 'height', 'width', 'block_width', 'block_height',
+             'image_width', 'image_height', 'chunk_rows', 'data_offset')
+    return dict(zip(names, fields[2:]), codec=codec)
+
+
+def load_matrix(path):
+    """Матрица (height, width, channels) uint8 из файла любого формата --matrix-bin.
+
+    .npy и 'raw' отображаются в память только для чтения (без копии),
+    сжатые пачки распаковываются в один заранее выделенный массив.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+    if magic.startswith(b'\x93NUMPY'):
+        return np.load(path, mmap_mode='r')
+
+    header = read_matrix_header(path)
+    shape = (header['height'], header['width'], header['channels'])
+    if header['codec'] == 'raw':
+        return np.memmap(path, dtype=np.uint8, mode='r', offset=header['data_offset'], shape=shape)
+
+    decompress = _compressor(header['codec'])[1]
+    matrix = np.empty(shape, dtype=np.uint8)
+    flat = matrix.reshape(-1)
+    row_bytes = header['width'] * header['channels']
+    with open(path, 'rb') as f:
+        f.seek(header['data_offset'])
+        for start in range(0, header['height'], header['chunk_rows']):
+            length, = struct.unpack('<I', f.read(4))
+            data = decompress(f.read(length))
+            offset = start * row_bytes
+            flat[offset:offset + len(data)] = np.frombuffer(data, dtype=np.uint8)
+    return matrix
@@ -0,0 +1,145 @@
+"""Поиск ближайшего цвета палитры сразу для всех блоков.
+
+Каждый уникальный цвет сравнивается со всеми цветами палитры одним
+матричным умножением: |c - p|^2 = |c|^2 - 2 c.p + |p|^2. Для целых 0..255
+все слагаемые точно представимы в float64, поэтому расстояния точные, а
+при равенстве, как и у min() по словарю, выбирается первый цвет палитры.
+
+Дополнительно можно использовать таблицу RGB -> номер цвета палитры:
+
+- 'full' - все 2^24 цветов, точный результат. Строится один раз на
+           палитру и кэшируется на диске (PIXELATE_CACHE_DIR или
+           ~/.cache/pixelate), дальше читается отображением в память;
+- '32'   - 32x32x32 ячейки по 5 бит на канал, цвет ячейки - её центр.
+           Приближённо: на границах между цветами палитры возможны
+           расхождения с точным поиском.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+LUT_MODES = ('none', '32', 'full')
+
+# Ограничение на размер матрицы расстояний (цветов x цветов палитры)
+_DISTANCE_CHUNK = 1 << 22
+
+
+def cache_dir():
+    """Каталог дискового кэша таблиц"""
+    return os.environ.get('PIXELATE_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'pixelate')
+
+
+def load_palette(path):
+    """Палитра пользователя из JSON {"#rrggbb" или "r,g,b": символ}"""
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+    palette = {}
+    for key, symbol in entries.items():
+        key = key.strip()
+        if key.startswith('#'):
+            color = tuple(int(key[i:i + 2], 16) for i in (1, 3, 5))
+        else:
+            color = tuple(int(part) for part in key.replace(' ', ',').split(',') if part)
+        if len(color) != 3 or not all(0 <= c <= 255 for c in color):
+            raise ValueError(f"Bad palette color: {key}")
+        palette[color] = str(symbol)
+    if not palette:
+        raise ValueError(f"Empty palette: {path}")
+    return palette
+
+
+def _nearest(colors, palette_colors):
+    """Номера ближайших цветов палитры (k, 3) для списка цветов (n, 3)"""
+    palette = np.asarray(palette_colors, dtype=np.float64)
+    palette_norms = (palette ** 2).sum(axis=1)
+    result = np.empty(len(colors), dtype=np.intp)
+    chunk = max(1, _DISTANCE_CHUNK // len(palette))
+    for start in range(0, len(colors), chunk):
+        part = colors[start:start + chunk].astype(np.float64)
+        distances = (part ** 2).sum(axis=1)[:, None] - 2 * part @ palette.T + palette_norms
+        result[start:start + chunk] = distances.argmin(axis=1)
+    return result
+
+
+def nearest_indices(colors, palette_colors):
+    """Номера ближайших цветов палитры (k, 3) для цветов (..., 3); повторы считаются один раз"""
+    colors = np.asarray(colors)
+    unique, inverse = np.unique(colors.reshape(-1, 3), axis=0, return_inverse=True)
+    return _nearest(unique, palette_colors)[inverse.reshape(-1)].reshape(colors.shape[:-1])
+
+
+def _index_dtype(count):
+    return np.uint8 if count <= 256 else np.uint16 if count <= 65536 else np.int32
+
+
+def build_lut(palette_colors, bits=8):
+    """Таблица (2^bits)^3 номеров цветов палитры; ячейка представлена своим центром"""
+    levels = np.arange(1 << bits)
+    centers = (levels << (8 - bits)) + ((1 << (8 - bits)) >> 1)
+    lut = np.empty((1 << bits,) * 3, dtype=_index_dtype(len(palette_colors)))
+    plane = np.empty((1 << bits, 1 << bits, 3), dtype=np.int64)
+    plane[..., 1] = centers[:, None]
+    plane[..., 2] = centers[None, :]
+    for r in levels:
+        plane[..., 0] = centers[r]
+        lut[r] = _nearest(plane.reshape(-1, 3), palette_colors).reshape(plane.shape[:2])
+    return lut
+
+
+def cached_lut(palette_colors, bits=8, directory=None):
+    """Таблица из дискового кэша; при отсутствии строится и сохраняется"""
+    palette_colors = np.ascontiguousarray(palette_colors, dtype=np.int64)
+    key = hashlib.sha1(palette_colors.tobytes()).hexdigest()[:16]
+    directory = directory or cache_dir()
+    path = os.path.join(directory, f"palette-{key}-{bits}.npy")
+    if os.path.exists(path):
+        try:
+            return np.load(path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass  # Повреждённый файл - построим заново
+
+    lut = build_lut(palette_colors, bits)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as f:
+            np.save(f, lut)
+        os.replace(temporary, path)
+    except OSError:
+        pass  # Кэш недоступен для записи - работаем с таблицей в памяти
+    return lut
+
+
+class PaletteMatcher:
+    """Сопоставление цветов символам палитры {(r, g, b): символ}"""
+
+    def __init__(self, palette, lut='none', cache_directory=None):
+        if lut not in LUT_MODES:
+            raise ValueError(f"Unknown palette LUT mode: {lut}")
+        self.colors = np.array(list(palette.keys()), dtype=np.int64).reshape(-1, 3)
+        self.symbols = np.array(list(palette.values()), dtype=object)
+        self.lut_mode = lut
+        self.cache_directory = cache_directory
+        self._lut = None
+
+    @property
+    def lut(self):
+        if self._lut is None and self.lut_mode != 'none':
+            bits = 8 if self.lut_mode == 'full' else 5
+            self._lut = cached_lut(self.colors, bits, self.cache_directory)
+        return self._lut
+
+    def indices(self, colors):
+        """Номера цветов палитры для массива цветов (..., 3) со значениями 0..255"""
+        colors = np.asarray(colors)
+        if self.lut_mode == 'none':
+            return nearest_indices(colors, self.colors)
+        shift = 8 - (self.lut.shape[0].bit_length() - 1)
+        quantized = colors.astype(np.intp) >> shift
+        return self.lut[quantized[..., 0], quantized[..., 1], quantized[..., 2]]
+
+    def match(self, colors):
+        """Символы палитры массивом той же формы без последней оси"""
+        return self.symbols[self.indices(colors)]
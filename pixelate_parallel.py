@@ -0,0 +1,112 @@
+"""Параллельная пикселизация горизонтальными полосами.
+
+Изображение делится на полосы, кратные высоте блока, поэтому ни один блок
+не пересекает границу полосы и результат совпадает с однопоточным.
+Полосы обрабатываются пулом потоков (NumPy и OpenCV отпускают GIL на
+основных операциях) или процессов. Каждый исполнитель пишет свою часть
+сетки и холста прямо на место: для потоков это общие массивы, для
+процессов - блоки multiprocessing.shared_memory.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from pixelate_engine import grid_shape, upsample_grid
+
+BACKENDS = ('thread', 'process')
+
+# Полос больше, чем исполнителей, чтобы выровнять нагрузку
+BANDS_PER_WORKER = 4
+
+
+def band_bounds(height, block_height, bands):
+    """Границы полос [(y0, y1), ...], кратные высоте блока"""
+    rows = -(-height // block_height)
+    bands = max(1, min(bands, rows))
+    edges = [i * rows // bands for i in range(bands + 1)]
+    return [(r0 * block_height, min(r1 * block_height, height))
+            for r0, r1 in zip(edges, edges[1:]) if r1 > r0]
+
+
+def _process_band(arr, grid, canvas, y0, y1, block_width, block_height, grid_function):
+    r0, r1 = y0 // block_height, -(-y1 // block_height)
+    grid[r0:r1] = grid_function(arr[y0:y1], block_width, block_height)
+    upsample_grid(grid[r0:r1], block_width, block_height, canvas.shape[1], y1 - y0, out=canvas[y0:y1])
+
+
+def _attach(name):
+    """Подключается к общей памяти; удаляет её только создавший процесс"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13: трекер общий с родителем, повторная регистрация безвредна
+        return shared_memory.SharedMemory(name=name)
+
+
+def _process_band_shared(buffers, y0, y1, block_width, block_height, grid_function):
+    """Задача процесса: buffers - [(имя, форма)] для входа, сетки и холста"""
+    handles = [_attach(name) for name, _ in buffers]
+    arrays = []
+    try:
+        arrays.extend(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+                      for shm, (_, shape) in zip(handles, buffers))
+        _process_band(*arrays, y0, y1, block_width, block_height, grid_function)
+    finally:
+        # Виды на буфер нужно отпустить до close()
+        arrays.clear()
+        for shm in handles:
+            shm.close()
+
+
+def _run_threads(arr, block_width, block_height, grid_function, workers, bands):
+    height, width = arr.shape[:2]
+    grid = np.empty(grid_shape(width, height, block_width, block_height) + (3,), dtype=np.uint8)
+    canvas = np.empty((height, width, 3), dtype=np.uint8)
+    with ThreadPoolExecutor(workers) as pool:
+        futures = [pool.submit(_process_band, arr, grid, canvas, y0, y1,
+                               block_width, block_height, grid_function) for y0, y1 in bands]
+        for future in futures:
+            future.result()
+    return grid, canvas
+
+
+def _run_processes(arr, block_width, block_height, grid_function, workers, bands):
+    height, width = arr.shape[:2]
+    shapes = [arr.shape, grid_shape(width, height, block_width, block_height) + (3,), (height, width, 3)]
+    handles = [shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape))))
+               for shape in shapes]
+    arrays = []
+    try:
+        arrays.extend(np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+                      for shm, shape in zip(handles, shapes))
+        arrays[0][...] = arr
+        buffers = [(shm.name, shape) for shm, shape in zip(handles, shapes)]
+        with ProcessPoolExecutor(workers) as pool:
+            futures = [pool.submit(_process_band_shared, buffers, y0, y1,
+                                   block_width, block_height, grid_function) for y0, y1 in bands]
+            for future in futures:
+                future.result()
+        # Общую память нужно освободить, поэтому результат копируется один раз
+        return arrays[1].copy(), arrays[2].copy()
+    finally:
+        arrays.clear()
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+
+
+def pixelate_tiled(arr, block_width, block_height, grid_function, workers, backend='thread'):
+    """Считает сетку и холст по полосам в workers исполнителях.
+
+    grid_function(arr, block_width, block_height) -> сетка (rows, cols, 3) uint8;
+    для backend='process' она должна сериализоваться pickle (функция модуля
+    или functools.partial от неё). Возвращает (grid, canvas).
+    """
+    if arr.dtype != np.uint8 or arr.ndim != 3:
+        raise ValueError("Expected an (H, W, 3) uint8 array")
+    bands = band_bounds(arr.shape[0], block_height, workers * BANDS_PER_WORKER)
+    if backend == 'process':
+        return _run_processes(arr, block_width, block_height, grid_function, workers, bands)
+    if backend == 'thread':
+        return _run_threads(arr, block_width, block_height, grid_function, workers, bands)
+    raise ValueError(f"Unknown backend: {backend}")
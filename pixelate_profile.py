@@ -0,0 +1,166 @@
+"""Замеры по этапам обработки (--profile).
+
+Этапы размечаются контекстом stage(name):
+
+    with stage('resize', nbytes) as record:
+        ...
+        record['bytes'] = ...   # объём, если он известен только в конце
+
+Пока нет активного Profiler, stage() возвращает один и тот же пустой
+контекст - цена выключенных замеров - вызов функции и чтение одной
+ContextVar. Внутри `with Profiler(label) as profiler:` каждый этап
+получает запись: время (wall), процессорное время (cpu), пик памяти
+сверх занятой на входе в этап (по tracemalloc, NumPy тоже учитывается) и
+обработанные байты; start_s - начало этапа от создания Profiler. Этапы
+могут быть вложенными.
+
+Активный Profiler и хуки хранятся в contextvars: в каждом потоке и каждой
+задаче asyncio свои, поэтому параллельные конвейеры (--workers-backend
+thread, потоки HTTP-сервиса, AsyncPixelator) не пишут в чужой Profiler.
+Пик памяти tracemalloc общий для процесса, поэтому память замеряют
+Profiler только одного потока за раз; в записях остальных peak_bytes -
+None.
+
+Записи остаются в profiler.records и передаются функциям, добавленным
+add_hook(callback) в том же контексте, сразу по завершении этапа.
+"""
+import contextvars
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+PROFILE_FORMATS = ('text', 'json')
+
+# Запись выключенного этапа: изменения в ней никуда не попадают
+_DISCARDED = {}
+_DISABLED = nullcontext(_DISCARDED)
+
+_active = contextvars.ContextVar('pixelate_profiler', default=None)
+_hooks = contextvars.ContextVar('pixelate_profile_hooks', default=())
+
+# Поток, чьи Profiler сейчас замеряют память, и глубина их вложенности
+_memory_lock = threading.Lock()
+_memory_owner = None
+_memory_depth = 0
+
+
+def add_hook(callback):
+    """callback(record) вызывается по завершении каждого этапа активного Profiler текущего контекста"""
+    _hooks.set(_hooks.get() + (callback,))
+
+
+def remove_hook(callback):
+    hooks = list(_hooks.get())
+    hooks.remove(callback)
+    _hooks.set(tuple(hooks))
+
+
+def stage(name, nbytes=0):
+    """Контекст этапа; без активного Profiler ничего не замеряет"""
+    profiler = _active.get()
+    if profiler is None:
+        return _DISABLED
+    return profiler.stage(name, nbytes)
+
+
+def _claim_memory():
+    """Занимает замер памяти для текущего потока; False, если он занят другим"""
+    global _memory_owner, _memory_depth
+    with _memory_lock:
+        if _memory_owner not in (None, threading.get_ident()):
+            return False
+        _memory_owner = threading.get_ident()
+        _memory_depth += 1
+        return True
+
+
+def _release_memory():
+    global _memory_owner, _memory_depth
+    with _memory_lock:
+        _memory_depth -= 1
+        if not _memory_depth:
+            _memory_owner = None
+
+
+class Profiler:
+    """Сбор записей этапов; label (например, путь к файлу) попадает в каждую запись"""
+
+    def __init__(self, label=None, memory=True):
+        self.label = label
+        self.memory = memory
+        self.records = []
+        self._depth = 0
+        self._peaks = []
+        self._token = None
+        self._measuring = False
+        self._tracing = False
+        self._started = time.perf_counter()
+
+    def __enter__(self):
+        self._token = _active.set(self)
+        self._measuring = self.memory and _claim_memory()
+        if self._measuring and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        return self
+
+    def __exit__(self, *exc_info):
+        _active.reset(self._token)
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        if self._measuring:
+            _release_memory()
+            self._measuring = False
+
+    def _traced(self):
+        return tracemalloc.get_traced_memory() if self._measuring and tracemalloc.is_tracing() else (0, 0)
+
+    @contextmanager
+    def stage(self, name, nbytes=0):
+        record = {'image': self.label, 'stage': name, 'depth': self._depth, 'bytes': nbytes}
+        # Пик памяти общий для процесса: перед вложенным этапом сохраняем пик
+        # внешнего и сбрасываем счётчик, после - поднимаем пик внешнего
+        current, peak = self._traced()
+        if self._peaks:
+            self._peaks[-1] = max(self._peaks[-1], peak)
+        if self._measuring and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self._peaks.append(current)
+        self._depth += 1
+        wall, cpu = time.perf_counter(), time.process_time()
+        record['start_s'] = wall - self._started
+        try:
+            yield record
+        finally:
+            record['wall_s'] = time.perf_counter() - wall
+            record['cpu_s'] = time.process_time() - cpu
+            self._depth -= 1
+            stage_peak = max(self._peaks.pop(), self._traced()[1])
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], stage_peak)
+            record['peak_bytes'] = max(0, stage_peak - current) if self._measuring else None
+            self.records.append(record)
+            for hook in _hooks.get():
+                hook(record)
+
+    def json_lines(self):
+        """Записи в порядке завершения, по JSON-объекту в строке"""
+        return ''.join(json.dumps(record) + '\n' for record in self.records)
+
+    def text(self):
+        """Таблица этапов в порядке начала, вложенные - с отступом"""
+        lines = [f"Profile: {self.label}" if self.label else "Profile:",
+                 f"  {'stage':<20} {'wall ms':>9} {'cpu ms':>9} {'peak MB':>9} {'MB':>9} {'MB/s':>9}"]
+        # Записи добавляются по завершении: внешний этап идёт после вложенных
+        for record in sorted(self.records, key=lambda r: (r['start_s'], r['depth'])):
+            megabytes = record['bytes'] / 1e6
+            rate = f"{megabytes / record['wall_s']:9.1f}" if record['bytes'] and record['wall_s'] else f"{'':>9}"
+            peak = f"{record['peak_bytes'] / 1e6:9.1f}" if record['peak_bytes'] is not None else f"{'':>9}"
+            name = '  ' * record['depth'] + record['stage']
+            lines.append(f"  {name:<20} {record['wall_s'] * 1000:9.1f} {record['cpu_s'] * 1000:9.1f} {peak} "
+                         f"{megabytes:9.2f} {rate}")
+        return '\n'.join(lines)
+
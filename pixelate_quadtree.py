@@ -0,0 +1,205 @@
+"""Адаптивная пикселизация квадродеревом (--quadtree).
+
+Изображение покрывается корневыми блоками размера (bw * 2^levels,
+bh * 2^levels). Блок делится на четыре, пока разброс его цвета -
+корень из средней по каналам дисперсии - больше порога и блок крупнее
+минимального (bw, bh). Дисперсия прямоугольника берётся из интегральных
+изображений значений и их квадратов: Var = E[x^2] - E[x]^2 за восемь
+обращений к таблицам, поэтому деление всех блоков уровня - один
+пакетный расчёт, а однородный фон остаётся одним крупным блоком.
+
+Границы всех блоков дерева лежат на сетке минимальных блоков (или на
+краю изображения), поэтому таблицы строятся не по пикселям, а по суммам
+минимальных блоков (BlockMoments): один проход по изображению и таблицы
+размером с сетку вместо двух полноразмерных.
+
+Цвет листа - тот же метод усреднения, что и для обычной сетки: для
+методов на средних - по тем же интегральным таблицам, для остальных
+листья одного размера выкладываются в ряд и считаются как сетка блоков.
+Листья хранятся списком прямоугольников (x, y, w, h) с цветами; из него
+строятся изображение и матрицы --matrix-json/--matrix-txt.
+"""
+import base64
+
+import numpy as np
+
+from pixelate_engine import block_reduce
+from pixelate_integral import _integral, reduce_sums
+
+# Наибольшее число уровней: корневой блок (размер << levels) должен помещаться в int64
+MAX_LEVELS = 30
+
+
+class QuadTree:
+    """Листья квадродерева: rects (N, 4) - x, y, ширина, высота; colors (N, 3) uint8.
+
+    Листья упорядочены по строкам, затем по столбцам левого верхнего угла.
+    """
+
+    def __init__(self, rects, colors, width, height, block_width, block_height, levels):
+        self.rects = rects
+        self.colors = colors
+        self.width = width
+        self.height = height
+        self.block_width = block_width
+        self.block_height = block_height
+        self.levels = levels
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    def __len__(self):
+        return len(self.rects)
+
+    def _groups(self):
+        """Листья одного размера: (индексы, ширина, высота)"""
+        shapes, inverse = np.unique(self.rects[:, 2:], axis=0, return_inverse=True)
+        for group, (width, height) in enumerate(shapes.tolist()):
+            yield np.flatnonzero(inverse.ravel() == group), width, height
+
+    def to_array(self, out=None):
+        """Холст (H, W, 3) uint8: каждый лист залит своим цветом; out - готовый массив для него"""
+        canvas = np.empty((self.height, self.width, 3), dtype=np.uint8) if out is None else out
+        for index, width, height in self._groups():
+            ys, xs = gather_index(self.rects[index], width, height)
+            canvas[ys, xs] = self.colors[index][:, None, None]
+        return canvas
+
+    def to_image(self, out=None):
+        from PIL import Image
+        return Image.fromarray(self.to_array(out), 'RGB')
+
+    def save(self, path, **params):
+        self.to_image().save(path, **params)
+
+
+class BlockMoments:
+    """Интегральные таблицы сумм, сумм квадратов и числа "белых" значений по сетке минимальных блоков.
+
+    Прямоугольники задаются в пикселях; их границы должны лежать на сетке
+    (block_width, block_height) или на краю изображения.
+    """
+
+    def __init__(self, arr, block_width, block_height):
+        self.arr = arr
+        self.height, self.width = arr.shape[:2]
+        self.block_width = block_width
+        self.block_height = block_height
+        self.sums = _integral(block_reduce(arr, block_width, block_height, dtype=np.int64), 255)
+        squared = arr.astype(np.uint16)
+        squared *= squared  # 255 ** 2 помещается в uint16
+        self.squares = _integral(block_reduce(squared, block_width, block_height, dtype=np.int64), 255 * 255)
+        self._whites = None
+
+    @property
+    def whites(self):
+        """Число значений каналов >= 128 (для blwt)"""
+        if self._whites is None:
+            whites = np.count_nonzero(self.arr >= 128, axis=2).astype(np.uint8)[..., None]
+            sums = block_reduce(whites, self.block_width, self.block_height, dtype=np.int64)[..., 0]
+            self._whites = _integral(sums, self.arr.shape[2])
+        return self._whites
+
+    def _boxes(self, table, y0, y1, x0, x1):
+        """Суммы прямоугольников, заданных массивами границ одной длины"""
+        r0, r1 = y0 // self.block_height, -(-y1 // self.block_height)
+        c0, c1 = x0 // self.block_width, -(-x1 // self.block_width)
+        return table[r1, c1].astype(np.int64) - table[r0, c1] - table[r1, c0] + table[r0, c0]
+
+    def variance(self, y0, y1, x0, x1):
+        """Средняя по каналам дисперсия значений каждого прямоугольника (N,)"""
+        counts = ((y1 - y0) * (x1 - x0))[:, None]
+        mean = self._boxes(self.sums, y0, y1, x0, x1) / counts
+        variance = self._boxes(self.squares, y0, y1, x0, x1) / counts - mean * mean
+        return np.maximum(variance, 0).mean(axis=1)
+
+    def values(self, method, y0, y1, x0, x1):
+        """Значения прямоугольников методов на средних: (N, 3) или (N,)"""
+        counts = (y1 - y0) * (x1 - x0)
+        if method in ('blwt', 'blwt-tc'):
+            return reduce_sums(method, counts, whites=self._boxes(self.whites, y0, y1, x0, x1))
+        return reduce_sums(method, counts, sums=self._boxes(self.sums, y0, y1, x0, x1))
+
+
+def gather_index(rects, width, height):
+    """Индексы (ys, xs) пикселей листьев одного размера для выборки (N, height, width)"""
+    ys = rects[:, 1, None, None] + np.arange(height)[None, :, None]
+    xs = rects[:, 0, None, None] + np.arange(width)[None, None, :]
+    return ys, xs
+
+
+def split_leaves(moments, levels, threshold):
+    """Листья (N, 4) x, y, w, h: деление блоков BlockMoments, пока разброс цвета больше threshold"""
+    if not 0 <= levels <= MAX_LEVELS:
+        raise ValueError(f"levels must be between 0 and {MAX_LEVELS}: {levels}")
+    height, width = moments.height, moments.width
+    size_w, size_h = moments.block_width << levels, moments.block_height << levels
+    y0, x0 = np.meshgrid(np.arange(0, height, size_h), np.arange(0, width, size_w), indexing='ij')
+    y0, x0 = y0.ravel(), x0.ravel()
+    limit = float(threshold) ** 2
+    leaves = []
+    for level in range(levels, -1, -1):
+        y1, x1 = np.minimum(y0 + size_h, height), np.minimum(x0 + size_w, width)
+        split = moments.variance(y0, y1, x0, x1) > limit if level else np.zeros(len(y0), dtype=bool)
+        keep = ~split
+        leaves.append(np.stack([x0[keep], y0[keep], x1[keep] - x0[keep], y1[keep] - y0[keep]], axis=1))
+        if not split.any():
+            break
+        # Четыре четверти каждого делимого блока; четверти за краем изображения отбрасываются
+        size_w, size_h = size_w // 2, size_h // 2
+        y0 = (y0[split, None] + np.array([0, 0, size_h, size_h])).ravel()
+        x0 = (x0[split, None] + np.array([0, size_w, 0, size_w])).ravel()
+        inside = (y0 < height) & (x0 < width)
+        y0, x0 = y0[inside], x0[inside]
+    rects = np.concatenate(leaves).astype(np.int64)
+    return rects[np.lexsort((rects[:, 0], rects[:, 1]))]
+
+
+def leaf_colors(arr, rects, grid_function):
+    """Цвета листьев (N, 3) uint8 функцией сетки (как compute_grid с выбранным методом).
+
+    Листья одного размера выкладываются в ряд (height, N * width, 3) и
+    считаются одной сеткой блоков width x height.
+    """
+    colors = np.empty((len(rects), 3), dtype=np.uint8)
+    tree = QuadTree(rects, colors, arr.shape[1], arr.shape[0], 1, 1, 0)
+    for index, width, height in tree._groups():
+        ys, xs = gather_index(rects[index], width, height)
+        row = arr[ys, xs].transpose(1, 0, 2, 3).reshape(height, len(index) * width, arr.shape[2])
+        colors[index] = grid_function(row, width, height)[0]
+    return colors
+
+
+def quadtree_json(tree, matrix_type='rgb', strings=None):
+    """Словарь JSON-матрицы листьев для --matrix-json.
+
+    Каждый лист - x, y, ширина, высота и цвет в формате matrix_type:
+    aoa - [x, y, w, h, [r, g, b]]; sla - плоский список по 7 чисел на лист;
+    slo - объекты {x, y, w, h, r, g, b}; b64 - прямоугольники int32 и цвета
+    RGB в base64; hex/rgb/cmyk - [x, y, w, h, строка цвета]. strings -
+    строки цветов для hex/rgb/cmyk (pixel_strings по colors).
+    """
+    data = {"width": tree.width, "height": tree.height,
+            "min_block_width": tree.block_width, "min_block_height": tree.block_height,
+            "levels": tree.levels, "count": len(tree)}
+    rects, colors = tree.rects.tolist(), tree.colors.tolist()
+    if matrix_type == 'aoa':
+        data["blocks"] = [rect + [color] for rect, color in zip(rects, colors)]
+    elif matrix_type == 'sla':
+        data["fields"] = ["x", "y", "w", "h", "r", "g", "b"]
+        data["blocks"] = np.concatenate([tree.rects, tree.colors], axis=1).ravel().tolist()
+    elif matrix_type == 'slo':
+        data["blocks"] = [dict(zip("xywh", rect), **dict(zip("rgb", color))) for rect, color in zip(rects, colors)]
+    elif matrix_type == 'b64':
+        data["format"] = "rects: int32 little-endian x, y, w, h; colors: RGB"
+        data["rects"] = base64.b64encode(tree.rects.astype('<i4').tobytes()).decode('ascii')
+        data["colors"] = base64.b64encode(tree.colors.tobytes()).decode('ascii')
+    else:
+        data["blocks"] = [rect + [string] for rect, string in zip(rects, strings)]
+    return data
+
+
+def quadtree_text(tree, symbols):
+    """TXT-матрица листьев: строка 'x y w h символ' на лист"""
+    return '\n'.join(f"{x} {y} {w} {h} {symbol}" for (x, y, w, h), symbol in zip(tree.rects.tolist(), symbols))
@@ -0,0 +1,92 @@
+"""Пикселизация областей интереса (--roi, --roi-mask).
+
+Области задаются прямоугольниками X,Y,W,H или маской (ненулевые пиксели).
+Пикселизируются только блоки общей сетки изображения (от левого верхнего
+угла), которые пересекаются с областями, поэтому каждый такой блок
+совпадает с блоком полной пикселизации. Выбранные блоки объединяются в
+прямоугольники, и каждый прямоугольник обрабатывается на своём виде
+исходного массива: цвета считает та же функция сетки, что и для целого
+изображения, и они записываются обратно в тот же вид. Остальные пиксели
+не читаются и не меняются, полноразмерных копий нет - цена пропорциональна
+площади областей (маска читается целиком, по байту на пиксель).
+"""
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+from pixelate_engine import grid_shape, upsample_grid
+
+Rect = namedtuple('Rect', ['x', 'y', 'width', 'height'])
+
+
+def parse_rect(text):
+    """Rect из строки X,Y,W,H (координаты в пикселях выходного изображения)"""
+    try:
+        x, y, width, height = (int(part) for part in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"region must be X,Y,W,H: '{text}'") from None
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"region width and height must be positive: '{text}'")
+    return Rect(x, y, width, height)
+
+
+def rect_blocks(rects, width, height, block_width, block_height):
+    """Маска блоков (rows, cols) bool: блоки, пересекающие хотя бы один прямоугольник"""
+    selected = np.zeros(grid_shape(width, height, block_width, block_height), dtype=bool)
+    for x, y, w, h in rects:
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, width), min(y + h, height)
+        if x1 > x0 and y1 > y0:
+            selected[y0 // block_height:(y1 - 1) // block_height + 1,
+                     x0 // block_width:(x1 - 1) // block_width + 1] = True
+    return selected
+
+
+def mask_blocks(mask, block_width, block_height):
+    """Маска блоков (rows, cols) bool: блоки с хотя бы одним ненулевым пикселем маски (H, W)"""
+    mask = np.asarray(mask)
+    if mask.dtype != np.uint8:
+        mask = (mask != 0).view(np.uint8)
+    height, width = mask.shape
+    rows = np.maximum.reduceat(mask, np.arange(0, height, block_height), axis=0)
+    return np.maximum.reduceat(rows, np.arange(0, width, block_width), axis=1) != 0
+
+
+def block_rects(selected):
+    """Выбранные блоки как прямоугольники сетки [(r0, r1, c0, c1)].
+
+    В каждой строке блоков ищутся отрезки подряд идущих выбранных блоков;
+    одинаковые отрезки соседних строк сливаются в один прямоугольник.
+    """
+    rects = []
+    open_runs = {}
+    padded = np.zeros(selected.shape[1] + 2, dtype=np.int8)
+    for row in range(selected.shape[0] + 1):
+        runs = set()
+        if row < selected.shape[0]:
+            padded[1:-1] = selected[row]
+            edges = np.flatnonzero(np.diff(padded))
+            runs = set(zip(edges[0::2].tolist(), edges[1::2].tolist()))
+        for run in list(open_runs):
+            if run not in runs:
+                rects.append((open_runs.pop(run), row) + run)
+        for run in runs:
+            open_runs.setdefault(run, row)
+    return rects
+
+
+def pixelate_blocks(arr, selected, block_width, block_height, grid_function):
+    """Пикселизирует выбранные блоки массива (H, W, 3) на месте и возвращает его.
+
+    grid_function(region, block_width, block_height) -> цвета (rows, cols, 3),
+    как compute_grid с уже выбранным методом.
+    """
+    height, width = arr.shape[:2]
+    for r0, r1, c0, c1 in block_rects(selected):
+        y0, y1 = r0 * block_height, min(r1 * block_height, height)
+        x0, x1 = c0 * block_width, min(c1 * block_width, width)
+        region = arr[y0:y1, x0:x1]
+        grid = grid_function(region, block_width, block_height)
+        upsample_grid(grid, block_width, block_height, x1 - x0, y1 - y0, out=region)
+    return arr
@@ -0,0 +1,339 @@
+"""HTTP-сервис пикселизации (pixelate.py serve) с прогретыми исполнителями.
+
+Модули (NumPy, OpenCV, scikit-learn, pixelate) загружаются один раз при
+старте исполнителей, поэтому запрос платит только за обработку.
+
+    POST /pixelate?point-w=8&mode-grayscale=1&output=json&matrix-json=hex
+        тело - байты изображения; параметры запроса - те же опции, что у
+        командной строки (без ведущих --, флаги - со значением 1/true);
+        output: image (по умолчанию), json, txt или bin.
+    GET /metrics - счётчики, задержки (p50/p90/p99) и пропускная способность, JSON
+    GET /health  - проверка живости
+
+Очередь ограничена: одновременно принимается не больше workers + max_queue
+запросов, остальные сразу получают 503. По умолчанию сервер слушает
+только 127.0.0.1.
+"""
+import argparse
+import json
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+import pixelate
+from pixelate_matrix import MATRIX_BIN_SUFFIXES, matrix_compressor
+
+OUTPUTS = ('image', 'json', 'txt', 'bin')
+BACKENDS = ('process', 'thread')
+
+# Опции, ссылающиеся на файлы и каталоги сервера или на консоль, и опции,
+# обходящие ограничения пула (свои потоки/процессы и бюджет памяти на запрос)
+FORBIDDEN_OPTIONS = ('out-prefix', 'out-name', 'manifest', 'jobs', 'force', 'console', 'palette-file',
+                     'cache', 'cache-mb', 'variant', 'profile', 'profile-out', 'roi-mask',
+                     'workers', 'workers-backend', 'strip-mb')
+
+# Запрещённые значения разрешённых опций: полная таблица палитры - 16M
+# записей, которые строятся и пишутся на диск сервера
+FORBIDDEN_VALUES = {'palette-lut': ('full',)}
+
+# Формат матрицы по умолчанию, если запрошен её вывод без явного формата
+DEFAULT_MATRIX = {'json': ('matrix_json', 'rgb'), 'txt': ('matrix_txt', 'ansi'), 'bin': ('matrix_bin', 'npy')}
+
+# Задержки последних запросов для перцентилей и окно для текущей пропускной способности
+LATENCY_WINDOW = 1024
+THROUGHPUT_WINDOW = 60.0
+
+
+class RequestError(Exception):
+    """Ошибка запроса с HTTP-статусом"""
+
+    def __init__(self, status, message):
+        super().__init__(status, message)
+        self.status = status
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+class _RequestParser(argparse.ArgumentParser):
+    def error(self, message):
+        raise RequestError(400, message)
+
+
+def content_length(header, limit):
+    """Длина тела из заголовка Content-Length; RequestError, если её нет или она не от 1 до limit"""
+    if not header:
+        raise RequestError(411, 'image body required')
+    if not (header.isascii() and header.isdigit()):
+        raise RequestError(400, f"invalid Content-Length '{header}'")
+    length = int(header)
+    if length == 0:
+        raise RequestError(411, 'image body required')
+    if length > limit:
+        raise RequestError(413, 'upload too large')
+    return length
+
+
+def request_args(query):
+    """(args, output) из строки запроса; args - как у командной строки"""
+    parser = pixelate.build_parser(_RequestParser)
+    argv = []
+    output = 'image'
+    for name, values in parse_qs(query, keep_blank_values=True).items():
+        if name == 'output':
+            output = values[-1]
+            continue
+        if name in FORBIDDEN_OPTIONS:
+            raise RequestError(400, f"option '{name}' is not available over HTTP")
+        action = parser._option_string_actions.get('--' + name)
+        if action is None:
+            raise RequestError(400, f"unknown option '{name}'")
+        for value in values:
+            if value in FORBIDDEN_VALUES.get(name, ()):
+                raise RequestError(400, f"{name}={value} is not available over HTTP")
+            if action.nargs == 0:
+                if value.lower() in ('', '1', 'true', 'yes', 'on'):
+                    argv.append('--' + name)
+            else:
+                argv += ['--' + name, value] if value else ['--' + name]
+    if output not in OUTPUTS:
+        raise RequestError(400, f"output must be one of {', '.join(OUTPUTS)}")
+    args = parser.parse_args(argv + ['upload'])
+    if output in DEFAULT_MATRIX:
+        attribute, default = DEFAULT_MATRIX[output]
+        if not getattr(args, attribute):
+            setattr(args, attribute, default)
+    # out-type входит в путь результата: допускается только расширение, известное Pillow
+    if args.out_type and '.' + args.out_type.lower() not in Image.registered_extensions():
+        raise RequestError(400, f"unknown output type '{args.out_type}'")
+    if args.matrix_bin:
+        try:
+            matrix_compressor(args.matrix_bin)
+        except RuntimeError as e:
+            raise RequestError(400, str(e)) from None
+    return args, output
+
+
+def render_request(data, args, output='image'):
+    """Задача исполнителя: (content_type, bytes) результата для загруженных байтов"""
+    with tempfile.TemporaryDirectory(prefix='pixelate-') as directory:
+        source = os.path.join(directory, 'upload')
+        with open(source, 'wb') as f:
+            f.write(data)
+        args.out_name = os.path.join(directory, 'result')
+        messages = []
+        written = pixelate.process_image(source, args, log=messages.append)
+        if not written:
+            raise RequestError(400, '\n'.join(messages) or 'processing failed')
+
+        image_path = written[0]
+        if output == 'image':
+            path = image_path
+            content_type = mimetypes.guess_type(image_path)[0] or 'application/octet-stream'
+        elif output == 'json':
+            path, content_type = f"{image_path}.json", 'application/json'
+        elif output == 'txt':
+            path, content_type = f"{image_path}.txt", 'text/plain; charset=utf-8'
+        else:
+            path, content_type = image_path + MATRIX_BIN_SUFFIXES[args.matrix_bin], 'application/octet-stream'
+        if path not in written:
+            raise RequestError(500, '\n'.join(messages) or f"{output} output was not written")
+        with open(path, 'rb') as f:
+            return content_type, f.read()
+
+
+def warm_worker():
+    """Инициализация исполнителя: загружаем ленивые зависимости и прогоняем маленькое изображение"""
+    import cv2  # noqa: F401
+    from sklearn.cluster import KMeans  # noqa: F401
+    pixelate.pixelate_grid(Image.new('RGB', (16, 16)), 4, 4)
+
+
+class Metrics:
+    """Счётчики запросов, задержки и пропускная способность; потокобезопасно"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.statuses = {}
+        self.active = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.completed = deque()
+
+    def begin(self):
+        with self.lock:
+            self.active += 1
+
+    def finish(self, status, latency, bytes_in=0, bytes_out=0, began=True):
+        now = time.time()
+        with self.lock:
+            if began:
+                self.active -= 1
+            self.requests += 1
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            if status == 200:
+                self.latencies.append(latency)
+                self.completed.append(now)
+            while self.completed and self.completed[0] < now - THROUGHPUT_WINDOW:
+                self.completed.popleft()
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            uptime = time.time() - self.started
+            ok = self.statuses.get(200, 0)
+
+            def percentile(q):
+                return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else None
+
+            return {
+                'uptime_s': round(uptime, 3),
+                'requests': self.requests,
+                'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+                'active': self.active,
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'latency_ms': {'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99),
+                               'mean': sum(latencies) / len(latencies) * 1000 if latencies else None},
+                'throughput_rps': {'total': ok / uptime if uptime else 0.0,
+                                   'last_60s': len(self.completed) / min(THROUGHPUT_WINDOW, uptime or 1)},
+            }
+
+
+class PixelateHandler(BaseHTTPRequestHandler):
+    server_version = 'pixelate'
+
+    def _send(self, status, body, content_type='application/json'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def _error(self, status, message):
+        return self._send(status, json.dumps({'error': message}))
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == '/health':
+            self._send(200, 'ok\n', 'text/plain')
+        elif path == '/metrics':
+            self._send(200, json.dumps(self.server.metrics.snapshot(), indent=2))
+        else:
+            self._error(404, 'not found')
+
+    def do_POST(self):
+        start = time.perf_counter()
+        metrics = self.server.metrics
+        url = urlsplit(self.path)
+        if url.path not in ('/', '/pixelate'):
+            self._error(404, 'not found')
+            metrics.finish(404, 0, began=False)
+            return
+
+        try:
+            length = content_length(self.headers.get('Content-Length'), self.server.max_upload_bytes)
+        except RequestError as e:
+            self._error(e.status, str(e))
+            self.close_connection = True
+            metrics.finish(e.status, 0, began=False)
+            return
+
+        if not self.server.slots.acquire(blocking=False):
+            self._error(503, 'server busy')
+            self.close_connection = True
+            metrics.finish(503, 0, began=False)
+            return
+        metrics.begin()
+        status, sent = 500, 0
+        try:
+            data = self.rfile.read(length)
+            args, output = request_args(url.query)
+            content_type, body = self.server.executor.submit(render_request, data, args, output).result()
+            status = 200
+            sent = self._send(200, body, content_type)
+        except RequestError as e:
+            status = e.status
+            sent = self._error(status, str(e))
+        except Exception as e:
+            sent = self._error(500, f"{type(e).__name__}: {e}")
+        finally:
+            self.server.slots.release()
+            metrics.finish(status, time.perf_counter() - start, length, sent)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class PixelateServer(ThreadingHTTPServer):
+    """HTTP-сервер с пулом прогретых исполнителей и ограниченной очередью"""
+
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 8080), workers=None, backend='process', max_queue=16,
+                 max_upload_bytes=64 << 20, verbose=False):
+        self.workers = workers or os.cpu_count() or 1
+        if backend == 'process':
+            self.executor = ProcessPoolExecutor(self.workers, initializer=warm_worker)
+        elif backend == 'thread':
+            self.executor = ThreadPoolExecutor(self.workers, initializer=warm_worker)
+        else:
+            raise ValueError(f"Unknown backend: {backend}")
+        # Прогрев: исполнители запускаются до первого запроса
+        for future in [self.executor.submit(warm_worker) for _ in range(self.workers)]:
+            future.result()
+        self.slots = threading.BoundedSemaphore(self.workers + max_queue)
+        self.max_upload_bytes = max_upload_bytes
+        self.metrics = Metrics()
+        self.verbose = verbose
+        super().__init__(address, PixelateHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(cancel_futures=True)
+
+
+def serve_main(argv=None):
+    parser = argparse.ArgumentParser(prog='pixelate.py serve', description='Run the pixelation HTTP service.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to bind (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on (default: 8080, 0 - any free)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Warm worker count (default: number of CPUs)')
+    parser.add_argument('--backend', choices=BACKENDS, default='process',
+                        help='Worker pool type (default: process)')
+    parser.add_argument('--max-queue', type=int, default=16,
+                        help='Requests allowed to wait for a worker; more get 503 (default: 16)')
+    parser.add_argument('--max-upload-mb', type=float, default=64, help='Upload size limit in MB (default: 64)')
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args(argv)
+
+    server = PixelateServer((args.host, args.port), args.workers, args.backend, args.max_queue,
+                            int(args.max_upload_mb * 1024 * 1024), args.verbose)
+    host, port = server.server_address[:2]
+    print(f"Serving on http://{host}:{port} with {server.workers} {args.backend} workers", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,382 @@
+"""Потоковая пикселизация огромных изображений с ограниченной памятью.
+
+Исходник читается горизонтальными полосами, и для каждой полосы по очереди
+выполняются изменение размера, яркость и пикселизация, после чего готовые
+строки сразу дописываются в выходной файл. Пиковая память определяется
+бюджетом полосы, а не размером изображения.
+
+Изменение размера совпадает с Image.resize(..., LANCZOS) побитово:
+горизонтальный проход делает сам Pillow (строки независимы), а
+вертикальный повторяет Resample.c - те же коэффициенты с фиксированной
+точкой, посчитанные один раз на всё изображение.
+"""
+import math
+import os
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from pixelate_engine import image_to_array, upsample_grid
+
+# Режимы, для которых изменение размера выполняется по полосам
+STREAM_MODES = ('RGB', 'RGBA', 'L')
+
+DEFAULT_STRIP_BYTES = 64 * 1024 * 1024
+
+# Pillow: PRECISION_BITS для 8-битных каналов (Resample.c)
+PRECISION_BITS = 32 - 8 - 2
+
+
+# --- Чтение исходника полосами -------------------------------------------------
+# У читателя есть size, mode, read(y0, y1) - строки [y0, y1) исходника как
+# изображение PIL того же режима - и close().
+
+class ArrayReader:
+    """Массив (H, W[, C]) uint8, например np.load(..., mmap_mode='r')"""
+
+    def __init__(self, arr):
+        self.arr = arr
+        self.size = (arr.shape[1], arr.shape[0])
+        channels = arr.shape[2] if arr.ndim == 3 else 1
+        self.mode = {1: 'L', 3: 'RGB', 4: 'RGBA'}[channels]
+
+    def read(self, y0, y1):
+        return Image.fromarray(np.ascontiguousarray(self.arr[y0:y1]), self.mode)
+
+    def close(self):
+        pass
+
+
+class FullReader:
+    """Запасной вариант: изображение декодируется целиком"""
+
+    def __init__(self, image):
+        self.image = image
+        self.size = image.size
+        self.mode = image.mode
+
+    def read(self, y0, y1):
+        return self.image.crop((0, y0, self.size[0], y1))
+
+    def close(self):
+        self.image.close()
+
+
+# Байт на пиксель для несжатых raw-тайлов, у которых Pillow не хранит шаг строки
+_RAW_BYTES = {'L': 1, 'RGB': 3, 'BGR': 3, 'RGBA': 4, 'RGBX': 4, 'BGRA': 4, 'BGRX': 4}
+
+
+class TileReader:
+    """Декодирует только нужные полосы файла через список тайлов Pillow.
+
+    Подходит для файлов из нескольких полос во всю ширину (многополосный
+    TIFF) и для несжатых raw-данных (PPM, BMP, несжатый TIFF), которые
+    режутся на полосы пересчётом смещения.
+    """
+
+    def __init__(self, path, image):
+        self.path = path
+        self.size = image.size
+        self.mode = image.mode
+        self.tiles = list(image.tile)
+
+    @classmethod
+    def supports(cls, image):
+        tiles = getattr(image, 'tile', None) or []
+        width = image.size[0]
+        if len(tiles) == 1:
+            tile = tiles[0]
+            return tile[0] == 'raw' and tile[1] == (0, 0) + image.size and cls._raw_stride(tile, width)
+        return len(tiles) > 1 and all(t[0] != 'libtiff' and t[1][0] == 0 and t[1][2] == width
+                                      for t in tiles)
+
+    @staticmethod
+    def _raw_stride(tile, width):
+        args = tile[3] if isinstance(tile[3], tuple) else (tile[3], 0, 1)
+        rawmode, stride = args[0], args[1] if len(args) > 1 else 0
+        return stride or width * _RAW_BYTES.get(rawmode, 0)
+
+    @staticmethod
+    def _moved(tile, extents, offset, args):
+        """Копия тайла с новыми координатами (в Pillow 11+ это namedtuple)"""
+        if hasattr(tile, '_replace'):
+            return tile._replace(extents=extents, offset=offset, args=args)
+        return (tile[0], extents, offset, args)
+
+    def _subtiles(self, y0, y1):
+        width, height = self.size
+        if len(self.tiles) == 1:
+            tile = self.tiles[0]
+            args = tile[3] if isinstance(tile[3], tuple) else (tile[3], 0, 1)
+            stride = self._raw_stride(tile, width)
+            orientation = args[2] if len(args) > 2 else 1
+            first = y0 if orientation > 0 else height - y1
+            return y0, y1, [self._moved(tile, (0, 0, width, y1 - y0), tile[2] + first * stride,
+                                        (args[0], stride, orientation))]
+        chosen = [t for t in self.tiles if t[1][1] < y1 and t[1][3] > y0]
+        top = min(t[1][1] for t in chosen)
+        bottom = max(t[1][3] for t in chosen)
+        return top, bottom, [self._moved(t, (0, t[1][1] - top, width, t[1][3] - top), t[2], t[3])
+                             for t in chosen]
+
+    def read(self, y0, y1):
+        top, bottom, tiles = self._subtiles(y0, y1)
+        image = Image.open(self.path)
+        image.tile = tiles
+        image._size = (self.size[0], bottom - top)
+        if hasattr(image, '_tile_size'):
+            # TIFF выделяет буфер по размеру кадра, а не по image.size
+            image._tile_size = image._size
+        image.load()
+        # crop отвязывает результат от файла-источника
+        return image.crop((0, y0 - top, self.size[0], y1 - top))
+
+    def close(self):
+        pass
+
+
+def open_reader(path):
+    """Подбирает способ чтения полосами для файла"""
+    if path.lower().endswith('.npy'):
+        return ArrayReader(np.load(path, mmap_mode='r'))
+    image = Image.open(path)
+    if image.mode in STREAM_MODES and TileReader.supports(image):
+        return TileReader(path, image)
+    return FullReader(image)
+
+
+# --- Изменение размера по полосам -----------------------------------------------
+
+def _sinc(x):
+    if x == 0.0:
+        return 1.0
+    x = x * math.pi
+    return math.sin(x) / x
+
+
+def _lanczos(x):
+    if -3.0 <= x < 3.0:
+        return _sinc(x) * _sinc(x / 3)
+    return 0.0
+
+
+def lanczos_coefficients(in_size, out_size):
+    """Границы и коэффициенты фильтра, как precompute_coeffs в Pillow.
+
+    Возвращает (bounds, kk): bounds[i] = (первая строка, число строк),
+    kk[i] - коэффициенты с фиксированной точкой PRECISION_BITS.
+    Считается в float64 через math, чтобы совпасть с C до бита.
+    """
+    scale = in_size / out_size
+    filterscale = max(scale, 1.0)
+    support = 3.0 * filterscale
+    ksize = int(math.ceil(support)) * 2 + 1
+    ss = 1.0 / filterscale
+    bounds = np.zeros((out_size, 2), dtype=np.int64)
+    kk = np.zeros((out_size, ksize), dtype=np.int64)
+    for xx in range(out_size):
+        center = (xx + 0.5) * scale
+        xmin = max(int(center - support + 0.5), 0)
+        xmax = min(int(center + support + 0.5), in_size) - xmin
+        weights = []
+        total = 0.0
+        for x in range(xmax):
+            w = _lanczos((x + xmin - center + 0.5) * ss)
+            weights.append(w)
+            total += w
+        for x, w in enumerate(weights):
+            k = w / total if total != 0.0 else w
+            kk[xx, x] = int(-0.5 + k * (1 << PRECISION_BITS)) if k < 0 else int(0.5 + k * (1 << PRECISION_BITS))
+        bounds[xx] = xmin, xmax
+    return bounds, kk
+
+
+def _vertical_pass(rows, first_row, bounds, kk):
+    """Вертикальный проход Resample.c для строк полосы.
+
+    rows - строки исходника (уже сжатые по ширине), начиная с first_row.
+    """
+    out = np.empty((len(bounds),) + rows.shape[1:], dtype=np.uint8)
+    for i, (ymin, count) in enumerate(bounds):
+        window = rows[ymin - first_row:ymin - first_row + count]
+        acc = np.tensordot(kk[i, :count], window, axes=(0, 0)) + (1 << (PRECISION_BITS - 1))
+        out[i] = np.clip(acc >> PRECISION_BITS, 0, 255)
+    return out
+
+
+class StripResizer:
+    """Image.resize(size, LANCZOS) по полосам выходных строк"""
+
+    def __init__(self, reader, size):
+        self.reader = reader
+        self.size = size
+        src_width, src_height = reader.size
+        self.horizontal = size[0] != src_width
+        self.vertical = size[1] != src_height
+        if self.vertical:
+            self.bounds, self.kk = lanczos_coefficients(src_height, size[1])
+        # RGBA Pillow масштабирует в предумноженном виде (RGBa)
+        self.work_mode = 'RGBa' if reader.mode == 'RGBA' else reader.mode
+
+    def source_rows(self, y0, y1):
+        """Строки исходника, нужные для выходных строк [y0, y1)"""
+        if not self.vertical:
+            return y0, y1
+        bounds = self.bounds[y0:y1]
+        return int(bounds[:, 0].min()), int((bounds[:, 0] + bounds[:, 1]).max())
+
+    def read(self, y0, y1):
+        first, last = self.source_rows(y0, y1)
+        strip = self.reader.read(first, last)
+        if strip.mode != self.work_mode:
+            strip = strip.convert(self.work_mode)
+        if self.horizontal:
+            strip = strip.resize((self.size[0], strip.size[1]), Image.LANCZOS)
+        if self.vertical:
+            rows = np.asarray(strip).astype(np.int32)
+            out = _vertical_pass(rows, first, self.bounds[y0:y1], self.kk[y0:y1])
+            strip = Image.fromarray(out) if self.work_mode != 'RGBa' else \
+                Image.frombuffer('RGBa', (out.shape[1], out.shape[0]), out.tobytes(), 'raw', 'RGBa', 0, 1)
+        if strip.mode != self.reader.mode:
+            strip = strip.convert(self.reader.mode)
+        return strip
+
+
+# --- Запись по полосам ---------------------------------------------------------
+
+class PngStripWriter:
+    """Минимальный потоковый кодировщик PNG (8 бит RGB, фильтр Up)"""
+
+    def __init__(self, path, width, height):
+        self.f = open(path, 'wb')
+        self.compressor = zlib.compressobj(6)
+        self.previous = np.zeros(width * 3, dtype=np.uint8)
+        self.f.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.f.write(struct.pack('>I', len(data)) + kind + data)
+        self.f.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    def write(self, rows):
+        height = rows.shape[0]
+        flat = rows.reshape(height, -1)
+        raw = np.empty((height, flat.shape[1] + 1), dtype=np.uint8)
+        # Up: разница с предыдущей строкой, внутри блоков строки повторяются и дают нули
+        raw[:, 0] = 2
+        np.subtract(flat[0], self.previous, out=raw[0, 1:])
+        np.subtract(flat[1:], flat[:-1], out=raw[1:, 1:])
+        self.previous = flat[-1].copy()
+        data = self.compressor.compress(raw.tobytes())
+        if data:
+            self._chunk(b'IDAT', data)
+
+    def close(self):
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+        self.f.close()
+
+
+class NpyStripWriter:
+    """Массив .npy (H, W, 3), отображённый в память"""
+
+    def __init__(self, path, width, height):
+        self.arr = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(height, width, 3))
+        self.y = 0
+
+    def write(self, rows):
+        self.arr[self.y:self.y + len(rows)] = rows
+        self.y += len(rows)
+
+    def close(self):
+        self.arr.flush()
+        del self.arr
+
+
+class PpmStripWriter:
+    """Двоичный PPM (P6): заголовок и сырые строки"""
+
+    def __init__(self, path, width, height):
+        self.f = open(path, 'wb')
+        self.f.write(f"P6\n{width} {height}\n255\n".encode('ascii'))
+
+    def write(self, rows):
+        self.f.write(np.ascontiguousarray(rows).tobytes())
+
+    def close(self):
+        self.f.close()
+
+
+class ImageWriter:
+    """Прочие форматы: строки собираются в памяти и сохраняются Pillow в конце"""
+
+    def __init__(self, path, width, height):
+        self.path = path
+        self.canvas = np.empty((height, width, 3), dtype=np.uint8)
+        self.y = 0
+
+    def write(self, rows):
+        self.canvas[self.y:self.y + len(rows)] = rows
+        self.y += len(rows)
+
+    def close(self):
+        Image.fromarray(self.canvas, 'RGB').save(self.path)
+
+
+# Форматы, которые пишутся по полосам; остальные собираются в памяти целиком
+STRIP_WRITERS = {'png': PngStripWriter, 'npy': NpyStripWriter, 'ppm': PpmStripWriter}
+
+
+def open_writer(path, width, height):
+    ext = os.path.splitext(path)[1][1:].lower()
+    return STRIP_WRITERS.get(ext, ImageWriter)(path, width, height)
+
+
+# --- Конвейер -------------------------------------------------------------------
+
+def strip_rows(width, src_width, scale, block_height, strip_bytes):
+    """Высота полосы (кратная высоте блока), укладывающаяся в бюджет памяти"""
+    # Выходная строка: холст и строка int32-аккумулятора; исходная строка:
+    # декодированная, сжатая по ширине и её int32-копия
+    per_row = width * (3 + 4 * 4) + scale * (src_width * 4 + width * 4 * 5)
+    rows = int(strip_bytes // max(per_row, 1))
+    return max(block_height, rows // block_height * block_height)
+
+
+def stream_pixelate(reader, output_path, size, block_width, block_height, grid_function,
+                    brightness=None, strip_bytes=DEFAULT_STRIP_BYTES):
+    """Потоковая пикселизация: reader -> resize -> brightness -> блоки -> файл.
+
+    size - итоговый размер или None; brightness(image) - преобразование
+    полосы PIL; grid_function(arr, block_width, block_height) - сетка блоков.
+    Возвращает сетку цветов всего изображения (rows, cols, 3).
+    """
+    if size is None or size == reader.size:
+        source = reader
+    elif reader.mode in STREAM_MODES:
+        source = StripResizer(reader, size)
+    else:
+        # Режимы вроде P или I масштабируются целиком, как в обычном пути
+        source = FullReader(reader.read(0, reader.size[1]).resize(size, Image.LANCZOS))
+    width, height = source.size if size is None else size
+
+    scale = reader.size[1] / height
+    rows_per_strip = strip_rows(width, reader.size[0], scale, block_height, strip_bytes)
+    grids = []
+    writer = open_writer(output_path, width, height)
+    try:
+        for y0 in range(0, height, rows_per_strip):
+            y1 = min(y0 + rows_per_strip, height)
+            strip = source.read(y0, y1)
+            if brightness is not None:
+                strip = brightness(strip)
+            arr = image_to_array(strip)
+            grid = grid_function(arr, block_width, block_height)
+            writer.write(upsample_grid(grid, block_width, block_height, width, y1 - y0))
+            grids.append(grid)
+    finally:
+        writer.close()
+        reader.close()
+    return np.concatenate(grids, axis=0)
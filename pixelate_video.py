@@ -0,0 +1,446 @@
+"""Пикселизация видео и последовательностей кадров (pixelate.py video).
+
+    python pixelate.py video input.mp4 output.mp4 --point-w 16 --point-h 16
+    python pixelate.py video 'frames/*.png' 'out/frame_%05d.png' --threshold 0
+
+Кадры читаются через cv2.VideoCapture (видеофайл, камера, шаблон вида
+frame_%04d.png) или из списка изображений (каталог, шаблон с * и ?), а
+пишутся через cv2.VideoWriter либо по шаблону имени с %d.
+
+Между кадрами переиспользуются блоки: для каждого блока берётся
+наибольшее изменение канала пикселя относительно кадра, по которому блок
+был посчитан в последний раз (карта грязных блоков). Пересчитываются
+только блоки, где оно больше --threshold, на видах кадра - как области
+pixelate_roi; остальные сохраняют прежний цвет. При --threshold 0
+результат совпадает с покадровой пикселизацией побитово. При t > 0 цвет
+непересчитанного блока отличается от точного не больше чем на t только
+для методов BOUNDED_METHODS (среднее, медиана, взвешенное среднее и
+максимум каналов сдвигаются не больше, чем сами пиксели). У остальных
+ошибка не ограничена: порог bin-*/blwt* переключает блок между 0 и 255,
+тон gray-hsv-h переходит через 0, доминирующий цвет abdc меняется
+скачком; для точного результата с ними нужен --threshold 0.
+
+Чтение, пикселизация и запись идут конвейером в трёх потоках, связанных
+ограниченными очередями; буферы кадров ходят по кругу и не выделяются
+заново (декодирование OpenCV, преобразование цветов и кодирование
+отпускают GIL). Исключение - кадры последовательности изображений:
+cv2.imread декодирует каждый в новый массив, он копируется в буфер.
+"""
+import argparse
+import glob
+import os
+import queue
+import sys
+import threading
+import time
+from functools import partial
+
+import numpy as np
+
+import pixelate
+from pixelate_engine import upsample_grid
+from pixelate_roi import block_rects
+from pixelate_tone import adjust_array, is_identity
+
+# Кодек VideoWriter по расширению выходного файла
+VIDEO_FOURCC = {'.mp4': 'mp4v', '.m4v': 'mp4v', '.mov': 'mp4v', '.avi': 'MJPG', '.mkv': 'XVID'}
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp', '.ppm')
+DEFAULT_FPS = 25.0
+# Методы, у которых изменение пикселей не больше t сдвигает цвет блока не больше чем на t
+BOUNDED_METHODS = ('amac', 'meav', 'gray-rgb', 'gray-wav', 'gray-tc', 'gray-mb', 'gray-hsv-v')
+# Доля грязных блоков, с которой кадр дешевле пересчитать целиком
+FULL_FRAME_DIRTY = 0.5
+# Сколько ждать буфера или кадра, прежде чем снова проверить флаг остановки
+POLL_SECONDS = 0.1
+
+
+def block_max(values, block_width, block_height):
+    """Наибольшее значение каждого блока по всем каналам: (H, W, ch) uint8 -> (rows, cols)"""
+    height, width, channels = values.shape
+    flat = values.reshape(height, width * channels)
+    full = height // block_height * block_height
+    parts = []
+    if full:
+        parts.append(flat[:full].reshape(-1, block_height, width * channels).max(axis=1))
+    if full < height:
+        parts.append(flat[full:].max(axis=0, keepdims=True))
+    rows = np.concatenate(parts) if len(parts) > 1 else parts[0]
+    return np.maximum.reduceat(rows, np.arange(0, width * channels, block_width * channels), axis=1)
+
+
+class TemporalPixelator:
+    """Пикселизация кадров одного размера с переиспользованием блоков.
+
+    grid_function(region, block_width, block_height) -> цвета (rows, cols, 3),
+    как compute_grid с выбранным методом. process(frame) возвращает холст -
+    общий буфер, действительный до следующего вызова.
+    """
+
+    def __init__(self, block_width, block_height, grid_function, threshold=0):
+        self.block_width = block_width
+        self.block_height = block_height
+        self.grid_function = grid_function
+        self.threshold = threshold
+        self.reference = None  # Кадр, по которому посчитан каждый блок
+        self.grid = None
+        self.canvas = None
+        self._diff = None
+        self.frames = 0
+        self.blocks = 0
+        self.recomputed = 0
+
+    def _full(self, frame):
+        bw, bh = self.block_width, self.block_height
+        height, width = frame.shape[:2]
+        if self.reference is None or self.reference.shape != frame.shape:
+            self.reference = np.empty_like(frame)
+            self.canvas = np.empty_like(frame)
+            self._diff = np.empty_like(frame)
+        self.grid = self.grid_function(frame, bw, bh)
+        upsample_grid(self.grid, bw, bh, width, height, out=self.canvas)
+        np.copyto(self.reference, frame)
+
+    def dirty_blocks(self, frame):
+        """Карта (rows, cols) bool блоков, изменившихся больше порога"""
+        import cv2
+        cv2.absdiff(frame, self.reference, dst=self._diff)
+        return block_max(self._diff, self.block_width, self.block_height) > self.threshold
+
+    def process(self, frame):
+        bw, bh = self.block_width, self.block_height
+        height, width = frame.shape[:2]
+        if self.reference is None or self.reference.shape != frame.shape:
+            self._full(frame)
+            count = self.grid.shape[0] * self.grid.shape[1]
+        else:
+            dirty = self.dirty_blocks(frame)
+            count = int(np.count_nonzero(dirty))
+            if count > FULL_FRAME_DIRTY * dirty.size:
+                self._full(frame)
+            else:
+                for r0, r1, c0, c1 in block_rects(dirty):
+                    y0, y1 = r0 * bh, min(r1 * bh, height)
+                    x0, x1 = c0 * bw, min(c1 * bw, width)
+                    region = frame[y0:y1, x0:x1]
+                    colors = self.grid_function(region, bw, bh)
+                    self.grid[r0:r1, c0:c1] = colors
+                    upsample_grid(colors, bw, bh, x1 - x0, y1 - y0, out=self.canvas[y0:y1, x0:x1])
+                    self.reference[y0:y1, x0:x1] = region
+        self.frames += 1
+        self.blocks += self.grid.shape[0] * self.grid.shape[1]
+        self.recomputed += count
+        return self.canvas
+
+
+class CaptureSource:
+    """Кадры cv2.VideoCapture (BGR); read(buffer) декодирует в buffer, если он подходит"""
+
+    def __init__(self, path):
+        import cv2
+        self.capture = cv2.VideoCapture(int(path) if path.isdigit() else path)
+        if not self.capture.isOpened():
+            raise OSError(f"Cannot open video: {path}")
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or None
+
+    def read(self, buffer=None):
+        ok, frame = self.capture.read(buffer)
+        return frame if ok else None
+
+    def close(self):
+        self.capture.release()
+
+
+class SequenceSource:
+    """Кадры из списка файлов изображений (BGR), по порядку имён.
+
+    cv2.imread всегда декодирует в новый массив; read(buffer) копирует кадр
+    в buffer, если он подходит, чтобы буферы конвейера ходили по кругу.
+    """
+
+    fps = None
+
+    def __init__(self, paths):
+        if not paths:
+            raise OSError("No frames found")
+        self.paths = iter(paths)
+
+    def read(self, buffer=None):
+        import cv2
+        path = next(self.paths, None)
+        if path is None:
+            return None
+        frame = cv2.imread(path, cv2.IMREAD_COLOR)
+        if frame is None:
+            raise OSError(f"Cannot read frame: {path}")
+        return _into(frame, buffer)
+
+    def close(self):
+        pass
+
+
+def open_source(path):
+    """Источник кадров: каталог или шаблон с * - изображения, иначе cv2.VideoCapture"""
+    if os.path.isdir(path):
+        return SequenceSource(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                     if name.lower().endswith(IMAGE_SUFFIXES)))
+    if glob.has_magic(path):
+        return SequenceSource(sorted(glob.glob(path)))
+    return CaptureSource(path)
+
+
+class FrameSink:
+    """Запись кадров BGR: видеофайл через cv2.VideoWriter или изображения по шаблону с %d"""
+
+    def __init__(self, path, fps, fourcc=None):
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self.writer = None
+        self.count = 0
+        output_dir = os.path.dirname(path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        suffix = os.path.splitext(path)[1].lower()
+        self.sequence = '%' in path and fourcc is None and suffix not in VIDEO_FOURCC
+        if not self.sequence and fourcc is None and suffix not in VIDEO_FOURCC:
+            raise ValueError(f"Unknown video format '{suffix}': use {', '.join(VIDEO_FOURCC)}, "
+                             f"--fourcc or an image pattern with %d")
+        if self.sequence:
+            import cv2
+            if not cv2.haveImageWriter(path % 0):
+                raise ValueError(f"Unknown image format '{suffix}' in pattern: {path}")
+
+    def write(self, frame):
+        import cv2
+        if self.sequence:
+            target = self.path % self.count
+            if not cv2.imwrite(target, frame):
+                raise OSError(f"Cannot write frame: {target}")
+        else:
+            if self.writer is None:
+                fourcc = self.fourcc or VIDEO_FOURCC[os.path.splitext(self.path)[1].lower()]
+                height, width = frame.shape[:2]
+                self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*fourcc), self.fps, (width, height))
+                if not self.writer.isOpened():
+                    raise OSError(f"Cannot open video writer: {self.path} ({fourcc})")
+            self.writer.write(frame)
+        self.count += 1
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+def _put(q, item, stop):
+    """put в ограниченную очередь, прерываемый флагом stop"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _into(frame, buffer):
+    """frame, скопированный в buffer, если тот подходит по форме и типу, иначе сам frame"""
+    if buffer is None or buffer.shape != frame.shape or buffer.dtype != frame.dtype:
+        return frame
+    np.copyto(buffer, frame)
+    return buffer
+
+
+def _resize(frame, size, buffer=None, resample='lanczos'):
+    """Кадр размера size; в buffer, если он подходит.
+
+    'lanczos' - LANCZOS Pillow, как resize_image у изображений: тот же --zoom
+    у кадра и у изображения даёт ту же сетку. 'fast' - INTER_AREA OpenCV:
+    в десятки раз быстрее, но пиксели немного отличаются от изображений.
+    """
+    import cv2
+    if resample == 'fast':
+        return cv2.resize(frame, size, dst=buffer, interpolation=cv2.INTER_AREA)
+    from PIL import Image
+    resized = np.asarray(Image.fromarray(frame).resize(size, Image.LANCZOS))
+    result = _into(resized, buffer)
+    return resized.copy() if result is resized else result
+
+
+def _get(q, stop):
+    """get из очереди, прерываемый флагом stop; None - остановка"""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            pass
+    return None
+
+
+def _read_frames(source, frames, free, stop, scale=(None, None, None), tone=None, limit=None,
+                 resample='lanczos'):
+    """Поток чтения: кадр RGB (после изменения размера и кривой тона) в свободный буфер.
+
+    scale - (width, height, zoom) как у resized_size; размер определяется по первому кадру.
+    resample - 'lanczos' или 'fast', см. _resize.
+    """
+    import cv2
+    size = None  # None - ещё не известен, False - без изменения размера
+    decoded = None
+    count = 0
+    try:
+        while limit is None or count < limit:
+            buffer = _get(free, stop)
+            if stop.is_set():
+                return
+            if size:
+                decoded = source.read(decoded)
+                frame = None if decoded is None else _resize(decoded, size, buffer, resample)
+            else:
+                frame = source.read(buffer)
+            if frame is None:
+                break
+            if size is None:
+                size = pixelate.resized_size(frame.shape[1::-1], *scale) or False
+                if size:
+                    decoded, frame = frame, _resize(frame, size, resample=resample)
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=frame)
+            if tone is not None:
+                adjust_array(frame, *tone)
+            if not _put(frames, frame, stop):
+                return
+            count += 1
+        _put(frames, None, stop)
+    except Exception as e:
+        _put(frames, e, stop)
+
+
+def _write_frames(sink, written, free, errors):
+    """Поток записи; после ошибки кадры только возвращаются в пул, чтобы конвейер не встал"""
+    while True:
+        frame = written.get()
+        if frame is None:
+            return
+        if not errors:
+            try:
+                sink.write(frame)
+            except Exception as e:
+                errors.append(e)
+        free.put(frame)
+
+
+def pixelate_video(source_path, target_path, grid_function, block_width=10, block_height=10, threshold=0,
+                   width=None, height=None, zoom=None, tone=(0, 1.0, 1.0), fps=None, fourcc=None,
+                   queue_size=4, limit=None, resample='lanczos'):
+    """Пикселизирует кадры source_path в target_path; возвращает статистику.
+
+    grid_function - как у TemporalPixelator, tone - (яркость, контраст, гамма),
+    resample - уменьшение кадров (см. _resize).
+    В статистике: frames, seconds, fps, recomputed - доля пересчитанных блоков.
+    """
+    import cv2
+    source = open_source(source_path)
+    try:
+        sink = FrameSink(target_path, fps or source.fps or DEFAULT_FPS, fourcc)
+    except Exception:
+        source.close()
+        raise
+    pixelator = TemporalPixelator(block_width, block_height, grid_function, threshold)
+
+    # Пулы буферов: None - буфер ещё не выделен, его создаст первый кадр
+    frames, free_in = queue.Queue(queue_size), queue.Queue()
+    written, free_out = queue.Queue(queue_size), queue.Queue()
+    for _ in range(queue_size + 2):
+        free_in.put(None)
+        free_out.put(None)
+    stop = threading.Event()
+    errors = []
+    reader = threading.Thread(target=_read_frames, daemon=True,
+                              args=(source, frames, free_in, stop, (width, height, zoom),
+                                    None if is_identity(*tone) else tone, limit, resample))
+    writer = threading.Thread(target=_write_frames, args=(sink, written, free_out, errors), daemon=True)
+
+    started = time.perf_counter()
+    reader.start()
+    writer.start()
+    try:
+        while not errors:
+            frame = frames.get()
+            if isinstance(frame, Exception):
+                raise frame
+            if frame is None:
+                break
+            canvas = pixelator.process(frame)
+            free_in.put(frame)
+            out = free_out.get()
+            if out is None or out.shape != canvas.shape:
+                out = np.empty_like(canvas)
+            cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR, dst=out)
+            written.put(out)
+    finally:
+        stop.set()
+        written.put(None)
+        writer.join()
+        reader.join()
+        sink.close()
+        source.close()
+    if errors:
+        raise errors[0]
+    if not pixelator.frames:
+        raise OSError(f"No frames in {source_path}")
+    seconds = time.perf_counter() - started
+    return {'frames': pixelator.frames, 'seconds': seconds,
+            'fps': pixelator.frames / seconds if seconds else 0.0,
+            'recomputed': pixelator.recomputed / pixelator.blocks if pixelator.blocks else 0.0}
+
+
+def video_main(argv=None):
+    parser = argparse.ArgumentParser(prog='pixelate.py video',
+                                     description='Pixelate a video or an image sequence frame by frame.')
+    parser.add_argument('source', help='Video file, camera index, frame pattern (frame_%%04d.png), '
+                                       'directory or glob of images')
+    parser.add_argument('target', help=f"Output video ({', '.join(VIDEO_FOURCC)}) or image pattern with %%d")
+    parser.add_argument('--averating', choices=pixelate.COLOR_METHODS + pixelate.GRAYSCALE_METHODS
+                        + pixelate.BLACK_WHITE_METHODS, default='meav', help='Averaging method to use')
+    parser.add_argument('--mode-color', action='store_true', help='Output in color mode')
+    parser.add_argument('--mode-black-white', action='store_true', help='Output in black and white mode')
+    parser.add_argument('--mode-grayscale', action='store_true', help='Output in grayscale mode')
+    parser.add_argument('--point-w', type=int, default=10, help='Block width in pixels (default: 10)')
+    parser.add_argument('--point-h', type=int, default=10, help='Block height in pixels (default: 10)')
+    parser.add_argument('--width', type=int, help='Output frame width in pixels')
+    parser.add_argument('--height', type=int, help='Output frame height in pixels')
+    parser.add_argument('--zoom', type=float, help='Zoom factor (positive to enlarge, negative to shrink)')
+    parser.add_argument('--resample', choices=pixelate.RESAMPLE_MODES, default='lanczos',
+                        help='Resize quality: lanczos (default, same grid as for images) or fast - OpenCV '
+                             'INTER_AREA, much faster on large frames but slightly different colors')
+    parser.add_argument('--bright', type=int, default=0, help='Brightness adjustment (-255 to 255)')
+    parser.add_argument('--contrast', type=float, default=1.0, help='Contrast factor around mid-gray (default: 1.0)')
+    parser.add_argument('--gamma', type=pixelate.positive_float, default=1.0, help='Gamma (default: 1.0)')
+    parser.add_argument('--abdc-strategy', choices=pixelate.ABDC_STRATEGIES, default='mean',
+                        help='Dominant color search for abdc (default: mean)')
+    parser.add_argument('--abdc-clusters', type=int, default=3, help='Cluster count for --abdc-strategy kmeans')
+    parser.add_argument('--threshold', type=int, default=8,
+                        help='Recompute a block only if a pixel channel changed by more than this '
+                             'since it was last computed (default: 8, 0 - exact)')
+    parser.add_argument('--fps', type=float, help='Output frame rate (default: source rate or 25)')
+    parser.add_argument('--fourcc', help='VideoWriter codec, e.g. mp4v, MJPG, avc1 (default: by extension)')
+    parser.add_argument('--queue', type=int, default=4, help='Frames buffered between pipeline stages (default: 4)')
+    parser.add_argument('--frames', type=pixelate.positive_int, help='Stop after this many frames')
+    args = parser.parse_args(argv)
+    if args.fourcc is not None and len(args.fourcc) != 4:
+        parser.error('--fourcc must be four characters')
+
+    mode = pixelate.resolve_mode(args)
+    method = pixelate.resolve_method(args.averating, mode)
+    if args.threshold > 0 and method not in BOUNDED_METHODS:
+        print(f"Warning: with {method} a block kept under --threshold {args.threshold} may differ from the "
+              f"exact color by more than the threshold; use --threshold 0 for exact output", file=sys.stderr)
+    grid_function = partial(pixelate.compute_grid, method=method,
+                            abdc_strategy=args.abdc_strategy, abdc_clusters=args.abdc_clusters)
+    try:
+        stats = pixelate_video(args.source, args.target, grid_function, args.point_w, args.point_h, args.threshold,
+                               args.width, args.height, args.zoom, (args.bright, args.contrast, args.gamma),
+                               args.fps, args.fourcc, max(1, args.queue), args.frames, args.resample)
+    except (OSError, ValueError) as e:
+        parser.exit(1, f"Error: {e}\n")
+    print(f"Wrote {stats['frames']} frames to {args.target} in {stats['seconds']:.2f}s "
+          f"({stats['fps']:.1f} fps, {stats['recomputed']:.0%} blocks recomputed)")